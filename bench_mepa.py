@@ -0,0 +1,683 @@
+#!/usr/bin/env python3
+"""
+Benchmark do interpretador MEPA/Lua.
+
+Gera programas sintéticos grandes (atribuições aritméticas e alguns
+print) e compara a velocidade, em linhas por segundo, do RUN normal
+(AST + closures) com o RUN VM (compilação para MEPA + máquina virtual).
+
+Com --expr, roda um micro-benchmark das expressões: closures geradas
+pelo parser próprio contra o eval do Python (texto e código compilado).
+
+Com --load N, grava um arquivo de N linhas e mede, cada um em um
+processo separado, o tempo de LOAD e o pico de memória (RSS) do
+carregador mapeado em memória contra o carregador texto original.
+
+Com --loops, mede programas com laço (for, while e GOTO) variando o
+número de voltas e o tamanho do programa (linhas que o laço pula): o
+tempo deve acompanhar as voltas executadas, não o tamanho do programa.
+
+Com --tables, compara uma conta sobre uma tabela inteira feita por um
+laço for (u[i] = t[i] * 2) com a mesma conta vetorizada (u = t * 2).
+
+Com --spec, mede laços cheios de contas (só inteiros, só reais e
+misturados) com e sem a especialização por tipo das linhas (ver
+Interpreter.specialized_ops) e mostra quantas linhas foram
+especializadas e quantas guardas falharam.
+
+Com --reload, altera uma linha no meio de um arquivo e compara o WATCH
+(releitura só do trecho alterado, Interpreter.reload) com um LOAD do
+arquivo inteiro, cada um seguido de RUN.
+
+Com --stats, mede o custo dos contadores do STATS (sempre ligados):
+roda laços e um programa em linha reta e mostra as linhas por segundo
+contadas, o tempo fixo de cada RUN e o de gravar o registro JSON
+(--metrics). Com --stats-compare, roda os mesmos programas, alternando
+as rodadas, em outra versão do mepa.py (por exemplo, uma anterior aos
+contadores: git show <commit>:mepa.py > /tmp/mepa_antigo.py) e mostra
+a diferença de tempo.
+
+Com --suite, mede os comandos do REPL (LOAD, RUN, DEBUG/NEXT até o
+fim, DEBUG/CONT até um breakpoint na última linha, LIST sem paginação,
+DEL de um intervalo, SAVE de uma alteração e SAVE FULL) em programas de
+vários tamanhos, grava os tempos em JSON (--json) e compara com uma
+linha de base salva (--baseline): se alguma métrica piorar mais que
+--threshold, o script termina com código 1. A linha de base depende da
+máquina; gere a sua com --update-baseline.
+
+Uso:
+    python bench_mepa.py [--sizes 10000 100000] [--repeat 3]
+    python bench_mepa.py --expr
+    python bench_mepa.py --load 10000000
+    python bench_mepa.py --loops [--repeat 3]
+    python bench_mepa.py --tables [--repeat 3]
+    python bench_mepa.py --spec [--repeat 3]
+    python bench_mepa.py --reload [--sizes 10000 100000] [--repeat 3]
+    python bench_mepa.py --stats [--stats-compare /tmp/mepa_antigo.py]
+                         [--repeat 3]
+    python bench_mepa.py --suite [--sizes 1000 10000] [--depth 3] [--vars 50]
+                         [--print-every 100] [--json saida.json]
+                         [--baseline base.json [--update-baseline]]
+"""
+
+import argparse
+import contextlib
+import importlib.util
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+
+import mepa
+
+
+def iter_program(n_lines: int, n_vars: int = 50, print_every: int = 100,
+                 seed: int = 1234, depth: int = 1):
+    """
+    Gera (numero_linha, código) para um programa com n_lines linhas
+    numeradas de 10 em 10: atribuições a n_vars variáveis e um print a
+    cada print_every linhas. 'depth' é o aninhamento das expressões
+    (cada nível acrescenta um '(... * k + b - k)'). Os valores ficam
+    limitados com '% 1000' para não crescerem sem fim.
+    """
+    rnd = random.Random(seed)
+    defined = []
+
+    def term(level: int) -> str:
+        a = term(level - 1) if level > 1 else rnd.choice(defined)
+        b = rnd.choice(defined)
+        k = rnd.randint(1, 9)
+        return f"({a} * {k} + {b} - {k})"
+
+    for i in range(n_lines):
+        n = (i + 1) * 10
+        if defined and i % print_every == print_every - 1:
+            yield n, f"print({rnd.choice(defined)})"
+            continue
+        target = f"v{i % n_vars}"
+        if len(defined) < 2:
+            yield n, f"{target} = {rnd.randint(1, 99)}"
+        else:
+            yield n, f"{target} = {term(depth)} % 1000"
+        if target not in defined:
+            defined.append(target)
+
+
+def generate_program(n_lines: int, **kwargs) -> dict:
+    """Programa sintético como dicionário {linha: código}."""
+    return dict(iter_program(n_lines, **kwargs))
+
+
+def write_program(path: str, n_lines: int, **kwargs) -> None:
+    """Grava o programa sintético direto em arquivo, sem montá-lo na memória."""
+    with open(path, "w", encoding="utf-8") as f:
+        for n, code in iter_program(n_lines, **kwargs):
+            f.write(f"{n} {code}\n")
+
+
+def time_run(session: mepa.Interpreter, backend: str, repeat: int) -> float:
+    """Melhor tempo (s) de RUN com o backend pedido, saída descartada."""
+    best = float("inf")
+    with open(os.devnull, "w") as devnull:
+        session.set_output(devnull)
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            session.run(backend)
+            best = min(best, time.perf_counter() - t0)
+        session.set_output(None)
+    return best
+
+
+LOOP_KINDS = ("for", "while", "goto")
+
+
+def loop_program(kind: str, iterations: int, padding: int) -> dict:
+    """
+    Programa com um laço de 'iterations' voltas (três linhas no corpo)
+    seguido de 'padding' linhas que um GOTO pula: o programa fica grande
+    sem que as linhas a mais sejam executadas.
+    """
+    end_line = 1000 + 10 * padding
+    prog = {10: "s = 0", 20: "i = 0"}
+    body = {40: "i = i + 1", 50: "s = s + i % 7", 60: "t = s * 2"}
+    if kind == "for":
+        prog.update({30: f"for k = 1, {iterations} do", **body, 70: "end"})
+    elif kind == "while":
+        prog.update({30: f"while i < {iterations} do", **body, 70: "end"})
+    else:
+        prog.update(body)
+        prog.update({70: f"if i < {iterations} then", 80: "GOTO 40", 90: "end"})
+    prog[100] = f"GOTO {end_line}"
+    for k in range(padding):
+        prog[1000 + 10 * k] = f"x{k % 50} = {k} * 2"
+    prog[end_line] = "print(s)"
+    return prog
+
+
+def bench_loops(repeat: int) -> None:
+    """Tempo por volta do laço para vários tamanhos de laço e de programa."""
+    print(f"{'laço':>6} {'voltas':>8} {'linhas':>8} {'backend':>8} "
+          f"{'tempo (s)':>10} {'ns/volta':>9}")
+    for kind in LOOP_KINDS:
+        for iterations in (10_000, 100_000):
+            for padding in (0, 100_000):
+                session = mepa.Interpreter()
+                session.install(loop_program(kind, iterations, padding))
+                for backend in ("ast", "vm"):
+                    time_run(session, backend, 1)  # aquece os caches
+                    secs = time_run(session, backend, repeat)
+                    print(f"{kind:>6} {iterations:>8} {len(session.program_lines):>8} "
+                          f"{backend:>8} {secs:>10.4f} {secs / iterations * 1e9:>9.0f}")
+
+
+TABLE_REPS = 10
+
+
+def table_program(size: int, kind: str) -> dict:
+    """
+    Monta t = {1..size} e calcula TABLE_REPS vezes u = t * 2, por laço
+    (kind "loop") ou de uma vez ("vector"); "base" só monta t.
+    """
+    prog = {10: f"n = {size}", 20: "t = {}", 30: "for i = 1, n do",
+            40: "t[i] = i", 50: "end", 60: f"for r = 1, {TABLE_REPS} do"}
+    if kind == "vector":
+        prog[70] = "u = t * 2"
+    elif kind == "loop":
+        prog.update({70: "u = {}", 80: "for i = 1, n do", 90: "u[i] = t[i] * 2",
+                     100: "end"})
+    prog[110] = "end"
+    return prog
+
+
+def bench_tables(repeat: int) -> None:
+    """Conta elemento a elemento: laço for x operação sobre a tabela."""
+    print(f"{'elementos':>10} {'backend':>8} {'laço (s)':>10} {'vetor (s)':>10} "
+          f"{'ganho':>8}")
+    for size in (10_000, 100_000):
+        for backend in ("ast", "vm"):
+            secs = {}
+            for kind in ("base", "loop", "vector"):
+                session = mepa.Interpreter()
+                session.install(table_program(size, kind))
+                time_run(session, backend, 1)
+                secs[kind] = time_run(session, backend, repeat)
+            # tempo de uma conta, descontada a montagem de t
+            loop = max(secs["loop"] - secs["base"], 1e-6) / TABLE_REPS
+            vector = max(secs["vector"] - secs["base"], 1e-6) / TABLE_REPS
+            print(f"{size:>10} {backend:>8} {loop:>10.4f} {vector:>10.4f} "
+                  f"{loop / vector:>7.0f}x")
+
+
+SPEC_KINDS = ("int", "float", "mixed", "late")
+
+
+def spec_program(kind: str, iterations: int, body: int) -> dict:
+    """
+    Laço for com 'body' linhas de conta sobre quatro variáveis, todas
+    inteiras ("int"), todas reais ("float"), com uma variável que troca
+    de tipo a cada volta ("mixed": as linhas nem são especializadas) ou
+    que vira real na metade do laço ("late": as guardas falham).
+    """
+    if kind == "float":
+        prog = {10: "a = 1.5", 20: "b = 2.5", 30: "c = 0.5", 40: "d = 3.5"}
+    else:
+        prog = {10: "a = 1", 20: "b = 2", 30: "c = 3", 40: "d = 4"}
+    prog[50] = f"for k = 1, {iterations} do"
+    exprs = ["(a * 3 + b) % 1000", "(b + c * 7 - d) % 997", "(c * c + a - 5) % 991",
+             "(d + a * b) % 983"]
+    for i in range(body):
+        var = "abcd"[i % 4]
+        prog[100 + 10 * i] = f"{var} = {exprs[i % 4]}"
+    line = 100 + 10 * body
+    if kind in ("mixed", "late"):
+        # 'a' vira real (e, nas contas, as outras variáveis também)
+        cond = "k % 2 == 0" if kind == "mixed" else f"k == {iterations // 2}"
+        prog.update({line: f"if {cond} then", line + 10: "a = a + 0.5",
+                     line + 20: "end"})
+        line += 30
+    prog[line] = "end"
+    prog[line + 10] = "print(a + b + c + d)"
+    return prog
+
+
+def bench_spec(repeat: int) -> None:
+    """Laços de contas: caminho genérico x linhas especializadas por tipo."""
+    iterations, body = 50_000, 12
+    print(f"{'tipos':>6} {'genérico (s)':>13} {'especializado (s)':>18} "
+          f"{'ganho':>7} {'linhas esp.':>12} {'deopts':>8}")
+    for kind in SPEC_KINDS:
+        secs = {}
+        for specialize in (False, True):
+            session = mepa.Interpreter(specialize=specialize)
+            session.install(spec_program(kind, iterations, body))
+            time_run(session, "ast", 1)  # aquece (e especializa)
+            secs[specialize] = time_run(session, "ast", repeat)
+        counts = session.cache_stats()["spec"]
+        print(f"{kind:>6} {secs[False]:>13.4f} {secs[True]:>18.4f} "
+              f"{secs[False] / secs[True]:>6.2f}x {counts['specialized']:>12} "
+              f"{counts['deopts']:>8}")
+
+
+def bench_reload(sizes: list, repeat: int) -> None:
+    """
+    WATCH: arquivo alterado no meio (uma linha) e relido por diferença
+    (Interpreter.reload) x LOAD do arquivo inteiro, seguidos de RUN.
+    """
+    print(f"{'linhas':>10} {'LOAD (s)':>9} {'+ RUN (s)':>10} "
+          f"{'reload (s)':>11} {'+ RUN (s)':>10} {'ganho':>7}")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "prog.mepa")
+        for size in sizes:
+            program = generate_program(size, print_every=size)
+            middle = 10 * (size // 2)
+            secs = {}
+            for mode in ("load", "reload"):
+                best = (float("inf"), float("inf"))
+                for k in range(repeat + 1):
+                    # a linha do meio muda a cada rodada
+                    if k == 0:
+                        with open(path, "w", encoding="utf-8") as f:
+                            f.writelines(f"{n} {code}\n" for n, code in program.items())
+                        session = mepa.Interpreter(mepac_mode="off")
+                        session.watch(path)
+                        time_run(session, "ast", 1)
+                        continue
+                    program[middle] = f"v0 = {k}"
+                    with open(path, "w", encoding="utf-8") as f:
+                        f.writelines(f"{n} {code}\n" for n, code in program.items())
+                    t0 = time.perf_counter()
+                    if mode == "load":
+                        session.load(path)
+                    else:
+                        session.reload()
+                    t1 = time.perf_counter()
+                    time_run(session, "ast", 1)
+                    t2 = time.perf_counter()
+                    best = min(best, (t1 - t0, t2 - t1))
+                secs[mode] = best
+            total = {mode: sum(secs[mode]) for mode in secs}
+            print(f"{size:>10} {secs['load'][0]:>9.4f} {secs['load'][1]:>10.4f} "
+                  f"{secs['reload'][0]:>11.4f} {secs['reload'][1]:>10.4f} "
+                  f"{total['load'] / total['reload']:>6.1f}x")
+
+
+def load_module(path: str):
+    """Outra versão do mepa.py, importada de 'path' (para comparar)."""
+    spec = importlib.util.spec_from_file_location("mepa_compare", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def bench_stats(repeat: int, compare: str = None) -> None:
+    """
+    Custo dos contadores do STATS: tempo do RUN e linhas/s contadas em
+    laços e em linha reta; com 'compare', o mesmo RUN na outra versão
+    do mepa.py (as rodadas se alternam, para as duas versões sofrerem
+    igual com a variação da máquina).
+    """
+    modules = {"atual": mepa}
+    if compare:
+        modules["comparado"] = load_module(compare)
+    programs = {kind: loop_program(kind, 100_000, 0) for kind in LOOP_KINDS}
+    programs["spec"] = spec_program("int", 20_000, 12)
+    programs["reta"] = generate_program(100_000, print_every=100_000)
+    programs["pequeno"] = generate_program(10)
+    sessions = {}
+    with open(os.devnull, "w") as devnull:
+        for name, program in programs.items():
+            for label, module in modules.items():
+                # sem checkpoints: o RUN em linha reta roda tudo a cada vez
+                session = module.Interpreter(output=devnull, checkpoint_budget=0)
+                session.install(program)
+                session.run()  # aquece (compila e especializa)
+                sessions[name, label] = session
+        best = {}
+        for _ in range(max(repeat, 5)):
+            for name in programs:
+                # o programa pequeno roda muitas vezes: mede o custo fixo
+                times = 1000 if name == "pequeno" else 1
+                for label in modules:
+                    run = sessions[name, label].run
+                    t0 = time.perf_counter()
+                    for _ in range(times):
+                        run()
+                    secs = (time.perf_counter() - t0) / times
+                    best[name, label] = min(best.get((name, label), secs), secs)
+    header = f"{'programa':>9} {'RUN (s)':>10} {'linhas/s':>12}"
+    if compare:
+        header += f" {'comparado (s)':>14} {'diferença':>10}"
+    print(header)
+    for name in programs:
+        secs = best[name, "atual"]
+        lines = sessions[name, "atual"].stats.last_record()["lines_executed"]
+        row = f"{name:>9} {secs:>10.6f} {lines / secs:>12,.0f}"
+        if compare:
+            other = best[name, "comparado"]
+            row += f" {other:>14.6f} {100 * (secs - other) / other:>+9.1f}%"
+        print(row)
+
+    # --metrics: uma linha JSON acrescentada ao arquivo por RUN
+    session = sessions["pequeno", "atual"]
+    with tempfile.TemporaryDirectory() as tmp:
+        session.metrics_path = os.path.join(tmp, "metrics.jsonl")
+        with contextlib.redirect_stdout(open(os.devnull, "w")):
+            secs = min(timeit.repeat(lambda: mepa.cmd_run(session, quiet=True),
+                                     number=1000, repeat=repeat)) / 1000
+    print(f"RUN do programa pequeno com --metrics: {secs * 1e6:.1f} µs "
+          f"(sem: {best['pequeno', 'atual'] * 1e6:.1f} µs)")
+
+
+def legacy_load(path: str) -> dict:
+    """Carregador texto original do LOAD (uma str por linha em um dict)."""
+    new_program = {}
+    with open(path, "r", encoding="utf-8") as f:
+        for raw_line in f:
+            line = raw_line.rstrip("\n")
+            if not line.strip():
+                continue
+            parts = line.split(maxsplit=1)
+            if len(parts) != 2:
+                print(f"Aviso: linha ignorada (sem número + código): {line}")
+                continue
+            num_str, code = parts
+            num = mepa.parse_int(num_str)
+            if num is None or num < 0:
+                print(f"Aviso: número de linha inválido: {line}")
+                continue
+            new_program[num] = code
+    return new_program
+
+
+def load_worker(loader: str, path: str) -> None:
+    """Roda UM carregador e imprime tempo e pico de RSS em JSON."""
+    t0 = time.perf_counter()
+    if loader == "legacy":
+        program = legacy_load(path)
+    else:
+        program, _warnings = mepa.parse_program_file(path)
+    secs = time.perf_counter() - t0
+    # ru_maxrss é em KiB no Linux
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(json.dumps({"loader": loader, "lines": len(program),
+                      "seconds": secs, "peak_rss_mb": peak}))
+
+
+def bench_load(n_lines: int) -> None:
+    """Compara os carregadores em processos separados (RSS independente)."""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "big.mepa")
+        write_program(path, n_lines)
+        size_mb = os.path.getsize(path) / 1e6
+        print(f"arquivo: {n_lines:,} linhas, {size_mb:.1f} MB")
+        print(f"{'carregador':>10} {'tempo (s)':>10} {'linhas/s':>12} {'pico RSS (MB)':>14}")
+        for loader in ("legacy", "mmap"):
+            out = subprocess.run(
+                [sys.executable, __file__, "--load-worker", loader, path],
+                check=True, capture_output=True, text=True).stdout
+            r = json.loads(out.splitlines()[-1])
+            print(f"{loader:>10} {r['seconds']:>10.2f} "
+                  f"{r['lines'] / r['seconds']:>12,.0f} {r['peak_rss_mb']:>14.0f}")
+
+
+# métricas da suíte, na ordem em que são medidas
+SUITE_METRICS = ("load", "run", "run_warm", "rerun_edit", "debug", "cont",
+                 "list", "del_range", "save", "save_full")
+SUITE_SIZES = [1_000, 10_000, 100_000, 1_000_000]
+
+
+def timed(fn, repeat: int = 1) -> float:
+    """Melhor tempo (s) de 'repeat' chamadas de fn()."""
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def debug_walk(session: mepa.Interpreter) -> None:
+    """DEBUG seguido de NEXT até o fim do programa."""
+    mepa.cmd_debug(session)
+    while session.program_counter is not None:
+        mepa.debug_next(session)
+
+
+def debug_cont(session: mepa.Interpreter) -> None:
+    """DEBUG, BREAK na última linha e CONT até ela (depois até o fim)."""
+    mepa.cmd_debug(session)
+    session.set_breakpoint(session.line_numbers()[-1])
+    mepa.debug_cont(session)
+    mepa.debug_cont(session)
+    session.clear_breakpoints()
+
+
+def suite_size(path: str, repeat: int) -> dict:
+    """Mede os comandos do REPL sobre o programa gravado em 'path'."""
+    # LOAD sem o .mepac: mede a varredura do arquivo
+    session = mepa.Interpreter(mepac_mode="off", checkpoint_budget=0)
+    r = {}
+    r["load"] = timed(lambda: mepa.cmd_load(session, path), repeat)
+    # primeiro RUN inclui a compilação de todas as linhas; sem checkpoints,
+    # os dois RUN executam o programa inteiro
+    session.invalidate_changed_lines({})
+    r["run"] = timed(lambda: mepa.cmd_run(session))
+    r["run_warm"] = timed(lambda: mepa.cmd_run(session), repeat)
+    # RUN incremental depois de editar (INS) uma linha perto do fim
+    session.checkpoints.budget = mepa.DEFAULT_CHECKPOINT_BUDGET
+    mepa.cmd_run(session)
+    last = session.line_numbers()[-1]
+    code = session.program_lines[last]
+    r["rerun_edit"] = timed(lambda: (session.ins(last, code),
+                                     mepa.cmd_run(session)), repeat)
+    session.checkpoints.budget = 0
+    r["debug"] = timed(lambda: debug_walk(session), repeat)
+    r["cont"] = timed(lambda: debug_cont(session), repeat)
+    r["list"] = timed(lambda: mepa.cmd_list(session, None), repeat)
+    # DEL da metade do meio do programa (só dá para medir uma vez)
+    nums = session.line_numbers()
+    start, end = nums[len(nums) // 4], nums[3 * len(nums) // 4]
+    r["del_range"] = timed(lambda: mepa.cmd_del_range(session, start, end))
+    # SAVE de uma linha alterada (vai para o diário) e SAVE FULL
+    r["save"] = timed(lambda: (session.ins(last, code), mepa.cmd_save(session)),
+                      repeat)
+    r["save_full"] = timed(lambda: mepa.cmd_save(session, full=True), repeat)
+    return r
+
+
+def bench_suite(sizes: list, repeat: int, **program) -> dict:
+    """Roda a suíte em cada tamanho; devolve o relatório (para o JSON)."""
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp, open(os.devnull, "w") as devnull:
+        for size in sizes:
+            path = os.path.join(tmp, f"bench_{size}.mepa")
+            write_program(path, size, **program)
+            # mensagens do REPL e saída do programa vão para o devnull
+            with contextlib.redirect_stdout(devnull):
+                results[str(size)] = suite_size(path, repeat)
+            print(f"{size:>10} " + " ".join(
+                f"{results[str(size)][m]:>9.4f}" for m in SUITE_METRICS))
+    return {
+        "meta": {"python": platform.python_version(),
+                 "machine": platform.machine(), "repeat": repeat,
+                 "program": program},
+        "results": results,
+    }
+
+
+def compare_baseline(report: dict, baseline: dict, threshold: float,
+                     min_delta: float) -> list:
+    """
+    Métricas que pioraram mais que 'threshold' (fração) em relação à
+    linha de base; diferenças menores que min_delta segundos são ruído.
+    """
+    if baseline.get("meta", {}).get("program") != report["meta"]["program"]:
+        print("Aviso: a linha de base foi gerada com outros parâmetros de programa.",
+              file=sys.stderr)
+    regressions = []
+    for size, metrics in report["results"].items():
+        base = baseline.get("results", {}).get(size, {})
+        for name, secs in metrics.items():
+            old = base.get(name)
+            if old is None:
+                continue
+            if secs > old * (1 + threshold) and secs - old > min_delta:
+                regressions.append(f"{size} linhas, {name}: {old:.4f}s -> "
+                                   f"{secs:.4f}s (+{(secs / old - 1) * 100:.0f}%)")
+    return regressions
+
+
+def run_suite(opts) -> int:
+    """--suite: mede, grava o JSON e verifica a linha de base."""
+    program = {"n_vars": opts.vars, "print_every": opts.print_every,
+               "depth": opts.depth}
+    print(f"{'linhas':>10} " + " ".join(f"{m:>9}" for m in SUITE_METRICS))
+    report = bench_suite(opts.sizes or SUITE_SIZES, opts.repeat, **program)
+    if opts.json:
+        with open(opts.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    if not opts.baseline:
+        return 0
+    if opts.update_baseline or not os.path.exists(opts.baseline):
+        with open(opts.baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Linha de base gravada em '{opts.baseline}'.")
+        return 0
+    with open(opts.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    regressions = compare_baseline(report, baseline, opts.threshold,
+                                   opts.min_delta)
+    for line in regressions:
+        print(f"REGRESSÃO: {line}")
+    if regressions:
+        return 1
+    print(f"Sem regressões acima de {opts.threshold:.0%} em relação a "
+          f"'{opts.baseline}'.")
+    return 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", type=int, nargs="+")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--expr", action="store_true",
+                        help="micro-benchmark de expressões (closure x eval)")
+    parser.add_argument("--load", type=int, metavar="LINHAS",
+                        help="compara os carregadores de arquivo (LOAD)")
+    parser.add_argument("--loops", action="store_true",
+                        help="laços: custo por volta x tamanho do programa")
+    parser.add_argument("--tables", action="store_true",
+                        help="tabelas: laço for x conta vetorizada")
+    parser.add_argument("--spec", action="store_true",
+                        help="contas em laços: genérico x especializado por tipo")
+    parser.add_argument("--reload", action="store_true",
+                        help="WATCH: releitura por diferença x LOAD inteiro")
+    parser.add_argument("--stats", action="store_true",
+                        help="custo dos contadores do STATS")
+    parser.add_argument("--stats-compare", metavar="MEPA.PY",
+                        help="compara o --stats com outra versão do mepa.py")
+    parser.add_argument("--load-worker", nargs=2, metavar=("CARREGADOR", "ARQ"),
+                        help=argparse.SUPPRESS)
+    suite = parser.add_argument_group("suíte (--suite)")
+    suite.add_argument("--suite", action="store_true",
+                       help="mede LOAD, RUN, DEBUG, CONT, LIST, DEL e SAVE")
+    suite.add_argument("--depth", type=int, default=1,
+                       help="aninhamento das expressões geradas")
+    suite.add_argument("--vars", type=int, default=50,
+                       help="número de variáveis do programa gerado")
+    suite.add_argument("--print-every", type=int, default=100,
+                       help="um print a cada N linhas")
+    suite.add_argument("--json", metavar="ARQ", help="grava os tempos em JSON")
+    suite.add_argument("--baseline", metavar="ARQ",
+                       help="linha de base para detectar regressões")
+    suite.add_argument("--update-baseline", action="store_true",
+                       help="regrava a linha de base com os tempos medidos")
+    suite.add_argument("--threshold", type=float, default=0.25,
+                       help="piora tolerada (fração, padrão 0.25 = 25%%)")
+    suite.add_argument("--min-delta", type=float, default=0.005,
+                       help="diferença mínima (s) para contar como regressão")
+    opts = parser.parse_args()
+
+    if opts.load_worker:
+        load_worker(*opts.load_worker)
+        return 0
+    if opts.load:
+        bench_load(opts.load)
+        return 0
+    if opts.expr:
+        bench_expressions(200_000)
+        return 0
+    if opts.loops:
+        bench_loops(opts.repeat)
+        return 0
+    if opts.tables:
+        bench_tables(opts.repeat)
+        return 0
+    if opts.spec:
+        bench_spec(opts.repeat)
+        return 0
+    if opts.reload:
+        bench_reload(opts.sizes or [10_000, 100_000, 1_000_000], opts.repeat)
+        return 0
+    if opts.stats:
+        bench_stats(opts.repeat, opts.stats_compare)
+        return 0
+    if opts.suite:
+        return run_suite(opts)
+
+    print(f"{'linhas':>10} {'backend':>8} {'tempo (s)':>10} {'linhas/s':>12}")
+    for size in opts.sizes or [10_000, 100_000]:
+        session = mepa.Interpreter()
+        session.install(generate_program(size))
+        # primeira execução aquece os caches de compilação
+        results = {}
+        for backend in ("ast", "vm"):
+            time_run(session, backend, 1)
+            results[backend] = time_run(session, backend, opts.repeat)
+            secs = results[backend]
+            print(f"{size:>10} {backend:>8} {secs:>10.4f} {size / secs:>12,.0f}")
+        print(f"{'':>10} {'vm/ast':>8} {results['ast'] / results['vm']:>10.2f}x")
+    return 0
+
+
+# expressões válidas tanto na mini-Lua quanto em Python (mesmo resultado)
+EXPR_CASES = [
+    "a",
+    "a + 1",
+    "a * b + c - 2",
+    "(a * 3 + c - 3) % 1000",
+    "-(a + b) * (c - a) // 2",
+    "2 * 3 + 4 * 5 - a",
+]
+
+
+def bench_expressions(number: int) -> None:
+    """
+    Tempo médio (ns) por avaliação: eval(texto), eval(código) e a
+    closure da mini-Lua (variáveis em slots da sessão).
+    """
+    env = {"a": 3, "b": 4.5, "c": 7}
+    session = mepa.Interpreter()
+    for name, value in env.items():
+        session.memory[session.slot_of(name)] = value
+    mem = session.memory
+    print(f"{'expressão':<28} {'eval(str)':>10} {'eval(code)':>11} {'closure':>9}")
+    for expr in EXPR_CASES:
+        code = compile(expr, "<string>", "eval")
+        fn = mepa.compile_expression(expr, session.slot_of)[1]
+        assert fn(mem) == eval(code, {}, env), expr
+        t_str = timeit.timeit(lambda: eval(expr, {}, env), number=number)
+        t_code = timeit.timeit(lambda: eval(code, {}, env), number=number)
+        t_fn = timeit.timeit(lambda: fn(mem), number=number)
+        print(f"{expr:<28} {t_str / number * 1e9:>10.0f} "
+              f"{t_code / number * 1e9:>11.0f} {t_fn / number * 1e9:>9.0f}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+"""
+Teste diferencial do interpretador MEPA/Lua.
+
+Roda os mesmos programas no RUN normal (AST + closures), no RUN OPT
+(programa otimizado, ver optimize_flow) e no RUN VM (máquina MEPA) e
+confere se a saída, o erro (linha e mensagem) e as variáveis no fim
+(STACK) são iguais nos três.
+
+Há dois grupos de programas:
+
+- casos fixos de ordem de avaliação com variáveis não atribuídas: o
+  erro tem de citar a primeira variável, da esquerda para a direita,
+  como na VM;
+- programas aleatórios (--programs, com --seed para repetir): contas
+  com inteiros, reais, strings e nil, if/elseif/else, while, for,
+  GOTO para a frente, tabelas e, de vez em quando, uma linha com erro
+  de sintaxe ou um bloco mal fechado.
+
+Termina com código 1 se algum programa divergir e mostra os primeiros
+(--show) com o resultado de cada backend.
+
+Uso:
+    python check_mepa.py [--programs 500] [--seed 1] [--show 3]
+"""
+
+import argparse
+import io
+import random
+import sys
+
+import mepa
+
+BACKENDS = ("ast", "opt", "vm")
+
+# expressões com variáveis não atribuídas (a, c) e erros em outros pontos
+ERROR_ORDER_CASES = [
+    "a + c / a",
+    "c + nil * 1 * -2",
+    "a .. c .. a",
+    "a < c + 1",
+    "(a + 1) * (c + 2)",
+    "a ^ (c + 1)",
+    "a + #c",
+    "a == c + 1",
+    "1 + a * c",
+    "a % (1 // c)",
+    "-a + c",
+]
+
+VARS = "abcde"
+INITIAL_VALUES = ("1", "2", "3", "-1", "0", "0.5", "2.5", "'4'")
+
+
+def run_backend(program: dict, backend: str) -> tuple:
+    """(saída, erro, STACK) do programa em uma sessão nova."""
+    session = mepa.Interpreter(mepac_mode="off", checkpoint_budget=0)
+    out = io.StringIO()
+    session.set_output(out)
+    session.install(program)
+    try:
+        error = session.run(backend)
+    except Exception as e:  # falha do próprio interpretador
+        return out.getvalue(), f"exceção {type(e).__name__}: {e}", []
+    # tabelas (LuaTable) são comparadas pelo conteúdo, como no STACK
+    return out.getvalue(), error, [(name, repr(value))
+                                   for name, value in session.stack()]
+
+
+def check(name: str, program: dict, show: bool) -> bool:
+    results = [(backend, run_backend(program, backend)) for backend in BACKENDS]
+    first = results[0][1]
+    ok = all(result == first for _backend, result in results[1:])
+    if not ok and show:
+        print(f"DIVERGÊNCIA em {name}:")
+        for number, code in sorted(program.items()):
+            print(f"  {number} {code}")
+        for backend, (out, error, stack) in results:
+            print(f"  RUN {backend}: saída {out!r}, erro {error!r}, "
+                  f"STACK {stack}")
+    return ok
+
+
+class ProgramGenerator:
+    """Programas aleatórios pequenos, quase sempre bem formados e finitos."""
+
+    __slots__ = ("rng", "lines", "counters", "targets")
+
+    def __init__(self, rng: random.Random) -> None:
+        self.rng = rng
+        self.lines: list = []
+        self.counters = 0  # variáveis de controle dos laços (n1, n2, ...)
+        # linhas que começam um comando fora de blocos: os únicos destinos
+        # de GOTO (um GOTO para o 'end' de um while pularia o contador)
+        self.targets: list = []
+
+    def operand(self, mixed: bool) -> str:
+        rng = self.rng
+        k = rng.random()
+        if k < 0.5:
+            return rng.choice(VARS)
+        if k < 0.8:
+            return str(rng.randint(-3, 9))
+        if k < 0.9 or not mixed:
+            return rng.choice(("0.5", "2.0", "1e3", "-1.5", "t[1]", "#t"))
+        if k < 0.95:
+            return rng.choice(("'ab'", "'3'", '"x y"'))
+        return rng.choice(("nil", "t[a]", "true"))
+
+    def expr(self, depth: int = 0, mixed: bool = False) -> str:
+        """
+        Expressão aleatória. Sem 'mixed', só contas entre números (o
+        programa costuma ir até o fim); com 'mixed', aparecem strings,
+        nil, comparações e lógicos no meio das contas (e seus erros).
+        """
+        rng = self.rng
+        if depth == 0 and rng.random() < 0.1:
+            mixed = True
+        if depth > 2 or rng.random() < 0.3:
+            return self.operand(mixed)
+        k = rng.random() if mixed else rng.random() * 0.55
+        left, right = self.expr(depth + 1, mixed), self.expr(depth + 1, mixed)
+        if k < 0.4:
+            op = rng.choice(("+", "-", "*", "+", "-", "*"))
+        elif k < 0.55:
+            op = rng.choice(("/", "//", "%", "^", "..") if mixed else ("/", "+"))
+        elif k < 0.8:
+            op = rng.choice(("==", "~=", "<", "<=", ">", ">="))
+        elif k < 0.9:
+            op = rng.choice(("and", "or"))
+        else:
+            return rng.choice(("-", "not ", "#")) + f"({left})"
+        return f"({left} {op} {right})" if depth else f"{left} {op} {right}"
+
+    def condition(self) -> str:
+        rng = self.rng
+        if rng.random() < 0.7:
+            return (f"{rng.choice(VARS)} {rng.choice(('<', '>', '==', '~='))} "
+                    f"{rng.randint(-2, 6)}")
+        return f"{self.expr()} {rng.choice(('<', '>=', '~='))} {self.expr()}"
+
+    def block(self, depth: int, size: int) -> None:
+        for _ in range(size):
+            self.statement(depth)
+
+    def statement(self, depth: int) -> None:
+        rng = self.rng
+        add = self.lines.append
+        if depth == 0:
+            self.targets.append(len(self.lines))
+        k = rng.random()
+        if depth > 2:
+            k *= 0.55  # sem blocos novos
+        if k < 0.3:
+            add(f"{rng.choice(VARS)} = {self.expr()}")
+        elif k < 0.38:
+            add(f"print({self.expr()})")
+        elif k < 0.43:
+            add(rng.choice(("t = {1, 2, 3}", "t = {}", "t = {0.5, 'x'}",
+                            f"t[{rng.randint(1, 4)}] = {self.expr()}",
+                            f"t = t * {rng.randint(1, 3)}")))
+        elif k < 0.47:
+            add(f"{rng.choice(VARS)} = {rng.choice(VARS)} + 1")
+        elif k < 0.505:
+            add("GOTO *")  # destino (mais à frente) escolhido em program()
+        elif k < 0.515:
+            # 'end' sobrando só fora de blocos: dentro de um while, ele
+            # fecharia o laço antes do contador
+            add(rng.choice(("x = = 1", "print(", "y = 1 +", "else")
+                           + (("end",) if depth == 0 else ())))
+        elif k < 0.55:
+            add(f"local {rng.choice(VARS)} = {self.expr()}")
+        elif k < 0.7:
+            add(f"if {self.condition()} then")
+            self.block(depth + 1, rng.randint(1, 3))
+            for _ in range(rng.randint(0, 2)):
+                add(f"elseif {self.condition()} then")
+                self.block(depth + 1, rng.randint(1, 2))
+            if rng.random() < 0.5:
+                add("else")
+                self.block(depth + 1, rng.randint(1, 2))
+            add("end")
+        elif k < 0.85:
+            self.counters += 1
+            n = f"n{self.counters}"
+            add(f"for {n} = {rng.randint(-1, 2)}, {rng.randint(0, 4)}"
+                + (f", {rng.choice((1, 2, -1))} do" if rng.random() < 0.3
+                   else " do"))
+            self.block(depth + 1, rng.randint(1, 3))
+            add("end")
+        else:
+            # contador próprio: o corpo não o altera, o laço sempre termina
+            self.counters += 1
+            n = f"n{self.counters}"
+            add(f"{n} = 0")
+            add(f"while {n} < {rng.randint(0, 4)} do")
+            self.block(depth + 1, rng.randint(1, 3))
+            add(f"{n} = {n} + 1")
+            add("end")
+        if rng.random() < 0.005:
+            self.lines.pop()  # bloco sem 'end' ou linha perdida
+
+    def program(self) -> dict:
+        rng = self.rng
+        self.lines = []
+        self.targets = []
+        self.counters = 0
+        # valores iniciais (às vezes falta um: erro de variável não atribuída)
+        for name in VARS:
+            if rng.random() < 0.97:
+                self.lines.append(f"{name} = {rng.choice(INITIAL_VALUES)}")
+        self.lines.append("t = {1, 2, 3}")
+        self.block(0, rng.randint(1, 12))
+        program = {}
+        end = 10 * (len(self.lines) + 1)  # GOTO para depois da última linha
+        for i, code in enumerate(self.lines):
+            if code == "GOTO *":
+                later = [10 * (t + 1) for t in self.targets if t > i]
+                code = f"GOTO {rng.choice(later + [end])}"
+            program[10 * (i + 1)] = code
+        return program
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--programs", type=int, default=500,
+                        help="programas aleatórios")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--show", type=int, default=3,
+                        help="divergências mostradas por completo")
+    opts = parser.parse_args()
+
+    failed = 0
+    for expr in ERROR_ORDER_CASES:
+        program = {10: "x = 1", 20: f"y = {expr}", 30: "print(x)"}
+        failed += not check(repr(expr), program, failed < opts.show)
+    print(f"{len(ERROR_ORDER_CASES)} caso(s) de ordem de avaliação, "
+          f"{failed} divergência(s)")
+
+    generator = ProgramGenerator(random.Random(opts.seed))
+    random_failed = 0
+    for i in range(opts.programs):
+        program = generator.program()
+        ok = check(f"programa {i} (--seed {opts.seed})", program,
+                   failed + random_failed < opts.show)
+        random_failed += not ok
+    print(f"{opts.programs} programa(s) aleatório(s), "
+          f"{random_failed} divergência(s)")
+    return 1 if failed or random_failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""
+Teste de carga do servidor MEPA/Lua (python mepa.py serve ...).
+
+Abre --clients conexões ao mesmo tempo; cada uma monta um programa
+pequeno com INS e repete --requests vezes um INS (alterando uma linha)
+seguido de RUN, medindo o tempo de resposta de cada pedido. Com
+--slow N, outras N conexões ficam rodando um laço infinito (que o
+servidor interrompe pelo tempo limite): os tempos das demais não devem
+piorar, porque o RUN roda no pool de processos do servidor.
+
+Sem --socket/--port, o script inicia o próprio servidor (socket Unix
+temporário, --workers processos). Com --compare-spawn, mede também o
+jeito antigo: um 'python mepa.py run arquivo' por pedido.
+
+Uso:
+    python loadtest_mepa.py [--clients 20] [--requests 50] [--lines 20]
+                            [--slow 2] [--workers 4] [--compare-spawn]
+    python loadtest_mepa.py --socket /tmp/mepa.sock [--clients 20]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+MEPA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "mepa.py")
+
+
+class AsyncClient:
+    """Conexão assíncrona mínima com o servidor (um pedido por vez)."""
+
+    __slots__ = ("reader", "writer")
+
+    async def connect(self, socket_path, host, port) -> "AsyncClient":
+        if socket_path is not None:
+            self.reader, self.writer = await asyncio.open_unix_connection(
+                socket_path, limit=16 * 1024 * 1024)
+        else:
+            self.reader, self.writer = await asyncio.open_connection(
+                host, port, limit=16 * 1024 * 1024)
+        return self
+
+    async def request(self, cmd: str, timeout=None) -> dict:
+        message = {"cmd": cmd}
+        if timeout is not None:
+            message["timeout"] = timeout
+        self.writer.write(json.dumps(message).encode() + b"\n")
+        await self.writer.drain()
+        return json.loads(await self.reader.readline())
+
+    async def close(self) -> None:
+        self.writer.close()
+        await self.writer.wait_closed()
+
+
+def program_lines(n_lines: int, seed: int) -> list:
+    """Programa de teste: contas encadeadas e um print no fim."""
+    lines = [f"INS 10 x = {seed}"]
+    for i in range(1, n_lines - 1):
+        lines.append(f"INS {10 * (i + 1)} x = (x * 3 + {i}) % 1000")
+    lines.append(f"INS {10 * n_lines} print(x)")
+    return lines
+
+
+async def client_job(address, n_lines: int, requests: int, seed: int,
+                     latencies: list, failures: list) -> None:
+    client = await AsyncClient().connect(*address)
+    try:
+        for cmd in program_lines(n_lines, seed):
+            await client.request(cmd)
+        for i in range(requests):
+            for cmd in (f"INS 10 x = {seed + i}", "RUN"):
+                t0 = time.perf_counter()
+                reply = await client.request(cmd)
+                latencies.append(time.perf_counter() - t0)
+                if not reply.get("ok"):
+                    failures.append(reply.get("error"))
+    finally:
+        await client.close()
+
+
+async def slow_job(address, stop: asyncio.Event, timeout: float) -> int:
+    """Roda um laço infinito até 'stop'; devolve quantos RUN expiraram."""
+    client = await AsyncClient().connect(*address)
+    expired = 0
+    try:
+        await client.request("INS 10 x = 0")
+        await client.request("INS 20 while true do")
+        await client.request("INS 30 x = x + 1")
+        await client.request("INS 40 end")
+        while not stop.is_set():
+            reply = await client.request("RUN", timeout)
+            expired += bool(reply.get("timeout"))
+    finally:
+        await client.close()
+    return expired
+
+
+def percentile(values: list, p: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+
+
+def report(name: str, latencies: list, elapsed: float) -> None:
+    ms = [v * 1000 for v in latencies]
+    print(f"{name}: {len(ms)} pedidos em {elapsed:.2f}s "
+          f"({len(ms) / elapsed:,.0f} pedidos/s)")
+    print(f"  latência (ms): média {statistics.mean(ms):.2f}  "
+          f"p50 {percentile(ms, 50):.2f}  p95 {percentile(ms, 95):.2f}  "
+          f"p99 {percentile(ms, 99):.2f}  máx {max(ms):.2f}")
+
+
+async def load_test(address, opts) -> int:
+    latencies: list = []
+    failures: list = []
+    stop = asyncio.Event()
+    slow = [asyncio.create_task(slow_job(address, stop, opts.slow_timeout))
+            for _ in range(opts.slow)]
+    t0 = time.perf_counter()
+    await asyncio.gather(*(client_job(address, opts.lines, opts.requests, seed,
+                                      latencies, failures)
+                           for seed in range(opts.clients)))
+    elapsed = time.perf_counter() - t0
+    stop.set()
+    expired = sum(await asyncio.gather(*slow))
+    report(f"{opts.clients} cliente(s), {opts.slow} lento(s)", latencies, elapsed)
+    if opts.slow:
+        print(f"  RUN interrompidos pelo tempo limite (clientes lentos): {expired}")
+    if failures:
+        print(f"  {len(failures)} pedido(s) com erro, ex.: {failures[0]}")
+        return 1
+    return 0
+
+
+def compare_spawn(n_lines: int, samples: int) -> None:
+    """Um processo 'python mepa.py run' por pedido, como antes do servidor."""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "prog.mepa")
+        with open(path, "w", encoding="utf-8") as f:
+            for cmd in program_lines(n_lines, 1):
+                f.write(cmd[len("INS "):] + "\n")
+        latencies = []
+        t0 = time.perf_counter()
+        for _ in range(samples):
+            t1 = time.perf_counter()
+            subprocess.run([sys.executable, MEPA, "run", "--no-cache", path],
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                           check=True)
+            latencies.append(time.perf_counter() - t1)
+        report("um processo por RUN (python mepa.py run)", latencies,
+               time.perf_counter() - t0)
+
+
+def start_server(socket_path: str, workers: int, timeout: float):
+    """Inicia 'python mepa.py serve' e espera o socket aparecer."""
+    server = subprocess.Popen([sys.executable, MEPA, "serve", "--socket",
+                               socket_path, "--workers", str(workers),
+                               "--timeout", str(timeout)],
+                              stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 30
+    while not os.path.exists(socket_path):
+        if server.poll() is not None or time.monotonic() > deadline:
+            raise RuntimeError("o servidor não iniciou")
+        time.sleep(0.05)
+    return server
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--socket", metavar="CAMINHO")
+    parser.add_argument("--port", type=int)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--clients", type=int, default=20)
+    parser.add_argument("--requests", type=int, default=50,
+                        help="pares INS + RUN por cliente")
+    parser.add_argument("--lines", type=int, default=20,
+                        help="linhas do programa de cada cliente")
+    parser.add_argument("--slow", type=int, default=0,
+                        help="clientes rodando um laço infinito")
+    parser.add_argument("--slow-timeout", type=float, default=1.0,
+                        help="tempo limite pedido pelos clientes lentos")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="processos do servidor iniciado pelo script")
+    parser.add_argument("--compare-spawn", action="store_true",
+                        help="mede também um processo por pedido")
+    opts = parser.parse_args()
+
+    server = None
+    tmp = None
+    if opts.socket is None and opts.port is None:
+        tmp = tempfile.TemporaryDirectory()
+        opts.socket = os.path.join(tmp.name, "mepa.sock")
+        server = start_server(opts.socket, opts.workers, 30.0)
+    address = (opts.socket, opts.host, opts.port)
+    try:
+        status = asyncio.run(load_test(address, opts))
+        if opts.compare_spawn:
+            compare_spawn(opts.lines, 20)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+            tmp.cleanup()
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
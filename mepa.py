@@ -11,100 +11,4969 @@ Integrantes do Grupo:
 
 Divisorias principais do interpretador MEPA 
 
-1) ESTADO GLOBAL DO INTERPRETADOR
-   - Variáveis que representam o programa carregado, arquivo atual,
-     modo debug, contador de linha e memória de variáveis.
+1) ESTRUTURAS DE DADOS DO INTERPRETADOR
+   - Programa em memória (ProgramStore), instruções do cache em disco
+     (PrecompiledLines), saída com buffer dos print (OutputSink),
+     checkpoints do RUN incremental (RunCheckpoints), histórico do
+     DEBUG para BACK / STEP (DebugTrace) e alterações do SAVE
+     incremental (EditJournal).
 
 2) FUNÇÕES UTILITÁRIAS
-   - Funções auxiliares para lidar com entrada do usuário, controle de
-     alterações não salvas e ordenação de linhas.
+   - Funções auxiliares para lidar com entrada do usuário e conversão
+     de números.
 
-3) COMANDOS DO REPL (LOAD, LIST, INS, DEL, SAVE)
-   - Conjunto de funções que manipulam o código-fonte em memória
-     e fazem leitura/gravação em arquivo.
+3) ARQUIVOS DE PROGRAMA (.mepa E .mepac)
+   - Leitura e gravação dos arquivos de código numerado, do diário do
+     SAVE incremental e do cache compilado em disco.
 
-4) INTERPRETADOR mini-Lua
-   - Funções responsáveis por executar UMA linha da linguagem
-     (atribuições e print) e por percorrer o programa sequencialmente.
+4) EXPRESSÕES
+   - Parser próprio (tokens + precedência) que gera uma AST compacta,
+     dobra constantes e produz closures para avaliar as expressões
+     (e versões especializadas por tipo das linhas de conta).
 
-5) MODO DEBUG (DEBUG, NEXT, STACK, STOP)
-   - Controle de execução passo a passo, mantendo um program_counter
-     e exibindo o estado das variáveis.
+5) INTERPRETADOR mini-Lua
+   - Classe Interpreter: uma sessão com todo o estado (programa,
+     arquivo atual, variáveis, DEBUG, caches) e os comandos como
+     métodos que devolvem valores, sem imprimir nada.
 
-6) LOOP PRINCIPAL (REPL)
+6) BACKEND MEPA (COMPILE/ASM, RUN VM)
+   - Compilador das linhas mini-Lua para instruções MEPA (CRCT, CRVL,
+     ARMZ, SOMA, ...) e máquina virtual de pilha que as executa.
+
+7) COMANDOS DO REPL (LOAD, LIST, INS, DEL, SAVE, RUN, DEBUG, ...)
+   - Apresentação: chamam os métodos da sessão e mostram os
+     resultados e mensagens na tela.
+
+8) LOOP PRINCIPAL (REPL)
    - Laço que lê comandos do usuário, interpreta e chama as funções
-     acima, exibindo um prompt interativo.
+     acima, exibindo um prompt interativo (ou, em modo script, sem
+     prompt nem confirmações).
+
+9) MODO LOTE (python mepa.py run ...)
+   - Executa vários arquivos .mepa em paralelo, sem o REPL.
+
+10) MODO SERVIDOR (python mepa.py serve ...)
+   - Atende outros programas por socket (JSON por linha), com uma
+     sessão por conexão e o RUN num pool de processos.
 """
 
-import os
-import sys
-from typing import Dict, Optional, Tuple
+import argparse
+import asyncio
+import contextlib
+import copy
+import csv
+import gc
+import hashlib
+import io
+import json
+import marshal
+import math
+import mmap
+import os
+import re
+import sys
+import time
+import types
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import deque
+from itertools import accumulate, chain, compress, islice, repeat
+from operator import (add, and_, floordiv, is_ as operator_is,
+                      is_not as operator_is_not, itemgetter, lt, mod, mul, neg,
+                      sub, truediv)
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import (Callable, Deque, Dict, Iterable, Iterator, List, Optional,
+                    Tuple)
+
+
+# =====================================================================
+# 1. ESTRUTURAS DE DADOS DO INTERPRETADOR
+# =====================================================================
+# Classes usadas por uma sessão do interpretador (Interpreter, seção 5):
+# - ProgramStore: o código do programa em memória (numero_linha -> código),
+# - PrecompiledLines: instruções vindas do cache em disco (.mepac),
+# - OutputSink: destino, com buffer, da saída dos print do programa,
+# - RunCheckpoints: estados salvos no meio do RUN, para o RUN seguinte
+#   a uma alteração recomeçar perto dela,
+# - SessionStats: contadores e tempos da sessão (STATS e --metrics).
+# Não há estado global: o arquivo atual, as alterações não salvas, as
+# variáveis, o DEBUG e os caches pertencem a cada Interpreter.
+# =====================================================================
+
+# a cada quantos bytes de texto novo o ProgramStore confere se vale
+# compactar _text (linhas alteradas/removidas deixam bytes sem uso)
+TEXT_COMPACT_MIN = 1024 * 1024
+# máximo de textos distintos lembrados para reaproveitar (interning);
+# cheio, o dicionário recomeça do zero
+INTERN_LIMIT = 4096
+
+
+class ProgramStore:
+    """
+    Programa em memória: mapeia numero_linha -> "código" e mantém os
+    números de linha SEMPRE ordenados (array compacto de inteiros).
+
+    Assim ninguém precisa reordenar o programa inteiro:
+      - inserir/remover uma linha: busca binária (bisect);
+      - próxima linha a partir de uma posição conhecida: O(1);
+      - remover um intervalo: só toca nas k linhas removidas.
+
+    Não há um objeto str por linha. O texto de cada linha é um trecho
+    (início, tamanho) de um de dois blocos de bytes UTF-8:
+      - _buf, o conteúdo do arquivo lido pelo LOAD (início >= 0);
+      - _text, bloco próprio com as linhas inseridas/alteradas pelo
+        usuário (início < 0: o trecho começa em _text[-início - 1]).
+    O texto só é decodificado quando a linha é pedida (LIST, INS,
+    compilação...). Linhas repetidas ("end", "x = x + 1"...) apontam
+    para o mesmo trecho de _text (interning, ver _intern); os bytes que
+    deixam de ser usados são recuperados de tempos em tempos (_compact).
+    """
+
+    __slots__ = ("_nums", "_starts", "_lens", "_buf", "_text", "_intern",
+                 "_compact_at")
+
+    def __init__(self, lines: Optional[Dict[int, str]] = None) -> None:
+        self._nums = array("q")
+        self._starts = array("q")
+        self._lens = array("L")
+        self._buf = None
+        self._text = bytearray()
+        # texto -> (início, tamanho) já gravado em _text
+        self._intern: Dict[str, Tuple[int, int]] = {}
+        self._compact_at = TEXT_COMPACT_MIN
+        if lines:
+            self.update(lines)
+
+    @classmethod
+    def from_buffer(cls, buf, nums: "array", starts: "array",
+                    lens: "array") -> "ProgramStore":
+        """Cria o programa a partir de trechos de 'buf' (já ordenados)."""
+        store = cls()
+        store._nums, store._starts, store._lens = nums, starts, lens
+        store._buf = buf
+        return store
+
+    def __len__(self) -> int:
+        return len(self._nums)
+
+    def _index(self, line_no: int) -> int:
+        """Posição de line_no em _nums, ou -1 se não existir."""
+        nums = self._nums
+        i = bisect_left(nums, line_no)
+        if i < len(nums) and nums[i] == line_no:
+            return i
+        return -1
+
+    def _text_at(self, i: int) -> str:
+        start = self._starts[i]
+        if start < 0:
+            start = -start - 1
+            return self._text[start:start + self._lens[i]].decode("utf-8")
+        return self._buf[start:start + self._lens[i]].decode("utf-8", "replace")
+
+    def _put(self, code: str) -> Tuple[int, int]:
+        """Grava 'code' em _text (ou reaproveita) e devolve (início, tamanho)."""
+        intern = self._intern
+        slot = intern.get(code)
+        if slot is None:
+            raw = code.encode("utf-8")
+            slot = (-len(self._text) - 1, len(raw))
+            self._text += raw
+            if len(intern) >= INTERN_LIMIT:
+                intern.clear()
+            intern[code] = slot
+        return slot
+
+    def _put_many(self, codes: List[str]) -> List[Tuple[int, int]]:
+        """
+        _put de muitas linhas de uma vez (PASTE): os textos ainda não
+        gravados são codificados juntos e as posições saem de somas
+        acumuladas, sem laço Python por linha.
+        """
+        intern = self._intern
+        slots = dict.fromkeys(codes)
+        known = list(slots.keys() & intern.keys())
+        slots.update(zip(known, map(intern.__getitem__, known)))
+        fresh = list(slots.keys() - intern.keys())
+        if fresh:
+            joined = "".join(fresh)
+            raw = joined.encode("utf-8")
+            if len(raw) == len(joined):  # só ASCII: 1 byte por caractere
+                sizes = list(map(len, fresh))
+            else:
+                sizes = list(map(len, map(str.encode, fresh)))
+            offsets = accumulate(sizes, initial=len(self._text) + 1)
+            new_slots = list(zip(map(neg, offsets), sizes))
+            self._text += raw
+            slots.update(zip(fresh, new_slots))
+            if len(intern) + len(fresh) > INTERN_LIMIT:
+                intern.clear()
+            intern.update(islice(zip(fresh, new_slots),
+                                 INTERN_LIMIT - len(intern)))
+        return list(map(slots.__getitem__, codes))
+
+    def _compact(self) -> None:
+        """
+        Chamado quando _text cresce além de _compact_at: se menos da
+        metade dos bytes ainda é usada, copia só os trechos vivos para um
+        bloco novo e corrige os inícios.
+        """
+        starts, lens = self._starts, self._lens
+        # trechos vivos (não vazios) de _text, sem repetir os compartilhados
+        in_text = list(map(and_, map(lt, starts, repeat(0)), map(bool, lens)))
+        live = dict(zip(compress(starts, in_text), compress(lens, in_text)))
+        if 2 * sum(live.values()) < len(self._text):
+            old, text = self._text, bytearray()
+            moved: Dict[int, int] = {}
+            for start in sorted(live, reverse=True):  # do começo de _text ao fim
+                moved[start] = -len(text) - 1
+                text += old[-start - 1:-start - 1 + live[start]]
+            self._starts = array("q", map(moved.get, starts, starts))
+            self._text = text
+            self._intern = {code: (moved[slot[0]], slot[1])
+                            for code, slot in self._intern.items()
+                            if slot[0] in moved}
+        self._compact_at = max(2 * len(self._text), TEXT_COMPACT_MIN)
+
+    def __contains__(self, line_no: int) -> bool:
+        return self._index(line_no) >= 0
+
+    def __getitem__(self, line_no: int) -> str:
+        i = self._index(line_no)
+        if i < 0:
+            raise KeyError(line_no)
+        return self._text_at(i)
+
+    def __setitem__(self, line_no: int, code: str) -> None:
+        start, size = self._put(code)
+        i = bisect_left(self._nums, line_no)
+        if i < len(self._nums) and self._nums[i] == line_no:
+            self._starts[i] = start
+            self._lens[i] = size
+        else:
+            self._nums.insert(i, line_no)
+            self._starts.insert(i, start)
+            self._lens.insert(i, size)
+        if len(self._text) > self._compact_at:
+            self._compact()
+
+    def get(self, line_no: int, default: Optional[str] = None) -> Optional[str]:
+        try:
+            return self[line_no]
+        except KeyError:
+            return default
+
+    def update(self, lines: Dict[int, str]) -> int:
+        """
+        Insere/substitui várias linhas de uma vez (PASTE) e devolve
+        quantas já existiam. Em vez de um insert no meio dos arrays por
+        linha, as duas sequências ordenadas são intercaladas uma vez só;
+        linhas depois da última só são acrescentadas no fim.
+        """
+        new = sorted(lines)
+        if not new:
+            return 0
+        slots = self._put_many(list(map(lines.__getitem__, new)))
+        new_starts = array("q", map(itemgetter(0), slots))
+        new_lens = array("L", map(itemgetter(1), slots))
+        del slots
+        nums, starts, lens = self._nums, self._starts, self._lens
+        replaced = 0
+        if not nums or new[0] > nums[-1]:
+            nums.extend(new)
+            starts.extend(new_starts)
+            lens.extend(new_lens)
+        elif len(new) * 4 >= len(nums):
+            # bloco grande: intercala pelos dicionários (laços em C)
+            starts_of = dict(zip(nums, starts))
+            lens_of = dict(zip(nums, lens))
+            starts_of.update(zip(new, new_starts))
+            lens_of.update(zip(new, new_lens))
+            merged_nums = array("q", sorted(starts_of))
+            self._starts = array("q", map(starts_of.__getitem__, merged_nums))
+            self._lens = array("L", map(lens_of.__getitem__, merged_nums))
+            replaced = len(nums) + len(new) - len(merged_nums)
+            self._nums = merged_nums
+        else:
+            merged_nums, merged_starts, merged_lens = array("q"), array("q"), array("L")
+            i = 0
+            for k, n in enumerate(new):
+                j = bisect_left(nums, n, i)
+                merged_nums.extend(nums[i:j])
+                merged_starts.extend(starts[i:j])
+                merged_lens.extend(lens[i:j])
+                if j < len(nums) and nums[j] == n:
+                    replaced += 1
+                    j += 1
+                merged_nums.append(n)
+                merged_starts.append(new_starts[k])
+                merged_lens.append(new_lens[k])
+                i = j
+            merged_nums.extend(nums[i:])
+            merged_starts.extend(starts[i:])
+            merged_lens.extend(lens[i:])
+            self._nums, self._starts, self._lens = merged_nums, merged_starts, merged_lens
+        if len(self._text) > self._compact_at:
+            self._compact()
+        return replaced
+
+    def pop(self, line_no: int) -> str:
+        i = self._index(line_no)
+        if i < 0:
+            raise KeyError(line_no)
+        code = self._text_at(i)
+        del self._nums[i], self._starts[i], self._lens[i]
+        return code
+
+    def pop_range(self, start_no: int, end_no: int) -> List[Tuple[int, str]]:
+        """Remove as linhas em [start_no, end_no] e as devolve em ordem."""
+        i = bisect_left(self._nums, start_no)
+        j = bisect_right(self._nums, end_no)
+        removed = [(self._nums[k], self._text_at(k)) for k in range(i, j)]
+        del self._nums[i:j], self._starts[i:j], self._lens[i:j]
+        return removed
+
+    def numbers(self) -> "array":
+        """Números de linha em ordem crescente (não alterar o array!)."""
+        return self._nums
+
+    def items(self) -> Iterator[Tuple[int, str]]:
+        """Pares (numero_linha, código) em ordem crescente."""
+        text_at = self._text_at
+        for i, n in enumerate(self._nums):
+            yield n, text_at(i)
+
+    def position(self, line_no: int, hint: Optional[int] = None) -> Optional[int]:
+        """
+        Índice de line_no na ordem do programa (ou None se não existir).
+        Se 'hint' já for a posição certa, a resposta é O(1).
+        """
+        nums = self._nums
+        if hint is not None and hint < len(nums) and nums[hint] == line_no:
+            return hint
+        i = self._index(line_no)
+        return i if i >= 0 else None
+
+    def nbytes(self) -> int:
+        """
+        Memória própria do programa: arrays, texto e interning e os bytes
+        do arquivo lido pelo LOAD.
+        """
+        size = sum(map(sys.getsizeof, (self._nums, self._starts, self._lens,
+                                       self._text, self._intern)))
+        size += sum(map(sys.getsizeof, chain.from_iterable(self._intern.items())))
+        if self._buf is not None:
+            size += sys.getsizeof(self._buf)
+        return size
+
+    def detach(self) -> None:
+        """
+        Desliga o programa do arquivo mapeado (copiando os bytes para a
+        memória). O programa não pode ficar mapeado depois do LOAD: se
+        outro processo regravar ou cortar o arquivo, o texto das linhas
+        muda por baixo do programa e o acesso a uma página que sumiu
+        derruba o processo (SIGBUS); no Windows, o arquivo mapeado não
+        pode ser regravado pelo editor.
+        """
+        if isinstance(self._buf, mmap.mmap):
+            data = self._buf[:]
+            self._buf.close()
+            self._buf = data
+
+
+class PrecompiledLines:
+    """
+    Instruções já compiladas vindas do cache em disco (.mepac).
+
+    Cada linha fica serializada (marshal) em um único bloco de bytes,
+    com os números de linha e as posições em arrays. Nada é
+    desserializado no LOAD: a instrução só é reconstruída na primeira
+    vez que a linha executa (pop), e sai daqui.
+    """
+
+    __slots__ = ("_nums", "_offsets", "_blob", "_dropped")
+
+    def __init__(self, nums: Optional["array"] = None,
+                 offsets: Optional["array"] = None, blob: bytes = b"") -> None:
+        self._nums = nums if nums is not None else array("q")
+        # offsets tem len(nums) + 1 posições: linha i = blob[off[i]:off[i+1]]
+        self._offsets = offsets if offsets is not None else array("q", [0])
+        self._blob = blob
+        self._dropped: set = set()
+
+    def __len__(self) -> int:
+        return len(self._nums) - len(self._dropped)
+
+    def _index(self, line_no: int) -> int:
+        """Posição de line_no em _nums, ou -1 se não existir/já saiu."""
+        if line_no in self._dropped:
+            return -1
+        nums = self._nums
+        i = bisect_left(nums, line_no)
+        if i < len(nums) and nums[i] == line_no:
+            return i
+        return -1
+
+    def pop(self, line_no: int) -> Optional[tuple]:
+        """Retira e desserializa a instrução da linha (None se não houver)."""
+        i = self._index(line_no)
+        if i < 0:
+            return None
+        self._dropped.add(line_no)
+        return marshal.loads(self._blob[self._offsets[i]:self._offsets[i + 1]])
+
+    def discard(self, line_no: int) -> None:
+        """Esquece a linha (o código dela mudou)."""
+        if self._index(line_no) >= 0:
+            self._dropped.add(line_no)
+
+    def raw_items(self) -> Iterator[Tuple[int, bytes]]:
+        """(numero_linha, bytes serializados) das linhas ainda não usadas."""
+        blob, offsets, dropped = self._blob, self._offsets, self._dropped
+        for i, n in enumerate(self._nums):
+            if n not in dropped:
+                yield n, blob[offsets[i]:offsets[i + 1]]
+
+
+# tamanho padrão (em caracteres) do buffer de saída do RUN
+DEFAULT_OUTPUT_BUFFER = 64 * 1024
+
+
+class OutputSink:
+    """
+    Destino da saída produzida pelos print do programa.
+
+    Os valores são acumulados em memória e escritos em blocos grandes
+    (quando o buffer passa de buffer_size, no fim do RUN ou antes de
+    uma mensagem de erro). Com buffer_size=0 cada print é escrito na
+    hora.
+
+    target pode ser qualquer objeto com write() (arquivo aberto,
+    io.StringIO para capturar a saída, ...). Se for None, usa o
+    sys.stdout do momento da escrita.
+
+    Com um log ligado (start_log), cada bloco escrito também é guardado
+    em 'log', e position() diz quantos caracteres já saíram: é assim que
+    o RUN incremental sabe repetir a saída até um checkpoint.
+    """
+
+    __slots__ = ("target", "buffer_size", "_parts", "_size", "log", "written")
+
+    def __init__(self, target=None, buffer_size: int = DEFAULT_OUTPUT_BUFFER) -> None:
+        self.target = target
+        self.buffer_size = buffer_size
+        self._parts: List[str] = []
+        self._size = 0
+        self.log: Optional[List[str]] = None
+        self.written = 0  # caracteres já escritos desde start_log
+
+    def start_log(self, log: List[str]) -> None:
+        """Passa a guardar em 'log' tudo o que for escrito (a partir de agora)."""
+        self.flush()
+        self.log = log
+        self.written = 0
+
+    def stop_log(self) -> None:
+        self.flush()
+        self.log = None
+
+    def position(self) -> int:
+        """Caracteres escritos desde start_log (incluindo os do buffer)."""
+        return self.written + self._size
+
+    def write_text(self, text: str) -> None:
+        """Escreve um texto já formatado (várias linhas de uma vez)."""
+        self._parts.append(text)
+        self._size += len(text)
+        if self._size >= self.buffer_size:
+            self.flush()
+
+    def write_value(self, value: object) -> None:
+        """Equivalente a print(value), mas passando pelo buffer."""
+        if value is None or value is True or value is False:
+            value = lua_repr(value)  # nil, true, false
+        text = f"{value}\n"
+        self._parts.append(text)
+        self._size += len(text)
+        if self._size >= self.buffer_size:
+            self.flush()
+
+    def flush(self) -> None:
+        """Escreve de uma vez tudo o que está no buffer."""
+        if not self._parts:
+            return
+        target = self.target if self.target is not None else sys.stdout
+        data = "".join(self._parts)
+        self._parts.clear()
+        self._size = 0
+        if self.log is not None:
+            self.log.append(data)
+            self.written += len(data)
+        target.write(data)
+        target.flush()
+
+
+CHECKPOINT_INTERVAL = 1000                    # linhas entre checkpoints
+DEFAULT_CHECKPOINT_BUDGET = 64 * 1024 * 1024  # bytes para checkpoints + saída
+
+
+class RunCheckpoints:
+    """
+    Checkpoints do RUN incremental.
+
+    De tempos em tempos (a cada 'interval' linhas) o RUN guarda uma
+    cópia da memória de variáveis e a posição da saída, chaveadas pelo
+    número da linha que ia executar. A cópia só duplica a lista de
+    referências: os valores são imutáveis e ficam compartilhados. As
+    tabelas (LuaTable) são a exceção: mudam no lugar, então, se houver
+    alguma na memória, a cópia é profunda (copy.deepcopy, que mantém
+    quem aponta para a mesma tabela) e seu tamanho entra na conta. A
+    saída do RUN inteiro fica em 'log'.
+
+    Depois de alterar a linha k (note_edit), o estado antes de qualquer
+    linha <= k continua valendo: o RUN seguinte recomeça do último
+    checkpoint nessa faixa, repetindo a saída guardada até ele.
+
+    O espaço usado (cópias + saída) é limitado por 'budget' bytes:
+    quando passa, um checkpoint sim, outro não, é descartado e o
+    intervalo dobra, o que mantém a cobertura uniforme. Se só a saída
+    já passar do limite, os checkpoints são abandonados (RUN completo).
+    """
+
+    __slots__ = ("budget", "interval", "lines", "states", "log",
+                 "snapshot_bytes", "edited_from")
+
+    def __init__(self, budget: int = DEFAULT_CHECKPOINT_BUDGET) -> None:
+        self.budget = budget
+        self.log: List[str] = []
+        self.clear()
+
+    def clear(self) -> None:
+        self.interval = CHECKPOINT_INTERVAL
+        self.lines: List[int] = []
+        # (memória, posição da saída, bytes da cópia)
+        self.states: List[Tuple[tuple, int, int]] = []
+        self.log.clear()
+        self.snapshot_bytes = 0
+        self.edited_from: Optional[int] = None  # menor linha alterada
+
+    def __len__(self) -> int:
+        return len(self.lines)
+
+    def note_edit(self, line_no: int) -> None:
+        """A linha line_no mudou: checkpoints depois dela deixam de valer."""
+        if self.edited_from is None or line_no < self.edited_from:
+            self.edited_from = line_no
+
+    def resume_point(self) -> Optional[int]:
+        """Índice do checkpoint de onde recomeçar, ou None (do início)."""
+        if not self.lines:
+            return None
+        if self.edited_from is None:
+            return len(self.lines) - 1
+        i = bisect_right(self.lines, self.edited_from) - 1
+        return i if i >= 0 else None
+
+    def restore(self, index: int) -> Tuple[List[object], str]:
+        """
+        Descarta os checkpoints depois de 'index' e devolve (memória,
+        saída até ele). O log fica vazio, pronto para o novo RUN.
+        """
+        memory, out_pos, _size = self.states[index]
+        del self.lines[index + 1:]
+        for _snap, _pos, size in self.states[index + 1:]:
+            self.snapshot_bytes -= size
+        del self.states[index + 1:]
+        prefix = "".join(self.log)[:out_pos]
+        self.log.clear()
+        self.edited_from = None
+        if any(type(value) is LuaTable for value in memory):
+            # o checkpoint continua valendo para os próximos RUN
+            memory = copy.deepcopy(memory)
+        return list(memory), prefix
+
+    def record(self, line_no: int, memory: List[object], out_pos: int) -> bool:
+        """
+        Guarda o estado antes de line_no. Devolve False se não há espaço
+        nem para a saída (aí os checkpoints são descartados).
+        """
+        if out_pos > self.budget:
+            self.clear()
+            return False
+        snapshot = tuple(memory)
+        size = sys.getsizeof(snapshot)
+        tables = [value for value in snapshot if type(value) is LuaTable]
+        if tables:
+            snapshot = copy.deepcopy(snapshot)
+            size += sum(table.nbytes() for table in tables)
+        self.lines.append(line_no)
+        self.states.append((snapshot, out_pos, size))
+        self.snapshot_bytes += size
+        while self.snapshot_bytes + out_pos > self.budget and len(self.lines) > 1:
+            for _snap, _pos, size in self.states[1::2]:
+                self.snapshot_bytes -= size
+            del self.lines[1::2]
+            del self.states[1::2]
+            self.interval *= 2
+        return True
+
+
+TRACE_CHECKPOINT_INTERVAL = 1000          # passos do DEBUG entre cópias completas
+DEFAULT_TRACE_BUDGET = 16 * 1024 * 1024  # bytes para o histórico do DEBUG
+# estimativa do espaço de um passo guardado e de cada valor alterado nele
+TRACE_STEP_BYTES = 128
+TRACE_CHANGE_BYTES = 64
+# trechos (entre checkpoints) em que o orçamento é dividido, no mínimo
+TRACE_SEGMENTS = 8
+# operações que não escrevem em slots (setindex muda a tabela no lugar)
+TRACE_READ_ONLY_KINDS = ("nop", "print", "setindex", "error", "test", "jump")
+
+
+class DebugTrace:
+    """
+    Histórico do DEBUG, para voltar atrás (BACK) ou ir a um passo
+    qualquer (STEP <n>).
+
+    Cada NEXT guarda só o que a linha mudou: (linha executada, posição
+    do program_counter depois dela, slots alterados, escritas em
+    tabelas). Os slots alterados são os que, comparando por identidade
+    antes e depois da linha, apontam para outro valor; só os slots que
+    a operação pode escrever (ver watch) são comparados. As
+    tabelas mudam no lugar, então uma escrita t[k] = v vira (closure
+    que acha a tabela, chave, valor), refeita sobre a memória
+    reconstruída; tabelas guardadas como valor são copiadas
+    (copy.deepcopy), para não verem mudanças posteriores.
+
+    A cada 'interval' passos (ou antes, quando os passos desde o último
+    já ocupam 1/TRACE_SEGMENTS do orçamento) entra um checkpoint com a
+    memória inteira (como em RunCheckpoints); um CONT conta como um
+    passo só e sempre termina num checkpoint. O estado depois do passo n é reconstruído a
+    partir do último checkpoint até n, reaplicando as diferenças: o
+    espaço cresce com o número de mudanças, não com passos x variáveis.
+    Quando a estimativa passa de 'budget' bytes, o checkpoint mais
+    antigo e os passos até o seguinte (uma fração do histórico) são
+    descartados (buffer circular).
+    Orçamento 0 desliga o histórico.
+
+    Os passos vão de 'base' (o checkpoint mais antigo) até 'last';
+    'pos' é o passo em que a sessão está agora (menor que 'last' depois
+    de um BACK).
+    """
+
+    __slots__ = ("budget", "interval", "base", "pos", "steps", "cp_steps",
+                 "cp_states", "size", "segment_size", "index_exprs")
+
+    def __init__(self, budget: int = DEFAULT_TRACE_BUDGET) -> None:
+        self.budget = budget
+        self.interval = TRACE_CHECKPOINT_INTERVAL
+        self.clear()
+
+    def clear(self) -> None:
+        self.base = self.pos = 0
+        # passo base + 1 + i: (linha, pc depois, slots, escritas em tabelas)
+        self.steps: Deque[tuple] = deque()
+        self.cp_steps: List[int] = []
+        self.cp_states: List[Tuple[tuple, tuple, int]] = []  # (memória, pc, bytes)
+        self.size = 0
+        self.segment_size = 0  # bytes dos passos desde o último checkpoint
+        # closures (tabela, chave) de cada operação setindex já vista
+        self.index_exprs: Dict[int, tuple] = {}
+
+    @property
+    def active(self) -> bool:
+        return bool(self.cp_steps)
+
+    @property
+    def last(self) -> int:
+        return self.base + len(self.steps)
+
+    def start(self, memory: List[object], pc: tuple) -> None:
+        """Começa um histórico novo, com o estado inicial como passo 0."""
+        self.clear()
+        if self.budget > 0:
+            self.checkpoint(memory, pc)
+
+    def checkpoint(self, memory: List[object], pc: tuple) -> None:
+        """Cópia completa da memória no passo atual ('last')."""
+        snapshot = tuple(memory)
+        size = sys.getsizeof(snapshot)
+        tables = [value for value in snapshot if type(value) is LuaTable]
+        if tables:
+            snapshot = copy.deepcopy(snapshot)
+            size += sum(table.nbytes() for table in tables)
+        self.cp_steps.append(self.last)
+        self.cp_states.append((snapshot, pc, size))
+        self.size += size
+        self.segment_size = 0
+
+    def truncate(self) -> None:
+        """Descarta os passos depois de 'pos' (NEXT ou CONT depois de um BACK)."""
+        if self.pos == self.last:
+            return
+        for _ in range(self.last - self.pos):
+            self.size -= self.step_size(self.steps.pop())
+        k = bisect_right(self.cp_steps, self.pos)
+        for _snap, _pc, size in self.cp_states[k:]:
+            self.size -= size
+        del self.cp_steps[k:], self.cp_states[k:]
+
+    @staticmethod
+    def watch(op: tuple, memory: List[object]) -> Tuple[Optional[tuple], list]:
+        """
+        (slots que a operação pode alterar, valores deles antes dela).
+        Para uma operação desconhecida, (None, cópia da memória inteira).
+        """
+        kind = op[0]
+        if kind == "assign":
+            slots = (op[4],)
+        elif kind == "forprep":
+            slots = op[3]
+        elif kind == "forloop":
+            slots = op[1]
+        elif kind in TRACE_READ_ONLY_KINDS:
+            return (), []
+        else:
+            return None, memory[:]
+        return slots, [memory[i] for i in slots]
+
+    def index_target(self, op: tuple, memory: List[object],
+                     slot_of: Callable[[str], int]) -> Optional[tuple]:
+        """
+        Para uma operação setindex, (closure da tabela, chave, tabela)
+        calculados ANTES de executá-la (a chave pode depender da própria
+        tabela, como em t[#t + 1] = v). None para as outras operações.
+        """
+        if op[0] != "setindex":
+            return None
+        cached = self.index_exprs.get(id(op))
+        if cached is None or cached[0] is not op:
+            nodes = op[3]
+            cached = (op, compile_node(nodes[0], slot_of),
+                      compile_node(nodes[1], slot_of))
+            self.index_exprs[id(op)] = cached
+        _op, table_of, key_of = cached
+        try:
+            table = table_of(memory)
+            return table_of, key_of(memory), table
+        except Exception:
+            return None  # a própria operação vai dar o erro
+
+    @staticmethod
+    def step_size(step: tuple) -> int:
+        _line, _pc, slots, writes = step
+        size = TRACE_STEP_BYTES
+        for values in (slots, writes):
+            if values:
+                size += TRACE_CHANGE_BYTES * len(values)
+                size += sum(change[-1].nbytes() for change in values
+                            if type(change[-1]) is LuaTable)
+        return size
+
+    def record(self, line_no: int, pc: tuple, watched: tuple,
+               memory: List[object], target: Optional[tuple]) -> None:
+        """
+        Guarda o passo que levou a memória do estado 'watched' (de
+        watch, antes da operação) a 'memory'.
+        """
+        watched_slots, before = watched
+        if watched_slots is not None:
+            slots = [(i, memory[i]) for i, old in zip(watched_slots, before)
+                     if memory[i] is not old]
+        else:
+            n = len(before)
+            slots = [(i, memory[i]) for i in
+                     compress(range(n), map(operator_is_not, before, memory))]
+            slots.extend((i, memory[i]) for i in range(n, len(memory))
+                         if memory[i] is not UNDEFINED)
+        writes = None
+        if target is not None:
+            table_of, key, table = target
+            writes = ((table_of, key, lua_index(table, key)),)
+        changes = (tuple(slots), writes)
+        if any(type(change[-1]) is LuaTable for change in chain(*filter(None, changes))):
+            changes = copy.deepcopy(changes)
+        step = (line_no, pc) + changes
+        size = self.step_size(step)
+        self.steps.append(step)
+        self.size += size
+        self.segment_size += size
+        self.pos = self.last
+        if (self.last - self.cp_steps[-1] >= self.interval
+                or self.segment_size * TRACE_SEGMENTS >= self.budget):
+            self.checkpoint(memory, pc)
+        self.trim(memory, pc)
+
+    def record_jump(self, line_no: int, pc: tuple, memory: List[object]) -> None:
+        """Guarda um CONT: um passo só, que termina num checkpoint."""
+        step = (line_no, pc, None, None)
+        self.steps.append(step)
+        self.size += self.step_size(step)
+        self.pos = self.last
+        self.checkpoint(memory, pc)
+        self.trim(memory, pc)
+
+    def trim(self, memory: List[object], pc: tuple) -> None:
+        """Descarta os passos mais antigos enquanto passar do orçamento."""
+        while self.size > self.budget:
+            if len(self.cp_steps) == 1:
+                if self.cp_steps[0] == self.last:
+                    break  # só resta o estado atual
+                self.checkpoint(memory, pc)
+            for _ in range(self.cp_steps[1] - self.base):
+                self.size -= self.step_size(self.steps.popleft())
+            self.size -= self.cp_states[0][2]
+            del self.cp_steps[0], self.cp_states[0]
+            self.base = self.cp_steps[0]
+
+    def rebuild(self, n: int) -> Tuple[List[object], tuple]:
+        """
+        (memória, pc) depois do passo n (base <= n <= last): parte do
+        último checkpoint até n e reaplica as diferenças guardadas.
+        """
+        k = bisect_right(self.cp_steps, n) - 1
+        snapshot, pc, _size = self.cp_states[k]
+        memory = list(snapshot)
+        if any(type(value) is LuaTable for value in memory):
+            memory = copy.deepcopy(memory)  # o checkpoint continua valendo
+        for i in range(self.cp_steps[k] - self.base, n - self.base):
+            _line, pc, slots, writes = self.steps[i]
+            for slot, value in slots:
+                if slot >= len(memory):
+                    memory.extend([UNDEFINED] * (slot + 1 - len(memory)))
+                memory[slot] = (copy.deepcopy(value) if type(value) is LuaTable
+                                else value)
+            for table_of, key, value in writes or ():
+                lua_setindex(table_of(memory), key,
+                             copy.deepcopy(value) if type(value) is LuaTable
+                             else value)
+        return memory, pc
+
+    def line_of(self, n: int) -> Optional[int]:
+        """Linha executada no passo n (None para o passo base)."""
+        if n <= self.base:
+            return None
+        return self.steps[n - self.base - 1][0]
+
+
+# o diário é incorporado ao arquivo (SAVE completo) quando passa do
+# maior destes dois limites: bytes fixos ou fração do arquivo base
+JOURNAL_COMPACT_MIN = 1024 * 1024
+JOURNAL_COMPACT_RATIO = 0.1
+
+
+class EditJournal:
+    """
+    Estado do SAVE incremental (ver read_journal / append_journal).
+
+    Em vez de regravar o programa inteiro, o SAVE acrescenta ao diário
+    ("prog.mepa.journal") só as alterações feitas desde o SAVE anterior,
+    guardadas em 'pending' como ("INS", linha, código) ou ("DEL",
+    linha_i, linha_f). O LOAD lê o arquivo base e reaplica o diário.
+
+    'base' identifica o arquivo base, (tamanho, mtime_ns, hash) como
+    estava quando o diário começou (ver journal_base); None quando o
+    programa não veio de um
+    arquivo (ou o diário não vale para ele), e aí o SAVE é completo
+    (e nada precisa ir para 'pending'). Quando o diário passa do
+    limite, o SAVE também é completo e o diário é apagado.
+    """
+
+    __slots__ = ("pending", "base", "size", "records")
+
+    def __init__(self) -> None:
+        self.pending: List[tuple] = []
+        self.reset(None)
+
+    def reset(self, base: Optional[Tuple[int, int, str]], size: int = 0,
+              records: int = 0) -> None:
+        """Novo arquivo base (ou nenhum), sem alterações pendentes."""
+        self.pending.clear()
+        self.base = base
+        self.size = size        # bytes do diário em disco (0 = não existe)
+        self.records = records  # alterações gravadas no diário
+
+    def needs_compaction(self) -> bool:
+        limit = max(JOURNAL_COMPACT_MIN, JOURNAL_COMPACT_RATIO * self.base[0])
+        return self.size > limit
+
+
+# as linhas executadas e as avaliações de expressão de um RUN são
+# somadas num inteiro só (ver ControlFlow.step_marks): as avaliações
+# ficam dos bits STEP_SHIFT em diante
+STEP_SHIFT = 40
+STEP_MASK = (1 << STEP_SHIFT) - 1
+
+# campos do registro de um RUN (SessionStats.last_run é uma tupla nesta
+# ordem; last_record monta o dicionário só quando alguém pede)
+RUN_FIELDS = ("time", "file", "backend", "lines", "lines_executed",
+              "evaluations", "resumed_at", "errors", "error_line",
+              "compile_seconds", "execute_seconds")
+
+
+class SessionStats:
+    """
+    Contadores e tempos da sessão (comando STATS; --metrics grava um
+    registro JSON por RUN). Ficam sempre ligados: o LOAD, o SAVE, o RUN
+    e o DEBUG só somam números já conhecidos no fim de cada comando, e
+    o laço do RUN conta as linhas executadas sem custo extra por linha
+    (só nos desvios; ver ControlFlow.step_marks). Medido com
+    bench_mepa.py --stats: os laços ficam dentro do ruído; cada RUN
+    custa uns 2 µs fixos (o registro do RUN), o que só aparece em
+    programas de poucas linhas.
+
+    Os tempos são do relógio (time.perf_counter), em segundos. O RUN
+    tem duas fases: "compile" (preparar: compilar linhas, ligar blocos,
+    gerar MEPA) e "execute" (rodar). O CONT conta linhas e tempo como
+    execução; cada NEXT é um passo de DEBUG. No RUN VM as linhas e as
+    avaliações não são contadas (a máquina executa instruções MEPA).
+    """
+
+    __slots__ = ("loads", "lines_loaded", "load_seconds", "saves",
+                 "save_seconds", "runs", "run_errors", "lines_executed",
+                 "evaluations", "compile_seconds", "execute_seconds",
+                 "counted_seconds", "debug_steps", "debug_seconds", "last_run",
+                 "pending")
+
+    def __init__(self) -> None:
+        self.reset()
+
+    def reset(self) -> None:
+        """STATS RESET: zera tudo."""
+        self.loads = 0
+        self.lines_loaded = 0
+        self.load_seconds = 0.0
+        self.saves = 0
+        self.save_seconds = 0.0
+        self.runs = 0
+        self.run_errors = 0
+        self.lines_executed = 0
+        self.evaluations = 0
+        self.compile_seconds = 0.0
+        self.execute_seconds = 0.0
+        self.counted_seconds = 0.0  # execução com linhas contadas (sem VM)
+        self.debug_steps = 0
+        self.debug_seconds = 0.0
+        self.last_run: Optional[tuple] = None  # último RUN (ver RUN_FIELDS)
+        self.pending = 0  # execução em andamento (formato de step_marks)
+
+    def add_load(self, lines: int, seconds: float) -> None:
+        self.loads += 1
+        self.lines_loaded += lines
+        self.load_seconds += seconds
+
+    def add_save(self, seconds: float) -> None:
+        self.saves += 1
+        self.save_seconds += seconds
+
+    def take(self) -> Tuple[int, int]:
+        """(linhas, avaliações) anotadas desde a última chamada."""
+        steps, self.pending = self.pending, 0
+        return steps & STEP_MASK, steps >> STEP_SHIFT
+
+    def add_run(self, run: tuple) -> None:
+        """
+        Soma um RUN (tupla de Interpreter.run_record, deste processo ou
+        de um processo do servidor) e o guarda como o último.
+        """
+        (_time, _file, _backend, _lines, executed, evaluations, _resumed,
+         errors, _error_line, compile_seconds, execute_seconds) = run
+        self.runs += 1
+        self.run_errors += errors
+        self.compile_seconds += compile_seconds
+        self.execute_seconds += execute_seconds
+        if executed is not None:
+            self.lines_executed += executed
+            self.evaluations += evaluations
+            self.counted_seconds += execute_seconds
+        self.last_run = run
+
+    def last_record(self) -> Optional[dict]:
+        """
+        O último RUN como dicionário (campos de RUN_FIELDS mais
+        lines_per_second): o registro do --metrics e do STATS.
+        """
+        if self.last_run is None:
+            return None
+        record = dict(zip(RUN_FIELDS, self.last_run))
+        executed, seconds = record["lines_executed"], record["execute_seconds"]
+        record["time"] = round(record["time"], 3)
+        record["compile_seconds"] = round(record["compile_seconds"], 6)
+        record["execute_seconds"] = round(seconds, 6)
+        record["lines_per_second"] = (round(executed / seconds, 1)
+                                      if executed is not None and seconds
+                                      else None)
+        return record
+
+    def add_step(self, seconds: float) -> None:
+        self.debug_steps += 1
+        self.debug_seconds += seconds
+
+    def add_cont(self, seconds: float) -> None:
+        """Soma um CONT: as linhas anotadas e o tempo, como execução."""
+        lines, evaluations = self.take()
+        self.lines_executed += lines
+        self.evaluations += evaluations
+        self.execute_seconds += seconds
+        self.counted_seconds += seconds
+
+    def as_dict(self) -> dict:
+        """Totais da sessão (STATS / STATS do servidor)."""
+        rate = (self.lines_executed / self.counted_seconds
+                if self.counted_seconds else 0.0)
+        return {"loads": self.loads, "lines_loaded": self.lines_loaded,
+                "load_seconds": round(self.load_seconds, 6),
+                "saves": self.saves,
+                "save_seconds": round(self.save_seconds, 6),
+                "runs": self.runs, "run_errors": self.run_errors,
+                "lines_executed": self.lines_executed,
+                "evaluations": self.evaluations,
+                "compile_seconds": round(self.compile_seconds, 6),
+                "execute_seconds": round(self.execute_seconds, 6),
+                "lines_per_second": round(rate, 1),
+                "debug_steps": self.debug_steps,
+                "debug_seconds": round(self.debug_seconds, 6),
+                "last_run": self.last_record()}
+
+
+# =====================================================================
+# 2. FUNÇÕES UTILITÁRIAS
+# =====================================================================
+# Funções de apoio usadas por vários comandos:
+# - confirmação [s/N] com o usuário,
+# - conversão segura para int,
+# - tamanho aproximado de estruturas em memória (comando MEM),
+# - registro das métricas de cada RUN em arquivo (--metrics).
+# =====================================================================
+
+
+def ask_yes_no(msg: str) -> bool:
+    """Pergunta [s/N] e retorna True se usuário responder 's'."""
+    try:
+        ans = input(f"{msg} [s/N] ").strip().lower()
+    except EOFError:  # entrada acabou: fica o padrão (N)
+        print()
+        return False
+    return ans in ("s", "sim", "y", "yes")
+
+
+def parse_int(value: str) -> Optional[int]:
+    """Tenta converter para int; em caso de falha, retorna None."""
+    try:
+        return int(value)
+    except ValueError:
+        return None
+
+
+# maior número de linha: o programa guarda os números em array("q")
+MAX_LINE_NUMBER = 2 ** 63 - 1
+
+
+def parse_line_number(value: str) -> Optional[int]:
+    """Número de linha (0 a MAX_LINE_NUMBER) ou None se inválido."""
+    num = parse_int(value)
+    if num is None or not 0 <= num <= MAX_LINE_NUMBER:
+        return None
+    return num
+
+
+# o MEM mede por amostragem as coleções com mais itens que isto
+MEM_SAMPLE = 2000
+
+
+def _children(obj) -> Iterable:
+    """Objetos diretamente alcançáveis a partir de obj (para deep_sizeof)."""
+    kind = type(obj)
+    if kind is tuple or kind is list or kind is set or kind is frozenset \
+            or kind is deque:
+        return obj
+    if kind is dict:
+        return obj.items() if len(obj) > MEM_SAMPLE else \
+            list(chain.from_iterable(obj.items()))
+    if kind is types.FunctionType:  # closure: código, padrões e células
+        return (obj.__code__, obj.__defaults__, obj.__closure__)
+    if kind is types.CellType:
+        try:
+            return (obj.cell_contents,)
+        except ValueError:  # célula ainda vazia
+            return ()
+    if kind is types.CodeType:
+        return obj.co_consts
+    slots = getattr(kind, "__slots__", None)
+    if slots and kind.__module__ == __name__:
+        return [getattr(obj, name, None) for name in slots]
+    return ()
+
+
+def deep_sizeof(obj, seen: Optional[set] = None) -> int:
+    """
+    Bytes (aproximados) ocupados por obj e por tudo o que ele alcança:
+    tuplas, listas, dicionários, closures, tabelas, objetos das classes
+    deste módulo... Cada objeto conta uma vez só; passando o mesmo
+    'seen' em várias chamadas, o que já foi contado não conta de novo.
+    Coleções com mais de MEM_SAMPLE itens são medidas por uma amostra
+    espaçada e o total é extrapolado.
+    """
+    if seen is None:
+        seen = set()
+    total = 0
+    stack = [obj]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen or obj is None or isinstance(obj, type):
+            continue
+        seen.add(id(obj))
+        total += sys.getsizeof(obj)
+        children = _children(obj)
+        n = len(children)
+        if n <= MEM_SAMPLE:
+            stack.extend(children)
+            continue
+        sample = list(islice(children, 0, None, n // MEM_SAMPLE))
+        if type(obj) is dict:  # amostra de pares (chave, valor)
+            sample = list(chain.from_iterable(sample))
+            n *= 2
+        part = sum(deep_sizeof(child, seen) for child in sample)
+        total += part * n // len(sample)
+    return total
+
+
+def append_metrics(path: str, record: dict) -> None:
+    """
+    Acrescenta um registro (ver SessionStats.last_record) ao arquivo de
+    métricas, como uma linha JSON. Cada linha vai numa escrita só, em
+    modo de acréscimo: vários processos (run --jobs) podem usar o mesmo
+    arquivo.
+    """
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+# =====================================================================
+# 3. ARQUIVOS DE PROGRAMA (.mepa E .mepac)
+# =====================================================================
+# Leitura e gravação dos arquivos de código numerado ('<linha> <código>')
+# e do cache compilado em disco. São funções sem estado: quem guarda o
+# programa carregado é a sessão (Interpreter.load / Interpreter.save).
+# =====================================================================
+
+
+# o LOAD processa o arquivo mapeado em blocos deste tamanho (bytes)
+LOAD_CHUNK = 4 * 1024 * 1024
+# quantos exemplos mostrar em cada aviso agregado do LOAD
+WARNING_EXAMPLES = 3
+
+
+def _scan_chunk_fast(chunk: bytes, base: int):
+    """
+    Caminho rápido do LOAD para um bloco de linhas completas que começa
+    no byte 'base' do arquivo. Todo o trabalho por linha é feito por
+    funções em C (split, map, accumulate), sem laço Python.
+
+    Retorna (números, inícios, tamanhos) ou None se o bloco tiver algo
+    fora do padrão '<número> <código>' (linha vazia, número inválido...).
+    """
+    lines = chunk.split(b"\n")
+    if lines[-1] == b"":
+        lines.pop()
+    try:
+        parts = list(map(bytes.split, lines, repeat(None), repeat(1)))
+        nums = array("q", map(int, map(itemgetter(0), parts)))
+        codes = list(map(itemgetter(1), parts))
+    except (IndexError, ValueError, OverflowError):
+        return None
+    if nums and min(nums) < 0:
+        return None
+    line_lens = list(map(len, lines))
+    line_starts = accumulate(map((1).__add__, line_lens), initial=base)
+    code_lens = array("L", map(len, codes))
+    # início do código = fim da linha - tamanho do código
+    starts = array("q", map(sub, map(add, line_starts, line_lens), code_lens))
+    if b"\r" in chunk:
+        # '\r' do fim de linha do Windows não faz parte do código
+        code_lens = array("L", map(sub, code_lens,
+                                   map(bytes.endswith, codes, repeat(b"\r"))))
+    return nums, starts, code_lens
+
+
+def parse_program_file(path: str) -> Tuple[ProgramStore, List[str]]:
+    """
+    Lê um arquivo de código numerado (formato: '<linha> <código>').
+
+    O arquivo é mapeado em memória (mmap) e varrido em blocos grandes;
+    o programa guarda uma cópia dos bytes (ver ProgramStore.detach),
+    só o número e a posição de cada linha, e o texto é decodificado sob
+    demanda. Blocos com linhas fora do padrão simples passam, linha a
+    linha, pelas regras originais do LOAD.
+
+    Retorna o programa e uma lista CURTA de avisos (agregados por tipo).
+    Erros de leitura são propagados.
+    """
+    if os.path.getsize(path) == 0:
+        return ProgramStore(), []
+    with open(path, "rb") as f:
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    store, warnings = parse_program_buffer(buf)
+    store.detach()
+    return store, warnings
+
+
+def parse_program_buffer(buf) -> Tuple[ProgramStore, List[str]]:
+    """
+    parse_program_file sobre o conteúdo já lido (bytes ou mmap) de um
+    arquivo; o programa devolvido guarda trechos de 'buf'.
+    """
+    size = len(buf)
+    if size == 0:
+        return ProgramStore(), []
+
+    nums = array("q")
+    starts = array("q")
+    lens = array("L")
+    code: Dict[int, str] = {}
+    no_code: List[str] = []      # linhas sem número + código
+    bad_number: List[str] = []   # linhas com número inválido
+
+    def scan_chunk_slow(chunk: bytes) -> None:
+        """Regras originais do LOAD, uma linha por vez."""
+        for raw in chunk.decode("utf-8", "replace").split("\n"):
+            line = raw.rstrip("\r")
+            if not line.strip():
+                continue
+            parts = line.split(maxsplit=1)
+            if len(parts) != 2:
+                no_code.append(line)
+                continue
+            num = parse_line_number(parts[0])
+            if num is None:
+                bad_number.append(line)
+                continue
+            nums.append(num)
+            starts.append(-1)
+            lens.append(0)
+            code[num] = parts[1]
+
+    pos = 0
+    while pos < size:
+        end = buf.find(b"\n", min(pos + LOAD_CHUNK, size))
+        end = size if end < 0 else end + 1
+        chunk = buf[pos:end]
+        fast = _scan_chunk_fast(chunk, pos)
+        if fast is None:
+            scan_chunk_slow(chunk)
+        else:
+            nums.extend(fast[0])
+            starts.extend(fast[1])
+            lens.extend(fast[2])
+        pos = end
+
+    if not all(map(lt, nums, islice(nums, 1, None))):
+        # fora de ordem ou repetido: ordena, valendo a última ocorrência
+        order = sorted(range(len(nums)), key=nums.__getitem__)
+        keep = [k for i, k in enumerate(order)
+                if i + 1 == len(order) or nums[order[i + 1]] != nums[k]]
+        nums = array("q", (nums[k] for k in keep))
+        starts = array("q", (starts[k] for k in keep))
+        lens = array("L", (lens[k] for k in keep))
+        for n, st in zip(nums, starts):
+            if st >= 0:
+                code.pop(n, None)
+
+    store = ProgramStore.from_buffer(buf, nums, starts, lens)
+    # linhas do caminho lento: o texto vai para o bloco próprio do programa
+    store.update(code)
+
+    return store, line_warnings(no_code, bad_number)
+
+
+def line_warnings(no_code: List[str], bad_number: List[str]) -> List[str]:
+    """Avisos agregados (contagem + exemplos) das linhas ignoradas."""
+    warnings: List[str] = []
+    for items, what in ((no_code, "ignorada(s) (sem número + código)"),
+                        (bad_number, "com número de linha inválido")):
+        if items:
+            examples = ", ".join(repr(x) for x in items[:WARNING_EXAMPLES])
+            warnings.append(f"Aviso: {len(items)} linha(s) {what}, ex.: {examples}")
+    return warnings
+
+
+def parse_numbered_lines(lines: Iterable[str]) -> Tuple[Dict[int, str], List[str]]:
+    """
+    Linhas '<número> <código>' vindas do PASTE, com as mesmas regras
+    do LOAD (linhas vazias puladas; repetidas: vale a última). Retorna
+    {número: código} e os avisos das linhas ignoradas.
+    """
+    lines = list(map(str.rstrip, lines, repeat("\r\n")))
+    # caminho rápido (como o do LOAD): tudo no padrão, sem laço Python.
+    # O coletor de lixo fica desligado enquanto as listas [número,
+    # código] são criadas: com 1M delas, as coletas dominariam o tempo.
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        parts = list(map(str.split, lines, repeat(None), repeat(1)))
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+    try:
+        code = dict(zip(map(int, map(itemgetter(0), parts)),
+                        map(itemgetter(1), parts)))
+        if not code or 0 <= min(code) and max(code) <= MAX_LINE_NUMBER:
+            return code, []
+    except (IndexError, ValueError):
+        pass
+    code = {}
+    no_code: List[str] = []
+    bad_number: List[str] = []
+    for line in lines:
+        parts = line.split(maxsplit=1)
+        if len(parts) != 2:
+            if parts:
+                no_code.append(line)
+            continue
+        num = parse_line_number(parts[0])
+        if num is None:
+            bad_number.append(line)
+            continue
+        code[num] = parts[1]
+    return code, line_warnings(no_code, bad_number)
+
+
+def write_program_file(path: str, store: ProgramStore) -> ProgramStore:
+    """
+    Grava o programa em 'path' (uma linha '<número> <código>' por linha)
+    e devolve o mesmo programa, agora sobre os bytes gravados (como
+    depois de um LOAD). A gravação vai para um arquivo temporário, que
+    só no fim substitui 'path' (os.replace): uma falha no meio não deixa
+    o arquivo cortado.
+    """
+    # monta o arquivo anotando onde fica o código de cada linha, para
+    # usar os bytes gravados como memória do programa
+    newline = os.linesep.encode()
+    starts = array("q")
+    lens = array("L")
+    parts = []
+    pos = 0
+    for n, code in store.items():
+        prefix = f"{n} ".encode()
+        data = code.encode("utf-8")
+        starts.append(pos + len(prefix))
+        lens.append(len(data))
+        parts.append(prefix + data + newline)
+        pos += len(prefix) + len(data) + len(newline)
+    buf = b"".join(parts)
+    del parts
+    tmp = path + ".tmp"
+    try:
+        with open(tmp, "wb") as f:
+            f.write(buf)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(tmp)
+        raise
+    return ProgramStore.from_buffer(buf, array("q", store.numbers()), starts, lens)
+
+
+# ---------------------------------------------------------------------
+# WATCH: o arquivo aberto é alterado num editor externo e relido. Em vez
+# de montar o programa de novo, a parte igual do começo e do fim do
+# arquivo é achada comparando os bytes (em C) e só as linhas do meio são
+# lidas e comparadas com as do programa em memória.
+# ---------------------------------------------------------------------
+
+# o WATCH confere o tamanho e a data do arquivo a cada tantos segundos
+WATCH_INTERVAL = 0.25
+# primeiro bloco comparado pelo diff (dobra a cada bloco igual)
+DIFF_BLOCK = 64 * 1024
+
+
+def _common_length(old, new, limit: int, from_end: bool = False) -> int:
+    """
+    Quantos bytes iniciais (ou finais, com from_end) old e new têm em
+    comum, até 'limit'. Compara blocos cada vez maiores e, no bloco com
+    a diferença, faz busca binária: O(tamanho) só em comparações em C.
+    """
+    def same(lo: int, hi: int) -> bool:
+        if from_end:
+            return old[len(old) - hi:len(old) - lo] == new[len(new) - hi:len(new) - lo]
+        return old[lo:hi] == new[lo:hi]
+
+    lo, block = 0, DIFF_BLOCK
+    while lo < limit:
+        hi = min(lo + block, limit)
+        if not same(lo, hi):
+            while hi - lo > 1:  # a diferença está em [lo, hi)
+                mid = (lo + hi) // 2
+                if same(lo, mid):
+                    lo = mid
+                else:
+                    hi = mid
+            return lo
+        lo, block = hi, block * 2
+    return limit
+
+
+def diff_program_file(store: ProgramStore, data
+                      ) -> Optional[Tuple[ProgramStore, List[int], List[int]]]:
+    """
+    Compara 'store', lido de um arquivo (e sem alterações desde então),
+    com o novo conteúdo 'data' desse arquivo. Devolve (programa sobre
+    'data', linhas novas ou alteradas, linhas removidas), ou None quando
+    o caminho rápido não vale (programa com linhas fora do arquivo ou
+    fora de ordem, trecho alterado com linhas fora do padrão...) e o
+    arquivo precisa ser lido inteiro (parse_program_buffer).
+
+    Só as linhas do trecho entre a parte igual do começo e a do fim são
+    lidas; as do fim só têm o início deslocado (uma soma em C por linha).
+    """
+    old, starts = store._buf, store._starts
+    if old is None or not starts or min(starts) < 0 \
+            or not all(map(lt, starts, islice(starts, 1, None))):
+        return None
+    old_size, new_size = len(old), len(data)
+    prefix = _common_length(old, data, min(old_size, new_size))
+    suffix = _common_length(old, data, min(old_size, new_size) - prefix, True)
+    # linhas inteiras (com o '\n') dentro da parte igual do começo / do fim
+    head = data.rfind(b"\n", 0, prefix) + 1
+    tail = data.find(b"\n", new_size - suffix) if suffix else -1
+    new_tail = new_size if tail < 0 else tail + 1
+    shift = new_size - old_size
+    i = bisect_left(starts, head)
+    j = bisect_left(starts, new_tail - shift)
+    if head < new_tail:
+        middle = _scan_chunk_fast(data[head:new_tail], head)
+        if middle is None:
+            return None
+    else:
+        middle = array("q"), array("q"), array("L")
+    nums = store._nums
+    mid_nums = middle[0]
+    edge = nums[max(i - 1, 0):i] + mid_nums + nums[j:j + 1]
+    if not all(map(lt, edge, islice(edge, 1, None))):
+        return None
+    new_store = ProgramStore.from_buffer(
+        data, nums[:i] + mid_nums, starts[:i] + middle[1],
+        store._lens[:i] + middle[2])
+    new_store._nums.extend(nums[j:])
+    new_store._starts.extend(map(add, starts[j:], repeat(shift)) if shift
+                             else starts[j:])
+    new_store._lens.extend(store._lens[j:])
+    old_code = {nums[k]: store._text_at(k) for k in range(i, j)}
+    changed = [n for k, n in enumerate(mid_nums, i)
+               if old_code.get(n) != new_store._text_at(k)]
+    removed = sorted(old_code.keys() - set(mid_nums))
+    return new_store, changed, removed
+
+
+class FileWatcher:
+    """
+    Observa um arquivo pelo tamanho e pela data de modificação (os.stat
+    a cada 'interval' segundos, sem ler o conteúdo). Uma alteração só é
+    avisada quando o arquivo fica igual por uma consulta inteira, para
+    não pegar o editor no meio da gravação; enquanto o arquivo não
+    existe (alguns editores apagam e recriam), nada é avisado.
+    """
+
+    __slots__ = ("path", "identity", "interval")
+
+    def __init__(self, path: str, interval: float = WATCH_INTERVAL) -> None:
+        self.path = path
+        self.interval = interval
+        self.identity = self.current()
+
+    def current(self) -> Optional[Tuple[int, int]]:
+        """(tamanho, mtime_ns) do arquivo, ou None se ele não existir."""
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return st.st_size, st.st_mtime_ns
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """
+        Espera o arquivo mudar: True quando mudou (e parou de mudar),
+        False se 'timeout' segundos passaram sem alteração.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        pending = None
+        while deadline is None or time.monotonic() < deadline:
+            time.sleep(self.interval)
+            seen = self.current()
+            if seen is None or seen == self.identity:
+                pending = None
+            elif seen == pending:
+                self.identity = seen
+                return True
+            else:
+                pending = seen
+        return False
+
+
+# ---------------------------------------------------------------------
+# Diário do SAVE incremental (ver EditJournal), ao lado do .mepa
+# ("prog.mepa" -> "prog.mepa.journal"). É texto, uma alteração por
+# linha, e cada SAVE acrescenta um lote terminado por "SAVE <n>":
+#   MEPAJ-2 <tamanho> <mtime_ns> <hash>   cabeçalho: o arquivo base
+#   INS <linha> <código>
+#   DEL <linha_i> <linha_f>
+#   SAVE <n>                              fim de um lote de n alterações
+# Um lote sem o "SAVE" final (gravação interrompida) é ignorado.
+# ---------------------------------------------------------------------
+
+JOURNAL_MAGIC = "MEPAJ-2"
+
+
+def journal_path(path: str) -> str:
+    """Caminho do diário do SAVE incremental de um arquivo .mepa."""
+    return path + ".journal"
+
+
+def file_identity(path: str) -> Tuple[int, int]:
+    """(tamanho, mtime_ns) do arquivo: muda a cada regravação."""
+    st = os.stat(path)
+    return st.st_size, st.st_mtime_ns
+
+
+def journal_base(path: str, data: Optional[bytes] = None) -> Tuple[int, int, str]:
+    """
+    Identidade do arquivo base do diário: (tamanho, mtime_ns, hash do
+    conteúdo). O hash pega também o que não muda o tamanho nem a data
+    (uma cópia que preserva a data, um relógio de pouca resolução...).
+    'data' é o conteúdo a que as alterações do diário se aplicam, se já
+    estiver em memória (o programa lido pelo LOAD); senão o arquivo é
+    lido.
+    """
+    with open(path, "rb") as f:
+        st = os.fstat(f.fileno())
+        if data is None:
+            data = f.read()
+    return st.st_size, st.st_mtime_ns, file_digest(data).hex()
+
+
+def read_journal(path: str, base: Tuple[int, int, str]
+                 ) -> Tuple[List[tuple], int, List[str]]:
+    """
+    Lê o diário de 'path'. Devolve (alterações dos lotes completos,
+    bytes do diário até o fim do último lote completo, avisos). Se o
+    diário não existir, ou for de outra versão do arquivo base, não há
+    alterações; no segundo caso o tamanho volta -1 (o próximo SAVE tem
+    de ser completo).
+    """
+    try:
+        with open(journal_path(path), "rb") as f:
+            data = f.read()
+    except FileNotFoundError:
+        return [], 0, []
+    if not data:
+        return [], 0, []
+    lines = data.split(b"\n")
+    header = " ".join(map(str, (JOURNAL_MAGIC,) + base))
+    if lines[0].decode("utf-8", "replace") != header:
+        return [], -1, [f"Aviso: o diário '{journal_path(path)}' não corresponde "
+                        f"ao arquivo (alterado fora do interpretador?); ignorado. "
+                        f"O próximo SAVE regrava o arquivo inteiro."]
+    edits: List[tuple] = []
+    batch: List[tuple] = []
+    valid = pos = len(lines[0]) + 1
+    for raw in lines[1:-1]:  # o último pedaço vem depois do último '\n'
+        pos += len(raw) + 1
+        kind, _, rest = raw.decode("utf-8", "replace").partition(" ")
+        try:
+            if kind == "INS":
+                num, _, code = rest.partition(" ")
+                batch.append(("INS", int(num), code))
+            elif kind == "DEL":
+                first, last = rest.split()
+                batch.append(("DEL", int(first), int(last)))
+            elif kind == "SAVE" and int(rest) == len(batch):
+                edits.extend(batch)
+                batch = []
+                valid = pos
+            else:
+                break
+        except ValueError:
+            break
+    warnings = []
+    if valid < len(data):
+        warnings.append(f"Aviso: o último SAVE do diário '{journal_path(path)}' "
+                        f"ficou incompleto; suas alterações foram ignoradas.")
+    return edits, valid, warnings
+
+
+def append_journal(path: str, base: Tuple[int, int, str], edits: List[tuple],
+                   size: int) -> int:
+    """
+    Acrescenta um lote de alterações ao diário ('size' = fim do último
+    lote completo, 0 se ainda não existe) e devolve o novo tamanho. O
+    que houver depois de 'size' (um lote interrompido) é descartado. O
+    lote só vale depois do fsync: antes disso, para o LOAD, ele não
+    existe.
+    """
+    out = []
+    if size == 0:
+        out.append(" ".join(map(str, (JOURNAL_MAGIC,) + base)) + "\n")
+    for edit in edits:
+        if edit[0] == "INS":
+            out.append(f"INS {edit[1]} {edit[2]}\n")
+        else:
+            out.append(f"DEL {edit[1]} {edit[2]}\n")
+    out.append(f"SAVE {len(edits)}\n")
+    data = "".join(out).encode("utf-8")
+    # "w" na primeira vez: descarta sobras de um diário que não valia
+    with open(journal_path(path), "r+b" if size > 0 else "wb") as f:
+        f.seek(size)
+        f.truncate()
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    return size + len(data)
+
+
+# ---------------------------------------------------------------------
+# Cache compilado em disco (.mepac), no mesmo espírito do .pyc:
+# fica ao lado do .mepa ("prog.mepa" -> "prog.mepac") e guarda a tabela
+# de linhas (números + posição do código no arquivo) e a forma
+# compilada (AST) de cada linha já compilada. Só é usado se o tamanho,
+# a data de modificação e o hash do .mepa baterem com os gravados.
+# ---------------------------------------------------------------------
+
+MEPAC_MAGIC = "MEPAC-4"
+
+# instruções cuja forma é (tipo, texto, ast, closure)
+EXPR_KINDS = ("print", "if", "elseif", "while")
+
+
+def mepac_path(path: str) -> str:
+    """Caminho do cache compilado de um arquivo .mepa."""
+    return path + "c"
+
+
+def file_digest(data) -> bytes:
+    """Hash (blake2b) do conteúdo do arquivo."""
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+def serialize_instruction(instr: tuple) -> tuple:
+    """
+    Forma gravável (marshal) de uma instrução: sem a closure e sem os
+    slots, que dependem da sessão.
+    """
+    kind = instr[0]
+    if kind in EXPR_KINDS:
+        return instr[:3]
+    if kind == "assign" or kind == "for" or kind == "setindex":
+        return instr[:4]
+    return instr
+
+
+def deserialize_instruction(data: tuple, slot_of: Callable[[str], int]) -> tuple:
+    """
+    Refaz a instrução a partir da AST gravada, sem passar pelo parser,
+    resolvendo as variáveis com slot_of (ver compile_node).
+    """
+    kind = data[0]
+    if kind in EXPR_KINDS:
+        return data + (compile_node(data[2], slot_of),)
+    if kind == "assign":
+        return data + (slot_of(data[1]), compile_node(data[3], slot_of))
+    if kind == "for":
+        return data + (slot_of(data[1]),
+                       tuple(compile_node(node, slot_of) for node in data[3]))
+    if kind == "setindex":
+        return data + (compile_setindex(data[3], slot_of),)
+    return data
+
+
+def read_mepac(path: str
+               ) -> Optional[Tuple[ProgramStore, List[str], PrecompiledLines]]:
+    """
+    Tenta carregar o programa pelo .mepac. Retorna (programa, avisos,
+    instruções pré-compiladas) ou None se o cache não existir ou não
+    corresponder mais ao .mepa.
+    """
+    try:
+        with open(mepac_path(path), "rb") as f:
+            data = marshal.load(f)
+        (magic, tag, mtime_ns, size, digest, nums, starts, lens, text,
+         warnings, comp_nums, comp_offsets, comp_blob) = data
+    except (OSError, EOFError, ValueError, TypeError):
+        return None
+    st = os.stat(path)
+    if (magic != MEPAC_MAGIC or tag != sys.implementation.cache_tag
+            or mtime_ns != st.st_mtime_ns or size != st.st_size or size == 0):
+        return None
+    with open(path, "rb") as f:
+        buf = f.read()
+    if file_digest(buf) != digest:
+        return None
+    store = ProgramStore.from_buffer(buf, array("q", nums), array("q", starts),
+                                     array("L", lens))
+    store._text = bytearray(text)
+    compiled = PrecompiledLines(array("q", comp_nums), array("q", comp_offsets),
+                                comp_blob)
+    return store, warnings, compiled
+
+
+def write_mepac(path: str, store: ProgramStore, warnings: List[str],
+                compiled: Optional[Dict[int, bytes]] = None) -> bool:
+    """
+    Grava o .mepac de 'path'. 'store' precisa ter sido lido desse mesmo
+    arquivo, sem alterações; 'compiled' traz as instruções já
+    serializadas de cada linha. Retorna False se não conseguiu gravar
+    ou se o arquivo não tem mais os bytes do programa (o cache é só uma
+    otimização: a falha é ignorada).
+    """
+    entries = compiled or {}
+    comp_nums = array("q", sorted(entries))
+    blobs = [entries[n] for n in comp_nums]
+    comp_offsets = array("q", [0])
+    comp_offsets.extend(accumulate(map(len, blobs)))
+    try:
+        st = os.stat(path)
+        with open(path, "rb") as f:
+            contents = f.read()
+        if store._buf != contents:
+            return False
+        digest = file_digest(contents)
+        data = (MEPAC_MAGIC, sys.implementation.cache_tag, st.st_mtime_ns,
+                st.st_size, digest, store._nums.tobytes(),
+                store._starts.tobytes(), store._lens.tobytes(), bytes(store._text),
+                warnings, comp_nums.tobytes(), comp_offsets.tobytes(),
+                b"".join(blobs))
+        tmp = mepac_path(path) + ".tmp"
+        with open(tmp, "wb") as f:
+            marshal.dump(data, f)
+        os.replace(tmp, mepac_path(path))
+        return True
+    except (OSError, ValueError):
+        return False
+
+
+def load_program(path: str, cache_mode: str = "on"
+                 ) -> Tuple[ProgramStore, List[str], PrecompiledLines]:
+    """
+    Lê o programa de 'path', pelo .mepac quando ele é válido ou pelo
+    texto (parse_program_file) caso contrário. Com cache_mode "rebuild"
+    o .mepac existente é ignorado e regravado; com "off" ele não é lido
+    nem gravado.
+    """
+    if cache_mode == "on":
+        cached = read_mepac(path)
+        if cached is not None:
+            return cached
+    store, warnings = parse_program_file(path)
+    if cache_mode != "off" and len(store):
+        write_mepac(path, store, warnings)
+    return store, warnings, PrecompiledLines()
+
+
+# =====================================================================
+# 4. EXPRESSÕES (PARSER + AVALIADOR)
+# =====================================================================
+# As expressões da mini-Lua NÃO passam mais pelo eval do Python:
+# - tokenize: separa números, strings, nomes e operadores;
+# - parse_expression: parser por precedência (precedence climbing)
+#   que gera uma AST compacta de tuplas e já dobra constantes;
+# - compile_expression: transforma a AST em closures Python; cada
+#   variável é resolvida, na compilação, para uma posição fixa (slot)
+#   da memória da sessão, que é uma lista simples de valores;
+# - lua_*: operações com a semântica da Lua (coerção string->número,
+#   '..' para concatenação, '^' sempre real, comparações sem coerção,
+#   só nil e false são falsos, etc.).
+#
+# Formato da AST:
+#   ("k", valor)              constante (inclui true, false e nil)
+#   ("v", nome)               variável
+#   ("neg", e)                menos unário
+#   ("not", e)                not
+#   ("and", esq, dir)         and (com curto-circuito, como na Lua)
+#   ("or", esq, dir)          or  (idem)
+#   ("bin", op, esq, dir)     operador binário (+ - * / // % ^ ..
+#                             == ~= < <= > >=)
+#   ("table", (e1, e2, ...))  construtor de tabela {e1, e2, ...}
+#   ("index", t, chave)       t[chave]
+#   ("len", e)                #e (tamanho de tabela ou string)
+#
+# Tabelas (LuaTable) guardam a parte de índices 1..n em um array
+# compacto e o resto em um dicionário; as operações aritméticas com
+# tabelas são feitas elemento a elemento, de uma vez (table_arith).
+# =====================================================================
+
+
+class ParseError(Exception):
+    """Erro de sintaxe em uma expressão da mini-Lua."""
+
+
+NUMBER_TYPES = (int, float)
+
+# valor das posições de memória (slots) ainda não atribuídas
+UNDEFINED = object()
+
+TOKEN_RE = re.compile(r"""
+    \s*(?:
+      (?P<num>0[xX][0-9a-fA-F]+|(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)
+    | (?P<name>[A-Za-z_]\w*)
+    | (?P<str>"(?:[^"\\\n]|\\.)*"|'(?:[^'\\\n]|\\.)*')
+    | (?P<op>\.\.|//|==|~=|<=|>=|[-+*/%^()<>,=\[\]{}#])
+    )""", re.VERBOSE)
+
+STRING_ESCAPES = {"n": "\n", "t": "\t", "r": "\r", "\\": "\\",
+                  '"': '"', "'": "'", "0": "\0"}
+
+# precedência e associatividade (True = à direita), como na Lua
+BINARY_PREC = {
+    "or": (1, False),
+    "and": (2, False),
+    "==": (3, False), "~=": (3, False), "<": (3, False), "<=": (3, False),
+    ">": (3, False), ">=": (3, False),
+    "..": (4, True),
+    "+": (5, False), "-": (5, False),
+    "*": (6, False), "/": (6, False), "//": (6, False), "%": (6, False),
+    "^": (8, True),
+}
+UNARY_PREC = 7
+
+# palavras reservadas: não podem ser nomes de variável
+LUA_KEYWORDS = frozenset((
+    "and", "break", "do", "else", "elseif", "end", "false", "for",
+    "function", "goto", "if", "in", "local", "nil", "not", "or", "repeat",
+    "return", "then", "true", "until", "while",
+))
+KEYWORD_CONSTANTS = {"true": True, "false": False, "nil": None}
+
+
+def lua_type(value: object) -> str:
+    """Nome do tipo do valor, como a função type() da Lua."""
+    if value is None:
+        return "nil"
+    if isinstance(value, bool):
+        return "boolean"
+    if isinstance(value, NUMBER_TYPES):
+        return "number"
+    if isinstance(value, str):
+        return "string"
+    if type(value) is LuaTable:
+        return "table"
+    return type(value).__name__
+
+
+def lua_tostring(value: object) -> str:
+    """Converte número/string para texto como a Lua (3.0 -> '3.0')."""
+    if value is None or type(value) is bool:
+        return lua_repr(value)
+    if type(value) is float:
+        text = "%.14g" % value
+        if text.lstrip("-").isdigit():
+            text += ".0"
+        return text
+    return str(value)
+
+
+def lua_repr(value: object) -> object:
+    """nil/true/false como a Lua os escreve; os outros valores, intactos."""
+    if value is None:
+        return "nil"
+    if value is True:
+        return "true"
+    if value is False:
+        return "false"
+    return value
+
+
+def lua_truthy(value: object) -> bool:
+    """Na Lua, só nil e false são falsos (0 e "" são verdadeiros)."""
+    return value is not None and value is not False
+
+
+def str_to_number(text: str) -> Optional[object]:
+    """Converte uma string numérica (decimal ou 0x..) em número, ou None."""
+    text = text.strip()
+    base = 16 if text.lower().startswith(("0x", "-0x")) else 10
+    try:
+        return int(text, base)
+    except ValueError:
+        pass
+    try:
+        return float(text)
+    except ValueError:
+        return None
+
+
+def _tonumber(value: object) -> object:
+    """Coerção da Lua para operandos aritméticos."""
+    if type(value) in NUMBER_TYPES:
+        return value
+    if type(value) is str:
+        number = str_to_number(value)
+        if number is not None:
+            return number
+    raise TypeError(f"tentativa de aritmética com valor do tipo {lua_type(value)}")
+
+
+def lua_add(a, b):
+    if type(a) not in NUMBER_TYPES or type(b) not in NUMBER_TYPES:
+        if type(a) is LuaTable or type(b) is LuaTable:
+            return table_arith("+", a, b)
+        a, b = _tonumber(a), _tonumber(b)
+    return a + b
+
+
+def lua_sub(a, b):
+    if type(a) not in NUMBER_TYPES or type(b) not in NUMBER_TYPES:
+        if type(a) is LuaTable or type(b) is LuaTable:
+            return table_arith("-", a, b)
+        a, b = _tonumber(a), _tonumber(b)
+    return a - b
+
+
+def lua_mul(a, b):
+    if type(a) not in NUMBER_TYPES or type(b) not in NUMBER_TYPES:
+        if type(a) is LuaTable or type(b) is LuaTable:
+            return table_arith("*", a, b)
+        a, b = _tonumber(a), _tonumber(b)
+    return a * b
+
+
+def lua_div(a, b):
+    if type(a) not in NUMBER_TYPES or type(b) not in NUMBER_TYPES:
+        if type(a) is LuaTable or type(b) is LuaTable:
+            return table_arith("/", a, b)
+        a, b = _tonumber(a), _tonumber(b)
+    return a / b
+
+
+def lua_idiv(a, b):
+    if type(a) not in NUMBER_TYPES or type(b) not in NUMBER_TYPES:
+        if type(a) is LuaTable or type(b) is LuaTable:
+            return table_arith("//", a, b)
+        a, b = _tonumber(a), _tonumber(b)
+    return a // b
+
+
+def lua_mod(a, b):
+    if type(a) not in NUMBER_TYPES or type(b) not in NUMBER_TYPES:
+        if type(a) is LuaTable or type(b) is LuaTable:
+            return table_arith("%", a, b)
+        a, b = _tonumber(a), _tonumber(b)
+    return a % b
+
+
+def lua_pow(a, b):
+    # na Lua, '^' sempre produz um número real
+    if type(a) not in NUMBER_TYPES or type(b) not in NUMBER_TYPES:
+        if type(a) is LuaTable or type(b) is LuaTable:
+            return table_arith("^", a, b)
+        a, b = _tonumber(a), _tonumber(b)
+    return math.pow(a, b)
+
+
+def lua_concat(a, b):
+    if type(a) is str and type(b) is str:
+        return a + b
+    for v in (a, b):
+        if type(v) not in NUMBER_TYPES and type(v) is not str:
+            raise TypeError(f"tentativa de concatenar valor do tipo {lua_type(v)}")
+    return lua_tostring(a) + lua_tostring(b)
+
+
+def lua_neg(a):
+    if type(a) not in NUMBER_TYPES:
+        if type(a) is LuaTable:
+            return table_neg(a)
+        a = _tonumber(a)
+    return -a
+
+
+def lua_eq(a, b):
+    # sem coerção: 1 == "1" é falso; true não é igual a 1
+    if type(a) is bool or type(b) is bool:
+        return a is b
+    return a == b
+
+
+def lua_ne(a, b):
+    return not lua_eq(a, b)
+
+
+def _check_order(a, b) -> None:
+    """Só números com números e strings com strings podem ser ordenados."""
+    if type(a) in NUMBER_TYPES and type(b) in NUMBER_TYPES:
+        return
+    if type(a) is str and type(b) is str:
+        return
+    raise TypeError(f"tentativa de comparar {lua_type(a)} com {lua_type(b)}")
+
+
+def lua_lt(a, b):
+    _check_order(a, b)
+    return a < b
+
+
+def lua_le(a, b):
+    _check_order(a, b)
+    return a <= b
+
+
+def lua_gt(a, b):
+    _check_order(a, b)
+    return a > b
+
+
+def lua_ge(a, b):
+    _check_order(a, b)
+    return a >= b
+
+
+BINARY_FUNCS = {
+    "+": lua_add, "-": lua_sub, "*": lua_mul, "/": lua_div,
+    "//": lua_idiv, "%": lua_mod, "^": lua_pow, "..": lua_concat,
+    "==": lua_eq, "~=": lua_ne, "<": lua_lt, "<=": lua_le,
+    ">": lua_gt, ">=": lua_ge,
+}
+
+
+# ---------------------------------------------------------------------
+# Tabelas
+# ---------------------------------------------------------------------
+
+# quantos elementos o STACK mostra de cada tabela
+TABLE_PREVIEW = 10
+
+
+def compact_values(values) -> object:
+    """
+    Guarda uma sequência de valores do jeito mais compacto: array('q')
+    se todos forem inteiros, array('d') se todos forem reais e lista
+    nos outros casos (misturas, strings, tabelas...).
+    """
+    kinds = set(map(type, values))
+    if kinds <= {int}:  # {} também: a tabela vazia ainda pode ser tipada
+        try:
+            return array("q", values)
+        except OverflowError:
+            pass  # inteiro grande demais para 64 bits
+    elif kinds == {float}:
+        return array("d", values)
+    return list(values)
+
+
+class LuaTable:
+    """
+    Tabela da Lua. A parte de índices inteiros contíguos 1..n fica em
+    'array' (ver compact_values: 8 bytes por número, sem um objeto
+    Python por elemento); as outras chaves ficam em 'hash'. Invariante:
+    'hash' nunca tem as chaves inteiras 1..n+1, de modo que #t = n.
+    Tabelas são comparadas por identidade, como na Lua.
+    """
+
+    __slots__ = ("array", "hash")
+
+    def __init__(self, values=()) -> None:
+        values = list(values)
+        self.hash: Dict[object, object] = {}
+        # {1, nil, 3}: a sequência termina no primeiro nil
+        if None in values:
+            cut = values.index(None)
+            for i, value in enumerate(values[cut + 1:], cut + 2):
+                if value is not None:
+                    self.hash[i] = value
+            del values[cut:]
+        self.array = compact_values(values)
+
+    def __str__(self) -> str:
+        return f"table: 0x{id(self):08x}"
+
+    def __repr__(self) -> str:
+        """Resumo para o STACK: os primeiros elementos e o tamanho."""
+        arr = self.array
+        shown = [_table_item(v) for v in islice(arr, TABLE_PREVIEW)]
+        for key, value in islice(self.hash.items(), TABLE_PREVIEW):
+            key = key[1] if type(key) is tuple else key  # chave booleana
+            shown.append(f"[{_table_item(key)}] = {_table_item(value)}")
+        total = len(arr) + len(self.hash)
+        if total > len(shown):
+            shown.append(f"... +{total - len(shown)}")
+        text = "{" + ", ".join(shown) + "}"
+        if total > TABLE_PREVIEW:
+            kind = arr.typecode if type(arr) is array else "objetos"
+            text += (f"  ({len(arr)} no array [{kind}], {len(self.hash)} no hash,"
+                     f" ~{self.nbytes() / 1024:.0f} KB)")
+        return text
+
+    def nbytes(self) -> int:
+        """Tamanho aproximado em memória (sem contar tabelas internas)."""
+        return sys.getsizeof(self.array) + sys.getsizeof(self.hash)
+
+    def get(self, key: object) -> object:
+        """t[key] (nil se a chave não existir)."""
+        kind = type(key)
+        if kind is int:
+            if 0 < key <= len(self.array):
+                return self.array[key - 1]
+        elif kind is float and key.is_integer():
+            return self.get(int(key))
+        elif kind is bool:
+            key = (bool, key)  # True == 1 no Python, mas não na Lua
+        return self.hash.get(key)
+
+    def set(self, key: object, value: object) -> None:
+        """t[key] = value (value nil remove a chave)."""
+        kind = type(key)
+        if kind is float:
+            if key.is_integer():
+                key, kind = int(key), int
+            elif key != key:
+                raise ValueError("índice da tabela é NaN")
+        elif key is None:
+            raise ValueError("índice da tabela é nil")
+        elif kind is bool:
+            key = (bool, key)
+        n = len(self.array)
+        if kind is int and 0 < key <= n + 1:
+            if value is None:
+                if key <= n:
+                    # buraco: o que vem depois passa para a parte hash
+                    for i, v in enumerate(self.array[key:], key + 1):
+                        self.hash[i] = v
+                    del self.array[key - 1:]
+                return
+            self._store(key - 1, value)
+            if key == n + 1 and self.hash:
+                # a sequência cresceu: traz as chaves seguintes do hash
+                key += 1
+                while key in self.hash:
+                    self._store(key - 1, self.hash.pop(key))
+                    key += 1
+            return
+        if value is None:
+            self.hash.pop(key, None)
+        else:
+            self.hash[key] = value
+
+    def _store(self, index: int, value: object) -> None:
+        """array[index] = value (ou append, se index == n), mudando o
+        armazenamento para lista se o valor não couber no array tipado."""
+        arr = self.array
+        if type(arr) is array:
+            kind = type(value)
+            code = "q" if kind is int else "d" if kind is float else None
+            if not arr and code is not None and arr.typecode != code:
+                arr = self.array = array(code)
+            if code == arr.typecode:
+                try:
+                    if index == len(arr):
+                        arr.append(value)
+                    else:
+                        arr[index] = value
+                    return
+                except OverflowError:
+                    pass
+            arr = self.array = arr.tolist()
+        if index == len(arr):
+            arr.append(value)
+        else:
+            arr[index] = value
+
+
+def _table_item(value: object) -> str:
+    """Um elemento no resumo de LuaTable (tabelas internas abreviadas)."""
+    if type(value) is LuaTable:
+        return "{...}"
+    return str(lua_repr(value)) if value is None or type(value) is bool else repr(value)
+
+
+def lua_index(obj: object, key: object) -> object:
+    if type(obj) is not LuaTable:
+        raise TypeError(f"tentativa de indexar valor do tipo {lua_type(obj)}")
+    return obj.get(key)
+
+
+def lua_setindex(obj: object, key: object, value: object) -> None:
+    if type(obj) is not LuaTable:
+        raise TypeError(f"tentativa de indexar valor do tipo {lua_type(obj)}")
+    obj.set(key, value)
+
+
+def lua_len(value: object) -> int:
+    """#valor: tamanho da sequência de uma tabela ou bytes de uma string."""
+    if type(value) is LuaTable:
+        return len(value.array)
+    if type(value) is str:
+        return len(value.encode("utf-8"))
+    raise TypeError(f"tentativa de obter o tamanho de valor do tipo {lua_type(value)}")
+
+
+# operador -> (operação do Python para arrays tipados, operação da Lua)
+TABLE_ARITH = {
+    "+": (add, lua_add), "-": (sub, lua_sub), "*": (mul, lua_mul),
+    "/": (truediv, lua_div), "//": (floordiv, lua_idiv), "%": (mod, lua_mod),
+    "^": (math.pow, lua_pow),
+}
+
+
+def _array_table(arr: "array") -> LuaTable:
+    """Tabela cuja parte array é 'arr' (já compacta)."""
+    table = LuaTable()
+    table.array = arr
+    return table
+
+
+def table_arith(op: str, a: object, b: object) -> LuaTable:
+    """
+    Operação aritmética elemento a elemento sobre a parte array de
+    tabelas: tabela com tabela do mesmo tamanho, ou tabela com número.
+    Com arrays tipados (ver compact_values), a conta toda é um único
+    map com o operador do Python, sem passar pelo laço do interpretador,
+    e o resultado também sai compacto. Nos outros casos, cada elemento
+    passa pela operação da Lua (coerção de strings, erros...).
+    """
+    fast, slow = TABLE_ARITH[op]
+    tables = [x.array for x in (a, b) if type(x) is LuaTable]
+    scalar = None
+    if len(tables) == 2:
+        if len(tables[0]) != len(tables[1]):
+            raise ValueError(f"'{op}' entre tabelas de tamanhos diferentes "
+                             f"({len(tables[0])} e {len(tables[1])})")
+    else:
+        scalar = _tonumber(b if type(a) is LuaTable else a)
+    n = len(tables[0])
+
+    def operands():
+        if scalar is None:
+            return tables
+        if type(a) is LuaTable:
+            return tables[0], repeat(scalar, n)
+        return repeat(scalar, n), tables[0]
+
+    if all(type(x) is array for x in tables):
+        codes = {x.typecode for x in tables}
+        floats = op in ("/", "^") or "d" in codes or type(scalar) is float
+        try:
+            return _array_table(array("d" if floats else "q",
+                                      map(fast, *operands())))
+        except ArithmeticError:
+            # inteiros além de 64 bits, divisão por zero...: refaz
+            # elemento a elemento, com as operações (e erros) da Lua
+            pass
+    return LuaTable(map(slow, *operands()))
+
+
+def table_neg(t: LuaTable) -> LuaTable:
+    """-t elemento a elemento."""
+    arr = t.array
+    if type(arr) is array:
+        try:
+            return _array_table(array(arr.typecode, map(neg, arr)))
+        except OverflowError:
+            pass
+    return LuaTable(map(lua_neg, arr))
+
+
+def tokenize(expr: str) -> List[Tuple[str, str]]:
+    """Quebra a expressão em tokens (tipo, texto)."""
+    tokens = []
+    pos = 0
+    end = len(expr.rstrip())
+    while pos < end:
+        m = TOKEN_RE.match(expr, pos)
+        if m is None or m.end() == pos:
+            bad = expr[pos:].strip()[:1]
+            raise ParseError(f"símbolo inesperado '{bad}'")
+        kind = m.lastgroup
+        tokens.append((kind, m.group(kind)))
+        pos = m.end()
+    return tokens
+
+
+def _parse_string(text: str) -> str:
+    """Remove as aspas e trata as sequências de escape."""
+    body = text[1:-1]
+    if "\\" not in body:
+        return body
+    out = []
+    i = 0
+    while i < len(body):
+        ch = body[i]
+        if ch == "\\" and i + 1 < len(body):
+            out.append(STRING_ESCAPES.get(body[i + 1], body[i + 1]))
+            i += 2
+        else:
+            out.append(ch)
+            i += 1
+    return "".join(out)
+
+
+def _parse_number(text: str) -> object:
+    if text[:2] in ("0x", "0X"):
+        return int(text, 16)
+    if "." in text or "e" in text or "E" in text:
+        return float(text)
+    return int(text)
+
+
+def make_binary(op: str, left: tuple, right: tuple) -> tuple:
+    """Cria o nó binário, dobrando a conta se os dois lados forem constantes."""
+    if left[0] == "k" and right[0] == "k":
+        try:
+            return ("k", BINARY_FUNCS[op](left[1], right[1]))
+        except Exception:
+            pass  # o erro fica para a execução, na linha certa
+    return ("bin", op, left, right)
+
+
+def make_negation(operand: tuple) -> tuple:
+    if operand[0] == "k":
+        try:
+            return ("k", lua_neg(operand[1]))
+        except Exception:
+            pass
+    return ("neg", operand)
+
+
+def make_logical(op: str, left: tuple, right: tuple) -> tuple:
+    """and/or; com o lado esquerdo constante, o resultado já é conhecido."""
+    if left[0] == "k":
+        if lua_truthy(left[1]):
+            return right if op == "and" else left
+        return left if op == "and" else right
+    return (op, left, right)
+
+
+def make_not(operand: tuple) -> tuple:
+    if operand[0] == "k":
+        return ("k", not lua_truthy(operand[1]))
+    return ("not", operand)
+
+
+def make_length(operand: tuple) -> tuple:
+    if operand[0] == "k" and type(operand[1]) is str:
+        return ("k", lua_len(operand[1]))
+    return ("len", operand)
+
+
+class _Parser:
+    """Parser por precedência sobre a lista de tokens."""
+
+    __slots__ = ("tokens", "pos")
+
+    def __init__(self, tokens: List[Tuple[str, str]]) -> None:
+        self.tokens = tokens
+        self.pos = 0
+
+    def peek(self) -> Optional[Tuple[str, str]]:
+        if self.pos < len(self.tokens):
+            return self.tokens[self.pos]
+        return None
+
+    def advance(self) -> Tuple[str, str]:
+        tok = self.peek()
+        if tok is None:
+            raise ParseError("fim inesperado da expressão")
+        self.pos += 1
+        return tok
+
+    def expression(self, min_prec: int = 0) -> tuple:
+        left = self.unary()
+        while True:
+            tok = self.peek()
+            if (tok is None or tok[1] not in BINARY_PREC
+                    or tok[0] not in ("op", "name")):
+                return left
+            prec, right_assoc = BINARY_PREC[tok[1]]
+            if prec < min_prec:
+                return left
+            self.pos += 1
+            right = self.expression(prec if right_assoc else prec + 1)
+            if tok[1] in ("and", "or"):
+                left = make_logical(tok[1], left, right)
+            else:
+                left = make_binary(tok[1], left, right)
+
+    def unary(self) -> tuple:
+        tok = self.peek()
+        if tok == ("op", "-"):
+            self.pos += 1
+            return make_negation(self.expression(UNARY_PREC))
+        if tok == ("name", "not"):
+            self.pos += 1
+            return make_not(self.expression(UNARY_PREC))
+        if tok == ("op", "#"):
+            self.pos += 1
+            return make_length(self.expression(UNARY_PREC))
+        return self.primary()
+
+    def expect(self, text: str) -> None:
+        if self.advance() != ("op", text):
+            raise ParseError(f"esperado '{text}'")
+
+    def suffixes(self, node: tuple) -> tuple:
+        """Índices depois de um nome ou parênteses: t[i][j]."""
+        while self.peek() == ("op", "["):
+            self.pos += 1
+            key = self.expression()
+            self.expect("]")
+            node = ("index", node, key)
+        return node
+
+    def table(self) -> tuple:
+        """Construtor {e1, e2, ...} (o '{' já foi lido)."""
+        items: List[tuple] = []
+        while self.peek() != ("op", "}"):
+            items.append(self.expression())
+            if self.peek() != ("op", "}"):
+                self.expect(",")
+        self.pos += 1
+        return ("table", tuple(items))
+
+    def primary(self) -> tuple:
+        kind, text = self.advance()
+        if kind == "num":
+            return ("k", _parse_number(text))
+        if kind == "str":
+            return ("k", _parse_string(text))
+        if kind == "name":
+            if text in KEYWORD_CONSTANTS:
+                return ("k", KEYWORD_CONSTANTS[text])
+            if text in LUA_KEYWORDS:
+                raise ParseError(f"símbolo inesperado '{text}'")
+            return self.suffixes(("v", text))
+        if text == "(":
+            node = self.expression()
+            self.expect(")")
+            return self.suffixes(node)
+        if text == "{":
+            return self.table()
+        raise ParseError(f"símbolo inesperado '{text}'")
+
+
+# profundidade máxima da AST de uma expressão (o Lua também tem um
+# limite de 200 níveis): mais funda, ela estouraria a pilha do Python no
+# parser, na geração das closures, na execução ou na compilação MEPA
+MAX_EXPRESSION_DEPTH = 200
+
+
+def expression_depth(node: tuple) -> int:
+    """Profundidade da AST, sem recursão (a própria AST pode ser funda)."""
+    depth = 0
+    stack = [(node, 1)]
+    while stack:
+        node, level = stack.pop()
+        depth = max(depth, level)
+        kind = node[0]
+        if kind == "k" or kind == "v":
+            continue
+        if kind == "bin":
+            children = node[2:]
+        elif kind == "table":
+            children = node[1]
+        else:  # neg, not, len, and, or, index
+            children = node[1:]
+        stack.extend(zip(children, repeat(level + 1)))
+    return depth
+
+
+def _parse_all(text: str, many: bool) -> List[tuple]:
+    """
+    Expressões de 'text' (uma, ou várias separadas por vírgula com
+    'many'). Uma expressão funda demais (ver MAX_EXPRESSION_DEPTH) é
+    erro de sintaxe, não um RecursionError no meio do RUN.
+    """
+    tokens = tokenize(text)
+    parser = _Parser(tokens)
+    try:
+        nodes = [parser.expression()]
+        while many and parser.peek() == ("op", ","):
+            parser.pos += 1
+            nodes.append(parser.expression())
+    except (RecursionError, MemoryError):
+        raise ParseError("expressão aninhada demais") from None
+    tok = parser.peek()
+    if tok is not None:
+        raise ParseError(f"símbolo inesperado '{tok[1]}'")
+    # cada nível da AST gasta ao menos um símbolo: só expressões longas
+    # precisam ser medidas
+    if (len(tokens) > MAX_EXPRESSION_DEPTH
+            and max(map(expression_depth, nodes)) > MAX_EXPRESSION_DEPTH):
+        raise ParseError("expressão aninhada demais")
+    return nodes
+
+
+def parse_expression(expr: str) -> tuple:
+    """Converte o texto da expressão em AST (com constantes dobradas)."""
+    return _parse_all(expr, False)[0]
+
+
+def split_assignment(text: str) -> Tuple[str, str]:
+    """
+    Separa 't[i] = expr' no primeiro '=' que é mesmo atribuição (e não
+    parte de '==', '<=', ... dentro do índice).
+    """
+    pos = 0
+    end = len(text)
+    while pos < end:
+        m = TOKEN_RE.match(text, pos)
+        if m is None or m.end() == pos:
+            break
+        if m.group("op") == "=":
+            return text[:m.start("op")].strip(), text[m.end():].strip()
+        pos = m.end()
+    raise ParseError("esperado '='")
+
+
+def parse_expression_list(text: str) -> List[tuple]:
+    """Expressões separadas por vírgula (cabeçalho do for numérico)."""
+    return _parse_all(text, True)
+
+
+def substitute_constants(node: tuple, known: Dict[str, object]) -> tuple:
+    """
+    Troca as variáveis de valor conhecido ('known': nome -> valor) por
+    constantes, dobrando de novo o que ficar constante. Devolve o
+    próprio 'node' se nada mudou (usado pelo OPT, ver optimize_flow).
+    """
+    kind = node[0]
+    if kind == "k":
+        return node
+    if kind == "v":
+        return ("k", known[node[1]]) if node[1] in known else node
+    if kind == "neg" or kind == "not" or kind == "len":
+        operand = substitute_constants(node[1], known)
+        if operand is node[1]:
+            return node
+        make = {"neg": make_negation, "not": make_not, "len": make_length}[kind]
+        return make(operand)
+    if kind == "table":
+        items = tuple(substitute_constants(item, known) for item in node[1])
+        if all(map(operator_is, items, node[1])):
+            return node
+        return ("table", items)
+    left, right = node[-2], node[-1]
+    new_left = substitute_constants(left, known)
+    new_right = substitute_constants(right, known)
+    if new_left is left and new_right is right:
+        return node
+    if kind == "index":
+        return ("index", new_left, new_right)
+    if kind == "and" or kind == "or":
+        return make_logical(kind, new_left, new_right)
+    return make_binary(node[1], new_left, new_right)
+
+
+# Fábricas de closures para os operadores aritméticos. Cada fábrica é
+# gerada UMA vez, ao importar o módulo, a partir do modelo abaixo: o
+# caminho rápido (dois números) usa o operador do Python direto e só os
+# outros casos (coerção de strings, erros) chamam a função lua_*.
+# Operandos que são variável (mem[slot]) ou constante são lidos "em
+# linha", sem chamar outra closure. Variável não atribuída (UNDEFINED)
+# não é número: o teste só acontece fora do caminho rápido — a não ser
+# que o lado direito seja outra closure, que pode dar um erro próprio:
+# aí a variável da esquerda é testada antes, como na VM (e no Lua), que
+# avaliam da esquerda para a direita.
+_FACTORY_TEMPLATE = """
+def factory(fl, fr, kl, kr, slow, NT, U, nl, nr):
+    def closure(mem):
+        a = {left}{check}
+        b = {right}
+        if type(a) in NT and type(b) in NT:
+            return a {op} b
+        if a is U:
+            raise NameError(f"name '{{nl}}' is not defined")
+        if b is U:
+            raise NameError(f"name '{{nr}}' is not defined")
+        return slow(a, b)
+    return closure
+"""
+_OPERAND_CODE = {"f": "{side}(mem)", "v": "mem[k{side_k}]", "k": "k{side_k}"}
+_LEFT_CHECK = """
+        if a is U:
+            raise NameError(f"name '{nl}' is not defined")"""
+# operador da mini-Lua -> operador do Python no caminho rápido (números)
+FAST_OPS = {"+": "+", "-": "-", "*": "*", "/": "/", "//": "//", "%": "%",
+            "==": "==", "~=": "!=", "<": "<", "<=": "<=", ">": ">", ">=": ">="}
+_CLOSURE_FACTORIES: Dict[Tuple[str, str, str], Callable] = {}
+
+
+def _build_closure_factories() -> None:
+    for op, py_op in FAST_OPS.items():
+        for lk in "fvk":
+            for rk in "fvk":
+                src = _FACTORY_TEMPLATE.format(
+                    op=py_op,
+                    left=_OPERAND_CODE[lk].format(side="fl", side_k="l"),
+                    right=_OPERAND_CODE[rk].format(side="fr", side_k="r"),
+                    check=_LEFT_CHECK if lk == "v" and rk == "f" else "",
+                )
+                scope: dict = {}
+                exec(src, scope)
+                _CLOSURE_FACTORIES[(op, lk, rk)] = scope["factory"]
+
+
+_build_closure_factories()
+
+
+# ---------------------------------------------------------------------
+# Versões especializadas por tipo (ver Interpreter.specialized_ops)
+# ---------------------------------------------------------------------
+# Uma linha de conta (x = (a * 3 + b) % 1000, while i < n) em que todas
+# as variáveis só tiveram inteiros (ou só reais) vira UMA função gerada
+# com a conta inteira em linha: em vez de uma closure por operador, cada
+# uma testando os tipos, os tipos são testados uma vez na entrada
+# (guarda). Se a guarda falhar (ou a conta der erro), a função devolve
+# False/None e a linha roda pelo caminho genérico, que dá o resultado
+# ou o erro de sempre: com números nos dois lados, os operadores do
+# Python são exatamente os do caminho rápido das closures.
+SPEC_ARITH_OPS = ("+", "-", "*", "/", "//", "%")
+SPEC_COMPARE_OPS = ("==", "~=", "<", "<=", ">", ">=")
+_SPEC_TEMPLATE = """
+def factory(T, {consts}):
+    def specialized(mem):
+{loads}
+        if {guards}:
+            try:
+                {body}
+            except Exception:
+                return {failed}
+            return {done}
+        return {failed}
+    return specialized
+"""
+
+
+def specializable(node: tuple, compare: bool = False) -> bool:
+    """
+    A expressão só tem contas (+ - * / // %, menos unário) sobre
+    variáveis e constantes numéricas? Com compare=True, a raiz também
+    pode ser uma comparação entre duas contas (condição de if/while).
+    """
+    kind = node[0]
+    if kind == "v":
+        return True
+    if kind == "k":
+        return type(node[1]) in NUMBER_TYPES
+    if kind == "neg":
+        return specializable(node[1])
+    if kind == "bin":
+        if node[1] in SPEC_ARITH_OPS or (compare and node[1] in SPEC_COMPARE_OPS):
+            return specializable(node[2]) and specializable(node[3])
+    return False
+
+
+def expression_slots(node: tuple, slot_of: Callable[[str], int]) -> List[int]:
+    """Slots das variáveis lidas por 'node', sem repetição, em ordem."""
+    slots: List[int] = []
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        if node[0] == "v":
+            slot = slot_of(node[1])
+            if slot not in slots:
+                slots.append(slot)
+        elif node[0] in ("neg", "bin"):
+            stack.extend(reversed([part for part in node[1:] if type(part) is tuple]))
+    return slots
+
+
+def compile_specialized(node: tuple, slot_of: Callable[[str], int],
+                        number_type: type, target: Optional[int] = None
+                        ) -> Callable[[list], object]:
+    """
+    Função especializada (ver acima) para 'node', com guarda de que
+    todas as variáveis são do tipo number_type (int ou float).
+    Com 'target' (atribuição), grava o valor em mem[target] e devolve
+    True; sem ele (condição), devolve o resultado da comparação. Se a
+    guarda falhar, devolve False (atribuição) ou None (condição).
+    """
+    slots = expression_slots(node, slot_of)
+    names = {slot: f"v{i}" for i, slot in enumerate(slots)}
+    consts: List[object] = []
+
+    def source(node: tuple) -> str:
+        kind = node[0]
+        if kind == "v":
+            return names[slot_of(node[1])]
+        if kind == "k":
+            consts.append(node[1])
+            return f"k{len(consts) - 1}"
+        if kind == "neg":
+            return f"(-{source(node[1])})"
+        return f"({source(node[2])} {FAST_OPS[node[1]]} {source(node[3])})"
+
+    expr = source(node)
+    src = _SPEC_TEMPLATE.format(
+        consts=", ".join(f"k{i}" for i in range(len(consts))),
+        loads="\n".join(f"        {names[slot]} = mem[{slot}]" for slot in slots),
+        guards=" and ".join(f"type({names[slot]}) is T" for slot in slots),
+        body=f"mem[{target}] = {expr}" if target is not None else f"return {expr}",
+        failed="False" if target is not None else "None",
+        done="True" if target is not None else "None",
+    )
+    scope: dict = {}
+    exec(src, scope)
+    return scope["factory"](number_type, *consts)
+
+
+def compile_node(node: tuple,
+                 slot_of: Callable[[str], int]) -> Callable[[list], object]:
+    """
+    Gera a closure que calcula 'node' a partir da memória de variáveis
+    (lista de valores). slot_of dá a posição fixa de cada nome.
+    """
+    kind = node[0]
+    if kind == "k":
+        value = node[1]
+        return lambda mem: value
+    if kind == "v":
+        name = node[1]
+        slot = slot_of(name)
+
+        def load(mem):
+            value = mem[slot]
+            if value is UNDEFINED:
+                raise NameError(f"name '{name}' is not defined")
+            return value
+        return load
+    if kind == "neg":
+        operand = compile_node(node[1], slot_of)
+
+        def negate(mem):
+            a = operand(mem)
+            if type(a) in NUMBER_TYPES:
+                return -a
+            return lua_neg(a)
+        return negate
+    if kind == "not":
+        operand = compile_node(node[1], slot_of)
+
+        def negation(mem):
+            a = operand(mem)
+            return a is None or a is False
+        return negation
+    if kind == "index":
+        fo, fk = compile_node(node[1], slot_of), compile_node(node[2], slot_of)
+
+        def index(mem):
+            t = fo(mem)
+            k = fk(mem)
+            # caminho rápido: t[i] com i dentro da parte array
+            if type(t) is LuaTable and type(k) is int and 0 < k <= len(t.array):
+                return t.array[k - 1]
+            return lua_index(t, k)
+        return index
+    if kind == "len":
+        operand = compile_node(node[1], slot_of)
+        return lambda mem: lua_len(operand(mem))
+    if kind == "table":
+        items = [compile_node(item, slot_of) for item in node[1]]
+        return lambda mem: LuaTable([f(mem) for f in items])
+    if kind == "and" or kind == "or":
+        fl, fr = compile_node(node[1], slot_of), compile_node(node[2], slot_of)
+        if kind == "and":
+            def conjunction(mem):
+                a = fl(mem)
+                if a is None or a is False:
+                    return a
+                return fr(mem)
+            return conjunction
+
+        def disjunction(mem):
+            a = fl(mem)
+            if a is None or a is False:
+                return fr(mem)
+            return a
+        return disjunction
+
+    # ("bin", op, esq, dir)
+    op, left, right = node[1], node[2], node[3]
+    if op in FAST_OPS:
+        lk = left[0] if left[0] in ("k", "v") else "f"
+        rk = right[0] if right[0] in ("k", "v") else "f"
+        factory = _CLOSURE_FACTORIES[(op, lk, rk)]
+        return factory(
+            compile_node(left, slot_of) if lk == "f" else None,
+            compile_node(right, slot_of) if rk == "f" else None,
+            _operand_key(left, lk, slot_of),
+            _operand_key(right, rk, slot_of),
+            BINARY_FUNCS[op],
+            NUMBER_TYPES,
+            UNDEFINED,
+            left[1] if lk == "v" else None,
+            right[1] if rk == "v" else None,
+        )
+    func = BINARY_FUNCS[op]
+    fl, fr = compile_node(left, slot_of), compile_node(right, slot_of)
+    return lambda mem: func(fl(mem), fr(mem))
+
+
+def _operand_key(node: tuple, kind: str, slot_of: Callable[[str], int]):
+    """Argumento 'k' da fábrica: o slot da variável ou a constante."""
+    if kind == "v":
+        return slot_of(node[1])
+    if kind == "k":
+        return node[1]
+    return None
+
+
+def compile_setindex(nodes: Tuple[tuple, tuple, tuple],
+                     slot_of: Callable[[str], int]) -> Callable[[list], None]:
+    """Closure de 't[k] = v' a partir das ASTs (tabela, chave, valor)."""
+    fo, fk, fv = [compile_node(node, slot_of) for node in nodes]
+
+    def setindex(mem):
+        t = fo(mem)
+        k = fk(mem)
+        v = fv(mem)
+        # caminho rápido: troca de um valor dentro da parte array
+        if (type(t) is LuaTable and type(k) is int and 0 < k <= len(t.array)
+                and v is not None):
+            t._store(k - 1, v)
+        else:
+            lua_setindex(t, k, v)
+    return setindex
+
+
+def compile_expression(expr: str, slot_of: Callable[[str], int]
+                       ) -> Tuple[tuple, Callable[[list], object]]:
+    """Parser + geração de closure; devolve (ast, closure)."""
+    node = parse_expression(expr)
+    return node, compile_node(node, slot_of)
+
+
+# =====================================================================
+# 5. INTERPRETADOR MINI-LUA (SESSÃO E EXECUÇÃO)
+# =====================================================================
+# Este bloco contém o núcleo do "interpretador":
+# - compile_line: analisa UMA linha e devolve a instrução pronta;
+# - build_control_flow: liga os blocos (if/elseif/else/end, while,
+#   for numérico) e os GOTO do programa inteiro em uma lista de
+#   operações com os destinos dos desvios já resolvidos (tabela de
+#   desvios): desviar é só trocar o índice da operação atual;
+# - optimize_flow: propaga constantes e remove atribuições mortas nessa
+#   lista de operações (OPT / RUN OPT);
+# - Interpreter: uma sessão completa (programa, arquivo, variáveis,
+#   DEBUG e caches), com os comandos como métodos que devolvem valores:
+#   load/ins/delete/save, run (RUN, RUN VM, RUN OPT, RUN PROFILE),
+#   start_debug/step/back/stop_debug (DEBUG, NEXT, BACK, STOP),
+#   stack (STACK)...
+#   Cada linha é compilada UMA vez e a instrução fica no cache da
+#   sessão (compiled_lines).
+# =====================================================================
+
+
+# cabeçalhos de bloco: cada um ocupa uma linha inteira do programa
+BLOCK_RE = re.compile(r"^(?:(if|elseif)\b(.*)\bthen|(while)\b(.*)\bdo)$")
+FOR_RE = re.compile(r"^for\s+([A-Za-z_]\w*)\s*=(.*)\bdo$")
+GOTO_RE = re.compile(r"^goto\s+(\S+)$", re.IGNORECASE)
+BLOCK_START_RE = re.compile(r"^(if|elseif|while|for)\b")
+
+
+def compile_line(code: str, slot_of: Callable[[str], int]) -> tuple:
+    """
+    Analisa UMA linha de código da mini-Lua e devolve a instrução pronta:
+        ("nop",)                                   - linha vazia
+        ("print", expr, ast, closure)              - print(expr)
+        ("assign", nome, expr, ast, slot, closure) - [local] nome = expr
+        ("setindex", alvo, expr, asts, closure)    - t[k] = expr
+        ("if", expr, ast, closure)                 - if expr then
+        ("elseif", expr, ast, closure)             - elseif expr then
+        ("else",)                                  - else
+        ("while", expr, ast, closure)              - while expr do
+        ("for", nome, exprs, asts, slot, closures) - for nome = a, b[, p] do
+        ("end",)                                   - end
+        ("goto", linha)                            - GOTO <linha>
+        ("error", mensagem[, bloco])               - erro adiado para a execução
+
+    As variáveis são resolvidas aqui mesmo para slots (posições fixas na
+    memória da sessão) por slot_of, normalmente Interpreter.slot_of.
+    Os blocos e os destinos dos GOTO só são ligados depois, com o
+    programa inteiro (build_control_flow).
+
+    Erros de sintaxe não são lançados aqui: viram uma instrução "error",
+    para que a mensagem só apareça quando a linha for de fato executada.
+    Em um cabeçalho de bloco o erro guarda também o tipo do bloco, para
+    que o 'end' correspondente continue casando com ele.
+    """
+    stripped = code.strip()
+    if not stripped:
+        return ("nop",)
+    if stripped == "end" or stripped == "else":
+        return (stripped,)
+
+    m = BLOCK_RE.match(stripped)
+    if m is not None:
+        kind = m.group(1) or m.group(3)
+        expr = (m.group(2) if m.group(1) else m.group(4)).strip()
+        try:
+            return (kind, expr) + compile_expression(expr, slot_of)
+        except ParseError as e:
+            return ("error", f"Erro ao avaliar expressão '{expr}': {e}", kind)
+
+    m = FOR_RE.match(stripped)
+    if m is not None:
+        var_name, exprs = m.group(1), m.group(2).strip()
+        if var_name in LUA_KEYWORDS:
+            return ("error", f"Nome de variável inválido: '{var_name}'", "for")
+        try:
+            nodes = parse_expression_list(exprs)
+        except ParseError as e:
+            return ("error", f"Erro ao avaliar expressão '{exprs}': {e}", "for")
+        if len(nodes) not in (2, 3):
+            return ("error", f"'for' espera 2 ou 3 expressões: '{exprs}'", "for")
+        if len(nodes) == 2:
+            nodes.append(("k", 1))
+        return ("for", var_name, exprs, tuple(nodes), slot_of(var_name),
+                tuple(compile_node(node, slot_of) for node in nodes))
+
+    m = BLOCK_START_RE.match(stripped)
+    if m is not None:
+        kind = m.group(1)
+        return ("error", f"Instrução '{kind}' mal formada: '{stripped}'", kind)
+
+    m = GOTO_RE.match(stripped)
+    if m is not None:
+        target = parse_int(m.group(1))
+        if target is None:
+            return ("error", f"GOTO: número de linha inválido '{m.group(1)}'")
+        return ("goto", target)
+
+    # Trata "local x = ..." como "x = ..."
+    if stripped.startswith("local "):
+        stripped = stripped[len("local "):].lstrip()
+
+    # print(...)
+    if stripped.startswith("print(") and stripped.endswith(")"):
+        inner = stripped[len("print("):-1].strip()
+        try:
+            return ("print", inner) + compile_expression(inner, slot_of)
+        except ParseError as e:
+            return ("error", f"Erro ao avaliar expressão '{inner}': {e}")
+
+    # Atribuição: x = expr
+    if "=" in stripped:
+        var_name, expr = stripped.split("=", 1)
+        var_name = var_name.strip()
+        expr = expr.strip()
+        if "[" in var_name or (not var_name.isidentifier() and "[" in stripped):
+            return compile_index_assignment(stripped, slot_of)
+        if not var_name.isidentifier() or var_name in LUA_KEYWORDS:
+            return ("error", f"Nome de variável inválido: '{var_name}'")
+        try:
+            node, fn = compile_expression(expr, slot_of)
+        except ParseError as e:
+            return ("error", f"Erro ao avaliar expressão '{expr}': {e}")
+        return ("assign", var_name, expr, node, slot_of(var_name), fn)
+
+    # Caso não reconheça a sintaxe:
+    return ("error", f"Instrução não suportada: '{code}'")
+
+
+def compile_index_assignment(text: str, slot_of: Callable[[str], int]) -> tuple:
+    """Atribuição a um campo de tabela: t[k] = expr (ver compile_line)."""
+    try:
+        target, expr = split_assignment(text)
+    except ParseError as e:
+        return ("error", f"Erro ao avaliar expressão '{text}': {e}")
+    try:
+        node = parse_expression(target)
+    except ParseError as e:
+        return ("error", f"Erro ao avaliar expressão '{target}': {e}")
+    if node[0] != "index":
+        return ("error", f"Alvo de atribuição inválido: '{target}'")
+    try:
+        value = parse_expression(expr)
+    except ParseError as e:
+        return ("error", f"Erro ao avaliar expressão '{expr}': {e}")
+    nodes = (node[1], node[2], value)
+    return ("setindex", target, expr, nodes, compile_setindex(nodes, slot_of))
+
 
+# instruções que não desviam: executadas uma após a outra, como estão
+STRAIGHT_KINDS = ("nop", "print", "assign", "setindex", "error")
+# especialização por tipo (ver Interpreter.specialized_ops): execuções
+# observadas antes de decidir e falhas de guarda até a linha voltar de
+# vez ao caminho genérico
+SPEC_WARMUP = 16
+SPEC_DEOPT_LIMIT = 8
+# operações de desvio do ControlFlow (o destino é sempre o último campo)
+FLOW_JUMP_KINDS = ("test", "jump", "forprep", "forloop")
+# peso de cada operação em ControlFlow.step_marks: uma linha e as
+# avaliações de expressão que ela faz (o for avalia início, limite e
+# passo); as que não estão aqui só contam a linha
+STEP_WEIGHTS = {kind: 1 + (evaluations << STEP_SHIFT) for kind, evaluations in
+                (("assign", 1), ("print", 1), ("setindex", 1), ("test", 1),
+                 ("forprep", 3))}
 
-# =====================================================================
-# 1. ESTADO GLOBAL DO REPL / INTERPRETADOR
-# =====================================================================
-# Aqui definimos variáveis globais que representam:
-# - o arquivo atual associado ao programa (current_file),
-# - se existem alterações não salvas (dirty),
-# - o código do programa em memória (program_lines),
-# - o modo de execução (debug_mode, program_counter),
-# - e o ambiente de variáveis em tempo de execução (runtime_env).
-# =====================================================================
 
-current_file: Optional[str] = None  # caminho do arquivo aberto
-dirty: bool = False                 # há alterações não salvas?
+class ControlFlow:
+    """
+    O programa inteiro pronto para executar: uma lista de operações com
+    os desvios já resolvidos para índices da própria lista.
+
+    ops[i] é uma instrução simples de compile_line (nop, print, assign,
+    error) ou uma operação de controle:
+        ("test", expr, closure, destino)            - se falso, desvia
+        ("jump", destino)                           - desvio incondicional
+        ("forprep", exprs, closures, slots, saída)  - entra no for ou sai
+        ("forloop", slots, corpo)                   - próxima volta do for
+    (slots do for = variável, contador, limite e passo.) Cada linha gera
+    uma operação, exceto 'elseif', que gera duas: o desvio para o 'end'
+    (fim do ramo anterior) e o teste da sua condição.
+
+    pos_of[i] é a posição, em nums, da linha de ops[i]; first_op[p] é a
+    primeira operação da linha na posição p.
+    """
+
+    __slots__ = ("nums", "ops", "pos_of", "first_op", "has_jumps", "marks")
+
+    def __init__(self, nums) -> None:
+        self.nums = nums
+        self.ops: List[tuple] = []
+        self.pos_of = array("q")
+        self.first_op = array("q")
+        self.has_jumps = False
+        self.marks: Optional[Tuple[List[int], List[int]]] = None  # step_marks
+
+    def step_marks(self) -> Tuple[List[int], List[int]]:
+        """
+        Contagens para as estatísticas (SessionStats), calculadas uma vez
+        por ControlFlow: (marks, hops), com
+            marks[i] = i + (avaliações de expressão em ops[:i]) << STEP_SHIFT.
+        Um trecho executado em sequência, de a até b, soma marks[b] -
+        marks[a]. Cada operação só desvia para um destino fixo, então
+        hops[i] = marks[i + 1] - marks[destino] é o que um desvio a partir
+        de i soma a mais (ou a menos) que seguir em frente: o RUN só
+        precisa somar hops[pc] em cada desvio.
+        """
+        if self.marks is None:
+            ops = self.ops
+            kinds = list(map(itemgetter(0), ops))
+            marks = list(accumulate(map(STEP_WEIGHTS.get, kinds, repeat(1)),
+                                    initial=0))
+            hops = [0] * len(ops)
+            for i in compress(range(len(ops)),
+                              map(FLOW_JUMP_KINDS.__contains__, kinds)):
+                target = ops[i][-1]
+                if target is not None:
+                    hops[i] = marks[i + 1] - marks[target]
+            self.marks = (marks, hops)
+        return self.marks
+
+    def line_of(self, pc: int) -> int:
+        """Número da linha de onde veio a operação pc."""
+        return self.nums[self.pos_of[pc]]
+
+    def op_range(self, pos: int) -> range:
+        """Índices das operações da linha na posição pos."""
+        end = self.first_op[pos + 1] if pos + 1 < len(self.first_op) else len(self.ops)
+        return range(self.first_op[pos], end)
+
+    def op_at(self, pos: int, offset: int) -> int:
+        """Índice da operação 'offset' da linha na posição pos (ou a primeira)."""
+        ops = self.op_range(pos)
+        return ops[offset] if offset < len(ops) else ops[0]
+
+
+def build_control_flow(nums, instructions,
+                       slot_of: Callable[[str], int]) -> ControlFlow:
+    """
+    Liga os blocos e os GOTO do programa (linhas 'nums', instruções em
+    'instructions', na mesma ordem) e devolve o ControlFlow.
+
+    Erros de estrutura ('end' sobrando, bloco sem 'end', GOTO para linha
+    que não existe) viram operações "error" na linha do problema: como os
+    erros de sintaxe, só aparecem se a linha for executada.
+    """
+    flow = ControlFlow(nums)
+    ops, pos_of, first_op = flow.ops, flow.pos_of, flow.first_op
+    patched: List[int] = []   # operações de controle (listas até o fim)
+    # blocos abertos: [tipo, op do cabeçalho, teste pendente, saídas, tem else]
+    blocks: List[list] = []
+    gotos: List[Tuple[int, int]] = []
+
+    def emit(op, pos: int) -> int:
+        if type(op) is list:
+            patched.append(len(ops))
+        ops.append(op)
+        pos_of.append(pos)
+        return len(ops) - 1
+
+    def patch(index: Optional[int], target: int) -> None:
+        if index is not None:
+            ops[index][-1] = target
+
+    for pos, (n, instr) in enumerate(zip(nums, instructions)):
+        first_op.append(len(ops))
+        kind = instr[0]
+        role = instr[2] if kind == "error" and len(instr) > 2 else kind
+        failed = kind == "error"
+
+        if role == "if" or role == "while":
+            op = emit(instr if failed else ["test", instr[1], instr[3], None], pos)
+            blocks.append([role, op, None if failed else op, [], False])
+        elif role == "for":
+            if failed:
+                op = emit(instr, pos)
+            else:
+                slots = (instr[4],) + tuple(slot_of(f"(for {n}).{part}")
+                                            for part in ("i", "limite", "passo"))
+                op = emit(["forprep", instr[2], instr[5], slots, None], pos)
+            blocks.append(["for", op, None if failed else op, [], False])
+        elif role == "elseif" or role == "else":
+            top = blocks[-1] if blocks else None
+            if top is None or top[0] != "if" or top[4]:
+                emit(("error", f"'{role}' sem 'if' correspondente"), pos)
+                continue
+            # fim do ramo anterior: desvia para depois do 'end'
+            top[3].append(emit(["jump", None], pos))
+            patch(top[2], len(ops))
+            if role == "else":
+                top[2], top[4] = None, True
+            else:
+                op = emit(instr if failed else ["test", instr[1], instr[3], None], pos)
+                top[2] = None if failed else op
+        elif kind == "end":
+            if not blocks:
+                emit(("error", "'end' sem bloco correspondente"), pos)
+                continue
+            block_kind, head, pending, exits, _has_else = blocks.pop()
+            if block_kind == "if":
+                emit(("nop",), pos)
+                for index in exits + [pending]:
+                    patch(index, len(ops))
+            elif block_kind == "while":
+                emit(["jump", head], pos)
+                patch(pending, len(ops))
+            else:
+                emit(["forloop", ops[head][3] if pending is not None else (),
+                      head + 1], pos)
+                patch(pending, len(ops))
+        elif kind == "goto":
+            gotos.append((emit(["jump", None], pos), instr[1]))
+        else:
+            emit(instr, pos)
+
+    for block_kind, head, pending, exits, _has_else in blocks:
+        ops[head] = ("error", f"'{block_kind}' sem 'end' correspondente")
+        # desvios do bloco que esperavam o 'end' (else, elseif) vão para
+        # o erro: um GOTO para dentro do bloco também o encontra
+        for index in exits + [pending]:
+            if index != head:
+                patch(index, head)
+    for index, target in gotos:
+        p = bisect_left(nums, target)
+        if p < len(nums) and nums[p] == target:
+            ops[index][-1] = first_op[p]
+        else:
+            ops[index] = ("error", f"GOTO para linha inexistente: {target}")
+    for index in patched:
+        if type(ops[index]) is list:
+            ops[index] = tuple(ops[index])
+    flow.has_jumps = bool(patched)
+    return flow
+
+
+def for_enter(mem: List[object], slots: tuple, start, stop, step) -> bool:
+    """
+    Início do for numérico (semântica da Lua 5.4): confere os valores,
+    guarda contador/limite/passo nos slots do laço e diz se há ao menos
+    uma volta. Com início e passo inteiros o laço é inteiro.
+    """
+    for value, what in ((start, "o valor inicial"), (stop, "o limite"),
+                        (step, "o passo")):
+        if type(value) not in NUMBER_TYPES:
+            raise RuntimeError(f"'for': {what} deve ser um número")
+    if step == 0:
+        raise RuntimeError("'for': o passo é zero")
+    if type(start) is int and type(step) is int:
+        if type(stop) is float and math.isfinite(stop):
+            stop = math.floor(stop) if step > 0 else math.ceil(stop)
+    else:
+        start, stop, step = float(start), float(stop), float(step)
+    if not (start <= stop if step > 0 else start >= stop):
+        return False
+    var, counter, limit, inc = slots
+    mem[var] = mem[counter] = start
+    mem[limit] = stop
+    mem[inc] = step
+    return True
+
+
+def for_next(mem: List[object], slots: tuple) -> bool:
+    """'end' do for: avança o contador e diz se há mais uma volta."""
+    if not slots or mem[slots[1]] is UNDEFINED:
+        raise RuntimeError("'end' do 'for' alcançado sem passar pelo 'for'")
+    var, counter, limit, inc = slots
+    step = mem[inc]
+    i = mem[counter] + step
+    if i <= mem[limit] if step > 0 else i >= mem[limit]:
+        mem[var] = mem[counter] = i
+        return True
+    mem[counter] = UNDEFINED
+    return False
+
+
+def optimize_flow(flow: ControlFlow, slot_of: Callable[[str], int]
+                  ) -> Tuple[ControlFlow, Dict[str, int]]:
+    """
+    OPT: otimiza as operações do programa, bloco básico a bloco básico
+    (trecho sem desvios, que só começa no início do programa, num
+    destino de desvio ou logo depois de um desvio):
+      - propaga constantes: depois de 'x = 10', 'y = x + 5' vira
+        'y = 15' (substitute_constants, que também dobra as contas);
+      - remove atribuições mortas: 'x = 10' sobrescrito por outra
+        atribuição a x mais adiante no mesmo bloco, sem leitura de x
+        no meio;
+      - retira as operações vazias ("nop") e corrige os destinos.
+
+    Nada que possa mudar a saída ou os erros é tocado: print ficam
+    todos; uma atribuição só é removida se o valor dela for constante
+    (não pode dar erro) e se nenhuma operação entre ela e a seguinte
+    puder dar erro (o STACK depois do erro mostraria o valor). Cada
+    operação mantém a linha de origem (pos_of), usada nas mensagens.
+    Devolve o novo ControlFlow e a contagem do que mudou.
+    """
+    ops = flow.ops
+    n = len(ops)
+    # inícios de bloco básico; o destino fica sempre no último campo
+    # (None nos desvios de um bloco sem 'end', que virou erro)
+    leaders = {0}
+    for i, op in enumerate(ops):
+        if op[0] in FLOW_JUMP_KINDS:
+            leaders.add(op[-1])
+            leaders.add(i + 1)
+
+    # 1) propagação de constantes (para frente)
+    new_ops = list(ops)
+    folded = 0
+    known: Dict[str, object] = {}
+    for i, op in enumerate(ops):
+        if i in leaders:
+            known = {}
+        kind = op[0]
+        if kind == "assign":
+            node = substitute_constants(op[3], known)
+            if node is not op[3]:
+                new_ops[i] = op[:3] + (node, op[4], compile_node(node, slot_of))
+                folded += 1
+            if node[0] == "k":
+                known[op[1]] = node[1]
+            else:
+                known.pop(op[1], None)
+        elif kind == "print":
+            node = substitute_constants(op[2], known)
+            if node is not op[2]:
+                new_ops[i] = op[:2] + (node, compile_node(node, slot_of))
+                folded += 1
+
+    # 2) atribuições mortas (para trás); no fim de cada bloco e em tudo
+    # que pode dar erro, todas as variáveis contam como lidas
+    keep = [True] * n
+    removed = nops = 0
+    overwritten: set = set()
+    for i in range(n - 1, -1, -1):
+        if i + 1 in leaders:
+            overwritten.clear()
+        op = new_ops[i]
+        kind = op[0]
+        if kind == "nop":
+            keep[i] = False
+            nops += 1
+        elif kind == "assign" and op[3][0] == "k":
+            if op[1] in overwritten:
+                keep[i] = False
+                removed += 1
+            else:
+                overwritten.add(op[1])
+        elif not (kind == "print" and op[2][0] == "k"):
+            overwritten.clear()
+
+    # 3) compacta: destino t passa a ser a t-ésima operação mantida
+    new_index = array("q", [0])
+    new_index.extend(accumulate(keep))
+    opt = ControlFlow(flow.nums)
+    for i, op in enumerate(new_ops):
+        if keep[i]:
+            if op[0] in FLOW_JUMP_KINDS and op[-1] is not None:
+                op = op[:-1] + (new_index[op[-1]],)
+            opt.ops.append(op)
+            opt.pos_of.append(flow.pos_of[i])
+    opt.first_op.extend(new_index[first] for first in flow.first_op)
+    opt.has_jumps = flow.has_jumps
+    return opt, {"lines": len(flow.nums), "ops": n, "folded": folded,
+                 "removed": removed, "nops": nops}
+
+
+class InterpreterError(Exception):
+    """Comando que não pode ser atendido (linha inexistente, nada carregado...)."""
+
+
+class _BreakpointHit(Exception):
+    """CONT chegou a um breakpoint: 'pc' é a operação (ainda não executada)."""
+
+    def __init__(self, pc: int) -> None:
+        super().__init__(pc)
+        self.pc = pc
+
+
+class Interpreter:
+    """
+    Uma sessão do interpretador MEPA/Lua.
+
+    Guarda tudo o que antes era estado global: o programa em memória, o
+    arquivo associado, as alterações não salvas, as variáveis, o estado
+    do DEBUG e os caches de compilação. Os métodos não escrevem na tela:
+    devolvem valores ou lançam InterpreterError, e quem apresenta os
+    resultados é o cliente (o REPL da seção 8, o modo lote da seção 9 ou
+    outro programa que importe este módulo). Só a saída dos print do
+    programa vai para output_sink.
+
+    Sessões são independentes entre si: várias podem existir (e rodar
+    em threads diferentes) no mesmo processo.
+    """
+
+    __slots__ = (
+        "current_file", "dirty", "program_lines", "debug_mode",
+        "program_counter", "pc_index", "pc_offset", "var_slots", "var_names",
+        "memory", "output_sink",
+        "compiled_lines", "flow_program", "opt_program", "mepa_fragments",
+        "mepa_program",
+        "breakpoints", "break_ops", "checkpoints", "last_resume",
+        "precompiled_lines", "mepac_mode", "mepac_stale", "last_profile",
+        "cache_hits", "cache_misses", "journal", "trace",
+        "specialize", "spec_ops", "spec_counts", "stats", "metrics_path",
+    )
+
+    def __init__(self, output=None, buffer_size: int = DEFAULT_OUTPUT_BUFFER,
+                 mepac_mode: str = "on",
+                 checkpoint_budget: int = DEFAULT_CHECKPOINT_BUDGET,
+                 trace_budget: int = DEFAULT_TRACE_BUDGET,
+                 specialize: bool = True) -> None:
+        self.current_file: Optional[str] = None  # caminho do arquivo aberto
+        self.dirty = False                       # há alterações não salvas?
+        self.journal = EditJournal()             # SAVE incremental
+
+        # programa em memória: {numero_linha: "código"} com índice ordenado
+        self.program_lines = ProgramStore()
+
+        # estado de execução / debug
+        self.debug_mode = False
+        self.program_counter: Optional[int] = None  # linha atual (número)
+        self.pc_index: Optional[int] = None  # posição de program_counter na ordem
+        self.pc_offset = 0  # operação dentro da linha (só 'elseif' tem duas)
+        self.trace = DebugTrace(trace_budget)  # passos do DEBUG (BACK / STEP)
+        # breakpoints do CONT: {numero_linha: None ou (expr, closure)}
+        self.breakpoints: Dict[int, Optional[tuple]] = {}
+        # (flow, operações com as armadilhas dos breakpoints); None = refazer
+        self.break_ops: Optional[Tuple[ControlFlow, List[tuple]]] = None
+        # RUN incremental (ver RunCheckpoints); orçamento 0 desliga
+        self.checkpoints = RunCheckpoints(checkpoint_budget)
+        self.last_resume: Optional[int] = None  # linha de onde o RUN recomeçou
+        # variáveis: cada nome recebe, ao compilar, um slot fixo (índice
+        # em 'memory'). Enquanto o programa é o mesmo, slots nunca são
+        # reaproveitados, para que as closures já compiladas continuem
+        # válidas depois de INS/DEL; install refaz a tabela (compact_slots).
+        self.var_slots: Dict[str, int] = {}   # nome -> slot
+        self.var_names: List[str] = []        # slot -> nome
+        self.memory: List[object] = []        # slot -> valor (ou UNDEFINED)
+        self.output_sink = OutputSink(output, buffer_size)  # saída dos print
+
+        # cache de linhas compiladas: {numero_linha: (código_fonte, instrução)}
+        self.compiled_lines: Dict[int, Tuple[str, tuple]] = {}
+        # programa com os blocos e GOTO ligados (None = precisa religar)
+        self.flow_program: Optional[ControlFlow] = None
+        # (flow_program de origem, versão otimizada, contagens) do OPT
+        self.opt_program: Optional[Tuple[ControlFlow, ControlFlow, dict]] = None
+        # cache dos trechos MEPA de cada linha: {numero_linha: (código, trecho)}
+        self.mepa_fragments: Dict[int, Tuple[str, list]] = {}
+        # programa MEPA já ligado (None = precisa recompilar)
+        self.mepa_program = None
+        # instruções vindas do .mepac, ainda não usadas; viram instrução de
+        # verdade (em compiled_lines) na primeira execução da linha
+        self.precompiled_lines = PrecompiledLines()
+        # uso do cache em disco (.mepac): "on", "off" ou "rebuild"
+        self.mepac_mode = mepac_mode
+        self.mepac_stale = False  # há linhas compiladas que o .mepac não tem?
+        # perfil do último RUN PROFILE: {numero_linha: [execuções, tempo_ns]}
+        self.last_profile: Optional[Dict[int, list]] = None
+        self.cache_hits = 0     # instruções reaproveitadas do cache
+        self.cache_misses = 0   # linhas que precisaram ser (re)compiladas
+        # versões especializadas por tipo das linhas de conta nos laços
+        self.specialize = specialize
+        self.spec_ops: Optional[Tuple[ControlFlow, List[tuple]]] = None
+        self.spec_counts = {"specialized": 0, "generic": 0, "deopts": 0,
+                            "reverted": 0}
+        # contadores e tempos (STATS); com metrics_path, cada RUN também
+        # acrescenta seu registro (JSON) a esse arquivo (ver cmd_run)
+        self.stats = SessionStats()
+        self.metrics_path: Optional[str] = None
+
+    # -----------------------------------------------------------------
+    # Programa e arquivos (LOAD, LIST, INS, DEL, SAVE)
+    # -----------------------------------------------------------------
+
+    def line_numbers(self) -> "array":
+        """
+        Números de linha do programa em ordem crescente. O array já é
+        mantido ordenado pelo ProgramStore (não há cópia; não alterar).
+        """
+        return self.program_lines.numbers()
+
+    def load(self, path: str, cache_mode: Optional[str] = None) -> List[str]:
+        """
+        LOAD: carrega um arquivo de código numerado ('<linha> <código>'),
+        pelo cache .mepac quando válido (cache_mode: "off" desliga,
+        "rebuild" força a reconstrução). Devolve os avisos da leitura;
+        erros de leitura são propagados.
+        """
+        if not os.path.exists(path):
+            raise InterpreterError(f"Erro: arquivo '{path}' não encontrado.")
+        t0 = time.perf_counter()
+        new_program, warnings, compiled = load_program(
+            path, cache_mode or self.mepac_mode)
+        self.install(new_program, path)
+        self.precompiled_lines = compiled
+        # o diário só vale para os bytes que acabaram de ser lidos
+        base = journal_base(path, self.program_lines._buf)
+        edits, size, journal_warnings = read_journal(path, base)
+        self.replay_journal(edits)
+        self.journal.reset(base if size >= 0 else None, max(size, 0), len(edits))
+        self.stats.add_load(len(self.program_lines), time.perf_counter() - t0)
+        return warnings + journal_warnings
+
+    def watch(self, path: str) -> Tuple[Optional[Tuple[List[int], List[int]]],
+                                        List[str]]:
+        """
+        WATCH: prepara a sessão para observar 'path'. Se ele já é o
+        arquivo atual e a sessão não tem alterações, o programa em memória
+        é mantido (relido por diferença, se o arquivo mudou desde o LOAD);
+        senão o arquivo é carregado como no LOAD. Devolve (linhas novas ou
+        alteradas e removidas, ou None se houve LOAD) e os avisos.
+        """
+        if path == self.current_file and not self.dirty and os.path.exists(path):
+            if journal_base(path) == self.journal.base:
+                return ([], []), []
+            return self.reload()
+        return None, self.load(path)
+
+    def reload(self) -> Tuple[Tuple[List[int], List[int]], List[str]]:
+        """
+        Relê o arquivo atual depois de uma alteração feita fora do
+        interpretador (WATCH) e aplica só a diferença: as linhas novas,
+        alteradas e removidas saem dos caches e marcam os checkpoints do
+        RUN incremental, como INS e DEL; as outras continuam compiladas.
+        O custo acompanha o tamanho da alteração (ver diff_program_file);
+        se o caminho rápido não vale, o arquivo é lido inteiro. Devolve
+        (linhas novas ou alteradas, linhas removidas) e os avisos.
+        """
+        path = self.current_file
+        if path is None:
+            raise InterpreterError("Nenhum arquivo associado ao programa.")
+        try:
+            with open(path, "rb") as f:
+                st = os.fstat(f.fileno())
+                data = f.read()
+        except FileNotFoundError:
+            raise InterpreterError(f"Erro: arquivo '{path}' não encontrado.") from None
+        base = (st.st_size, st.st_mtime_ns, file_digest(data).hex())
+        edits, size, warnings = read_journal(path, base)
+        diff = None
+        if not edits and not self.dirty:
+            diff = diff_program_file(self.program_lines, data)
+        if diff is None:
+            # caminho geral: programa novo inteiro, comparado linha a linha
+            old_code = dict(self.program_lines.items())
+            new_program, parse_warnings = parse_program_buffer(data)
+            warnings = parse_warnings + warnings
+            self.install(new_program, path)
+            self.replay_journal(edits)
+            changed = [n for n, code in self.program_lines.items()
+                       if old_code.pop(n, None) != code]
+            removed = sorted(old_code)
+        else:
+            new_program, changed, removed = diff
+            for n in chain(changed, removed):
+                self.invalidate_line(n)
+            if changed or removed:
+                self.checkpoints.note_edit(min(chain(changed[:1], removed[:1])))
+            self.program_lines = new_program
+            self.dirty = False
+            self.stop_debug()
+            self.memory = [UNDEFINED] * len(self.var_names)
+        self.journal.reset(base if size >= 0 else None, max(size, 0), len(edits))
+        return (changed, removed), warnings
+
+    def replay_journal(self, edits: List[tuple]) -> None:
+        """Reaplica as alterações do diário (ver EditJournal) no programa."""
+        program = self.program_lines
+        for edit in edits:
+            if edit[0] == "INS":
+                program[edit[1]] = edit[2]
+                self.invalidate_line(edit[1])
+            else:
+                for n, _code in program.pop_range(edit[1], edit[2]):
+                    self.invalidate_line(n)
+
+    def install(self, new_program, path: Optional[str] = None) -> None:
+        """
+        Troca o programa em memória por new_program (ProgramStore ou
+        dicionário {linha: código}) associado a 'path' e reinicia o
+        estado de execução.
+        """
+        # descarta do cache só as linhas que mudaram ou sumiram
+        compiled_before = len(self.compiled_lines)
+        self.invalidate_changed_lines(new_program)
+        self.checkpoints.clear()
+        self.precompiled_lines = PrecompiledLines()
+        if not isinstance(new_program, ProgramStore):
+            new_program = ProgramStore(new_program)
+        self.program_lines = new_program
+        self.current_file = path
+        self.dirty = False
+        self.journal.reset(None)
+
+        # reset estado de execução
+        self.debug_mode = False
+        self.program_counter = None
+        self.pc_index = None
+        self.pc_offset = 0
+        self.trace.clear()
+        if len(self.compiled_lines) * 2 <= compiled_before:
+            # programa (quase todo) novo: os slots antigos ficaram sem uso
+            self.compact_slots()
+        else:
+            self.memory = [UNDEFINED] * len(self.var_names)
+
+    def ins(self, line_no: int, code: str) -> Optional[str]:
+        """INS: insere ou substitui a linha; devolve o código antigo (ou None)."""
+        old = self.program_lines.get(line_no)
+        self.program_lines[line_no] = code
+        self.invalidate_line(line_no)
+        self.checkpoints.note_edit(line_no)
+        if self.journal.base is not None:
+            self.journal.pending.append(("INS", line_no, code))
+        self.dirty = True
+        return old
+
+    def ins_block(self, lines: Dict[int, str]) -> int:
+        """
+        PASTE / INS BLOCK: insere ou substitui várias linhas de uma vez
+        (ver ProgramStore.update); devolve quantas foram substituídas.
+        """
+        if not lines:
+            return 0
+        replaced = self.program_lines.update(lines)
+        # como invalidate_line, mas sem passar pelos caches vazios
+        for cache in (self.compiled_lines, self.mepa_fragments):
+            if cache:
+                for n in lines:
+                    cache.pop(n, None)
+        if len(self.precompiled_lines):
+            for n in lines:
+                self.precompiled_lines.discard(n)
+        self.flow_program = None
+        self.mepa_program = None
+        self.checkpoints.note_edit(min(lines))
+        if self.journal.base is not None:
+            self.journal.pending.extend(zip(repeat("INS"), lines, lines.values()))
+        self.dirty = True
+        return replaced
+
+    def delete(self, line_no: int) -> str:
+        """DEL <linha>: remove a linha e devolve o código removido."""
+        if line_no not in self.program_lines:
+            raise InterpreterError(f"Erro: linha {line_no} inexistente.")
+        removed = self.program_lines.pop(line_no)
+        self.invalidate_line(line_no)
+        self.checkpoints.note_edit(line_no)
+        if self.journal.base is not None:
+            self.journal.pending.append(("DEL", line_no, line_no))
+        self.dirty = True
+        return removed
+
+    def delete_range(self, start_no: int, end_no: int) -> List[Tuple[int, str]]:
+        """DEL <li> <lf>: remove as linhas do intervalo e as devolve em ordem."""
+        if start_no > end_no:
+            raise InterpreterError(
+                "Erro: intervalo inválido (linha inicial maior que final).")
+        removed = self.program_lines.pop_range(start_no, end_no)
+        for n, _code in removed:
+            self.invalidate_line(n)
+        if removed:
+            self.checkpoints.note_edit(removed[0][0])
+            if self.journal.base is not None:
+                self.journal.pending.append(("DEL", start_no, end_no))
+            self.dirty = True
+        return removed
+
+    def save(self, path: Optional[str] = None, full: bool = False) -> str:
+        """
+        SAVE: grava o programa em 'path' (ou no arquivo atual) e devolve
+        o caminho usado. Erros de escrita são propagados.
+
+        No arquivo atual, só as alterações desde o último SAVE vão para
+        o diário (ver EditJournal), que é incorporado ao arquivo quando
+        fica grande. 'full' (SAVE FULL) regrava o arquivo inteiro. Se o
+        arquivo não é mais o base do diário (tamanho, data ou hash
+        diferentes: alterado fora do interpretador), o SAVE também
+        regrava tudo, em vez de acrescentar alterações que o LOAD
+        aplicaria sobre outro conteúdo.
+        """
+        if not self.program_lines:
+            raise InterpreterError("Nenhum programa em memória para salvar.")
+        path = path or self.current_file
+        if path is None:
+            raise InterpreterError("Nenhum arquivo associado ao programa.")
+        t0 = time.perf_counter()
+        journal = self.journal
+        if (not full and path == self.current_file and journal.base is not None
+                and os.path.exists(path)
+                and file_identity(path) == journal.base[:2]
+                and journal_base(path) == journal.base):
+            if journal.pending:
+                journal.size = append_journal(path, journal.base, journal.pending,
+                                              journal.size)
+                journal.records += len(journal.pending)
+                journal.pending.clear()
+            self.dirty = False
+            if not journal.needs_compaction():
+                self.stats.add_save(time.perf_counter() - t0)
+                return path
+        self.program_lines = write_program_file(path, self.program_lines)
+        self.current_file = path
+        self.dirty = False
+        # o arquivo já tem tudo: o diário (deste ou de outro base) sai
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(journal_path(path))
+        journal.reset(journal_base(path, self.program_lines._buf))
+        if self.mepac_mode != "off":
+            self.write_cache([])
+        self.stats.add_save(time.perf_counter() - t0)
+        return path
+
+    def write_cache(self, warnings: List[str]) -> None:
+        """Grava o .mepac do arquivo atual com as linhas já compiladas."""
+        entries: Dict[int, bytes] = dict(self.precompiled_lines.raw_items())
+        for n, (_code, instr) in self.compiled_lines.items():
+            entries[n] = marshal.dumps(serialize_instruction(instr))
+        if write_mepac(self.current_file, self.program_lines, warnings, entries):
+            self.mepac_stale = False
+
+    def refresh_cache(self) -> None:
+        """
+        Depois de um RUN: se linhas novas foram compiladas e o programa é
+        exatamente o do arquivo atual, atualiza o .mepac com elas.
+        """
+        if (self.mepac_mode != "off" and self.mepac_stale
+                and self.current_file is not None and not self.dirty):
+            self.write_cache([])
+
+    # -----------------------------------------------------------------
+    # Compilação e execução (RUN, RUN VM, RUN OPT, RUN PROFILE)
+    # -----------------------------------------------------------------
+
+    def set_output(self, target=None,
+                   buffer_size: int = DEFAULT_OUTPUT_BUFFER) -> OutputSink:
+        """
+        Redireciona a saída dos programas (print) para 'target' — arquivo,
+        io.StringIO, ... ou None para o stdout — e devolve o novo destino.
+        """
+        self.output_sink.flush()
+        self.output_sink = OutputSink(target, buffer_size)
+        return self.output_sink
+
+    def reset_runtime(self) -> None:
+        """
+        Reinicia o ambiente de execução:
+        - limpa as variáveis (todos os slots voltam a UNDEFINED),
+        - posiciona o program_counter na primeira linha existente.
+        """
+        self.memory = [UNDEFINED] * len(self.var_names)
+        pc_list = self.line_numbers()
+        self.program_counter = pc_list[0] if pc_list else None
+        self.pc_index = 0 if pc_list else None
+        self.pc_offset = 0
+        self.trace.clear()
+
+    def slot_of(self, name: str) -> int:
+        """Slot da variável 'name', criando um novo na primeira vez."""
+        slot = self.var_slots.get(name)
+        if slot is None:
+            slot = self.var_slots[name] = len(self.var_names)
+            self.var_names.append(name)
+            self.memory.append(UNDEFINED)
+        return slot
+
+    def compact_slots(self) -> None:
+        """
+        Refaz a tabela de slots só com as variáveis do programa atual e
+        zera a memória. Chamada por install quando o programa novo
+        descarta a maior parte das linhas compiladas: sem isso, cada
+        programa instalado na mesma sessão (LOAD, modo lote, servidor)
+        deixaria seus slots para trás e a tabela só cresceria. As linhas
+        mantidas no cache são refeitas a partir da AST (sem passar pelo
+        parser); o resto se liga de novo no próximo RUN.
+        """
+        self.var_slots = {}
+        self.var_names = []
+        self.memory = []
+        slot_of = self.slot_of
+        self.compiled_lines = {
+            n: (code, deserialize_instruction(serialize_instruction(instr), slot_of))
+            for n, (code, instr) in self.compiled_lines.items()}
+        self.mepa_fragments.clear()
+        self.flow_program = self.mepa_program = None
+        self.opt_program = self.spec_ops = self.break_ops = None
+        for line_no, cond in self.breakpoints.items():
+            if cond is not None:
+                self.breakpoints[line_no] = (
+                    cond[0], compile_expression(cond[0], slot_of)[1])
+
+    def eval_expression(self, expr: str,
+                        fn: Optional[Callable[[list], object]] = None) -> object:
+        """
+        Avalia uma expressão da nossa mini-Lua (ver seção 4):
+          - números, strings, variáveis e parênteses
+          - +, -, *, /, //, %, ^ e .. (concatenação), menos unário
+          - tabelas: {a, b, c}, t[k] e #t
+
+        O escopo usado é somente a memória de variáveis da sessão
+        (memory, indexada por slot). Se fn for informada (closure já
+        compilada), o texto só é usado na mensagem de erro.
+        """
+        try:
+            if fn is None:
+                fn = compile_expression(expr, self.slot_of)[1]
+            return fn(self.memory)
+        except Exception as e:
+            raise RuntimeError(f"Erro ao avaliar expressão '{expr}': {e}")
+
+    def get_instruction(self, line_no: int) -> tuple:
+        """
+        Devolve a instrução compilada da linha 'line_no', usando o cache.
+        A entrada só é reaproveitada se o texto da linha for o mesmo que
+        foi compilado (chave = número da linha + código-fonte).
+        """
+        code = self.program_lines[line_no]
+        entry = self.compiled_lines.get(line_no)
+        if entry is not None and entry[0] == code:
+            self.cache_hits += 1
+            return entry[1]
+        self.cache_misses += 1
+        data = self.precompiled_lines.pop(line_no)
+        if data is not None:
+            # veio pronta do .mepac: só refaz a closure
+            instr = deserialize_instruction(data, self.slot_of)
+        else:
+            instr = compile_line(code, self.slot_of)
+            self.mepac_stale = True
+        self.compiled_lines[line_no] = (code, instr)
+        return instr
+
+    def invalidate_line(self, line_no: int) -> None:
+        """Remove do cache a instrução de uma linha alterada/removida."""
+        self.compiled_lines.pop(line_no, None)
+        self.mepa_fragments.pop(line_no, None)
+        self.precompiled_lines.discard(line_no)
+        self.flow_program = None
+        self.mepa_program = None
+
+    def invalidate_changed_lines(self, new_program) -> None:
+        """
+        Usada pelo LOAD: mantém no cache apenas as linhas cujo código
+        continua idêntico no novo programa.
+        """
+        self.flow_program = None
+        self.mepa_program = None
+        for cache in (self.compiled_lines, self.mepa_fragments):
+            for n in list(cache.keys()):
+                if new_program.get(n) != cache[n][0]:
+                    del cache[n]
+
+    def execute_instruction(self, instr: tuple) -> None:
+        """Executa uma instrução já compilada por compile_line."""
+        kind = instr[0]
+        if kind == "assign":
+            self.memory[instr[4]] = self.eval_expression(instr[2], instr[5])
+        elif kind == "print":
+            self.output_sink.write_value(self.eval_expression(instr[1], instr[3]))
+        elif kind == "setindex":
+            self.eval_expression(f"{instr[1]} = {instr[2]}", instr[4])
+        elif kind == "error":
+            raise RuntimeError(instr[1])
+
+    def execute_line(self, code: str) -> None:
+        """
+        Executa UMA linha de código da mini-Lua (fora do programa).
+        Suporta:
+            - local x = expr
+            - x = expr
+            - t[k] = expr
+            - print(expr)
+        """
+        self.execute_instruction(compile_line(code, self.slot_of))
+
+    def cache_stats(self) -> Dict[str, int]:
+        """Números do cache de compilação (comando CACHE)."""
+        return {"lines": len(self.compiled_lines),
+                "precompiled": len(self.precompiled_lines),
+                "hits": self.cache_hits, "misses": self.cache_misses,
+                "checkpoints": len(self.checkpoints),
+                "checkpoint_bytes": self.checkpoints.snapshot_bytes,
+                "last_resume": self.last_resume,
+                "spec": dict(self.spec_counts)}
+
+    def memory_usage(self) -> Dict[str, int]:
+        """
+        Bytes (aproximados, ver deep_sizeof) usados pela sessão (comando
+        MEM): o programa em memória (com os bytes do arquivo lido pelo
+        LOAD), os caches de compilação, as variáveis do programa e os
+        históricos do RUN incremental e do DEBUG. Objetos compartilhados
+        (a mesma instrução no cache e no programa ligado, por exemplo)
+        contam uma vez só, na primeira parte que os alcança.
+        """
+        seen: set = set()
+        program = self.program_lines
+        compiled = (deep_sizeof(self.compiled_lines, seen)
+                    + deep_sizeof(self.precompiled_lines, seen))
+        linked = sum(deep_sizeof(part, seen) for part in (
+            self.flow_program, self.opt_program, self.spec_ops, self.break_ops))
+        mepa = (deep_sizeof(self.mepa_fragments, seen)
+                + deep_sizeof(self.mepa_program, seen))
+        variables = sum(deep_sizeof(part, seen) for part in (
+            self.memory, self.var_slots, self.var_names))
+        return {"program": program.nbytes(),
+                "compiled": compiled, "linked": linked, "mepa": mepa,
+                "variables": variables,
+                "checkpoints": deep_sizeof(self.checkpoints, seen),
+                "trace": deep_sizeof(self.trace, seen),
+                "buffers": (deep_sizeof(self.output_sink, seen)
+                           + deep_sizeof(self.journal, seen))}
+
+    def control_flow(self) -> ControlFlow:
+        """
+        Programa da sessão com blocos e GOTO ligados (build_control_flow),
+        refeito só depois de mudanças no programa.
+        """
+        if self.flow_program is None:
+            nums = self.line_numbers()
+            self.flow_program = build_control_flow(
+                nums, map(self.get_instruction, nums), self.slot_of)
+        return self.flow_program
+
+    def for_prep(self, op: tuple, pc: int) -> int:
+        """Operação forprep: calcula início, limite e passo e entra no laço."""
+        mem = self.memory
+        try:
+            start, stop, step = [fn(mem) for fn in op[2]]
+        except Exception as e:
+            raise RuntimeError(f"Erro ao avaliar expressão '{op[1]}': {e}")
+        return pc + 1 if for_enter(mem, op[3], start, stop, step) else op[4]
+
+    def execute_op(self, ops: List[tuple], pc: int) -> int:
+        """Executa a operação ops[pc] e devolve o índice da próxima."""
+        op = ops[pc]
+        kind = op[0]
+        if kind == "test":
+            if lua_truthy(self.eval_expression(op[1], op[2])):
+                return pc + 1
+            return op[3]
+        if kind == "jump":
+            return op[1]
+        if kind == "forloop":
+            return op[2] if for_next(self.memory, op[1]) else pc + 1
+        if kind == "forprep":
+            return self.for_prep(op, pc)
+        if kind == "break":
+            if self.breakpoint_hit(op[1]):
+                raise _BreakpointHit(pc)
+            return self.execute_op(self.flow_program.ops, pc)
+        if kind == "warm":
+            return self.warm_up(ops, pc)
+        if kind == "specassign" or kind == "spectest":
+            return self.deoptimize(ops, pc)
+        return self.execute_generic(op, pc)
+
+    def execute_generic(self, op: tuple, pc: int) -> int:
+        """Instrução simples ou teste, pelo caminho genérico."""
+        if op[0] == "test":
+            if lua_truthy(self.eval_expression(op[1], op[2])):
+                return pc + 1
+            return op[3]
+        self.execute_instruction(op)
+        return pc + 1
+
+    def loop_ops(self, flow: ControlFlow) -> Optional[List[tuple]]:
+        """
+        Operações para o RUN de 'flow': as especializadas, se o programa
+        tem laços ou desvios (senão cada linha roda uma vez só e não há
+        o que aquecer), ou None para as de sempre.
+        """
+        if self.specialize and flow.has_jumps:
+            return self.specialized_ops(flow)
+        return None
+
+    def specialized_ops(self, flow: ControlFlow) -> List[tuple]:
+        """
+        Cópia das operações de 'flow' em que as atribuições e os testes
+        que só fazem contas (ver specializable) começam como
+        ("warm", operação, slots, tipos vistos, [execuções]): nas
+        primeiras SPEC_WARMUP execuções, anotam os tipos das variáveis
+        lidas. Se só apareceram inteiros (ou só reais), a operação vira
+        ("specassign" | "spectest", função especializada, operação,
+        [falhas de guarda]); senão, volta a ser a operação original.
+        As outras operações são as mesmas do RUN. A cópia é da sessão e
+        vale enquanto o programa não mudar, então um RUN aproveita o
+        aquecimento dos anteriores.
+        """
+        if self.spec_ops is None or self.spec_ops[0] is not flow:
+            ops = list(flow.ops)
+            for pc, op in enumerate(ops):
+                if op[0] == "assign" and specializable(op[3]):
+                    node = op[3]
+                elif op[0] == "test":
+                    try:
+                        node = parse_expression(op[1])
+                    except ParseError:
+                        continue
+                    if not specializable(node, compare=True) or node[0] != "bin":
+                        continue
+                else:
+                    continue
+                slots = expression_slots(node, self.slot_of)
+                if slots:
+                    ops[pc] = ("warm", op, node, slots, set(), [0])
+            self.spec_ops = (flow, ops)
+        return self.spec_ops[1]
+
+    def warm_up(self, ops: List[tuple], pc: int) -> int:
+        """Operação "warm": anota os tipos e, no fim do aquecimento, decide."""
+        _kind, op, node, slots, seen, count = ops[pc]
+        memory = self.memory
+        seen.update([type(memory[slot]) for slot in slots])
+        count[0] += 1
+        if count[0] >= SPEC_WARMUP:
+            number_type = next(iter(seen)) if len(seen) == 1 else None
+            if number_type is int or number_type is float:
+                target = op[4] if op[0] == "assign" else None
+                fn = compile_specialized(node, self.slot_of, number_type, target)
+                kind = "specassign" if op[0] == "assign" else "spectest"
+                ops[pc] = (kind, fn, op, [0])
+                self.spec_counts["specialized"] += 1
+            else:
+                ops[pc] = op
+                self.spec_counts["generic"] += 1
+        return self.execute_generic(op, pc)
+
+    def deoptimize(self, ops: List[tuple], pc: int) -> int:
+        """
+        A guarda da operação especializada falhou: executa a operação
+        original. Depois de SPEC_DEOPT_LIMIT falhas, a linha volta de
+        vez ao caminho genérico.
+        """
+        _kind, _fn, op, failures = ops[pc]
+        self.spec_counts["deopts"] += 1
+        failures[0] += 1
+        if failures[0] >= SPEC_DEOPT_LIMIT:
+            ops[pc] = op
+            self.spec_counts["reverted"] += 1
+        return self.execute_generic(op, pc)
+
+    def run_flow(self, flow: ControlFlow, pc: int = 0,
+                 ops: Optional[List[tuple]] = None) -> Optional[Tuple[int, str]]:
+        """
+        Executa o programa a partir da operação pc (padrão: do início) até
+        o fim. Devolve (linha, mensagem) do primeiro erro, ou None se tudo
+        correu bem. Sem desvios (programa em linha reta), as operações são
+        só percorridas em ordem. 'ops' troca a lista de operações por uma
+        com breakpoints (ver breakpoint_ops).
+
+        As linhas executadas e as avaliações vão para stats.pending: só
+        os desvios anotam alguma coisa no caminho (ver step_marks).
+        """
+        if ops is None:
+            ops = flow.ops
+        execute = self.execute_instruction
+        marks, hops = flow.step_marks()
+        start, skipped = pc, 0
+        try:
+            if not flow.has_jumps and ops is flow.ops and pc == 0:
+                for pc, op in enumerate(ops):
+                    execute(op)
+                pc = len(ops)
+                return None
+            execute_op, eval_expression = self.execute_op, self.eval_expression
+            memory = self.memory
+            end = len(ops)
+            while pc < end:
+                op = ops[pc]
+                kind = op[0]
+                # versões especializadas (ver specialized_ops), as mais
+                # comuns nos laços; se a guarda falhar, execute_op roda o
+                # caminho genérico
+                if kind == "specassign" and op[1](memory):
+                    pc += 1
+                elif kind == "assign" or kind == "print" or kind == "setindex":
+                    execute(op)
+                    pc += 1
+                elif kind == "test":
+                    value = eval_expression(op[1], op[2])
+                    if value is None or value is False:
+                        skipped += hops[pc]
+                        pc = op[3]
+                    else:
+                        pc += 1
+                elif kind == "spectest":
+                    value = op[1](memory)
+                    if value:
+                        pc += 1
+                    elif value is None:
+                        target = execute_op(ops, pc)
+                        if target != pc + 1:
+                            skipped += hops[pc]
+                        pc = target
+                    else:
+                        skipped += hops[pc]
+                        pc = op[2][3]
+                elif kind == "jump":
+                    skipped += hops[pc]
+                    pc = op[1]
+                elif kind == "forloop":
+                    if for_next(memory, op[1]):
+                        skipped += hops[pc]
+                        pc = op[2]
+                    else:
+                        pc += 1
+                else:
+                    target = execute_op(ops, pc)
+                    if target != pc + 1:
+                        skipped += hops[pc]
+                    pc = target
+        except RuntimeError as e:
+            line = flow.line_of(pc)
+            pc += 1  # a operação com erro conta como executada
+            return line, str(e)
+        finally:
+            self.stats.pending += marks[pc] - marks[start] + skipped
+        return None
+
+    def straight_tail(self) -> Optional[Tuple[int, "array", List[tuple]]]:
+        """
+        Parte do programa que um RUN incremental precisa executar:
+        (índice do checkpoint de onde recomeçar ou None, números das
+        linhas e instruções a partir dele). Devolve None se essa parte
+        tiver desvios ou blocos. As linhas antes do checkpoint não mudaram
+        desde o último RUN, que só gravou checkpoints por ser em linha
+        reta; basta então olhar o resto, sem refazer o ControlFlow.
+        """
+        index = self.checkpoints.resume_point()
+        nums = self.line_numbers()
+        if index is not None:
+            nums = nums[bisect_left(nums, self.checkpoints.lines[index]):]
+        instructions = list(map(self.get_instruction, nums))
+        for instr in instructions:
+            if instr[0] not in STRAIGHT_KINDS or len(instr) > 2 and instr[0] == "error":
+                return None
+        return index, nums, instructions
+
+    def run_incremental(self, index: Optional[int], nums,
+                        instructions: List[tuple]) -> Optional[Tuple[int, str]]:
+        """
+        RUN de um programa em linha reta (ver straight_tail) com
+        checkpoints: recomeça do checkpoint 'index' (ou do início, se
+        None), repetindo a saída até ele, e grava novos checkpoints pelo
+        caminho. Como cada linha só depende das anteriores, o resultado é
+        idêntico ao de um RUN completo. Devolve o mesmo que run_flow.
+        """
+        cps, sink = self.checkpoints, self.output_sink
+        execute = self.execute_instruction
+        if index is None:
+            cps.clear()
+            sink.start_log(cps.log)
+            self.last_resume = None
+            next_checkpoint = 0
+        else:
+            memory, prefix = cps.restore(index)
+            memory.extend([UNDEFINED] * (len(self.var_names) - len(memory)))
+            self.memory = memory
+            sink.start_log(cps.log)
+            sink.write_text(prefix)
+            self.last_resume = nums[0] if nums else None
+            next_checkpoint = cps.interval
+        pos, end = 0, len(nums)
+        try:
+            while pos < end:
+                if pos >= next_checkpoint:
+                    if cps.record(nums[pos], self.memory, sink.position()):
+                        next_checkpoint = pos + cps.interval
+                    else:
+                        next_checkpoint = end  # sem espaço: só termina o RUN
+                        sink.stop_log()
+                stop = min(end, next_checkpoint)
+                for pos in range(pos, stop):
+                    execute(instructions[pos])
+                pos = stop
+        except RuntimeError as e:
+            line = nums[pos]
+            pos += 1  # a linha com erro conta como executada
+            return line, str(e)
+        finally:
+            sink.stop_log()
+            # estatísticas: avaliam expressão as linhas executadas menos
+            # as vazias e um erro de sintaxe (que só pode ser a última)
+            done = instructions if pos == len(instructions) else instructions[:pos]
+            evaluations = pos - done.count(("nop",))
+            if pos and done[-1][0] == "error":
+                evaluations -= 1
+            self.stats.pending += pos + (evaluations << STEP_SHIFT)
+        return None
+
+    def run_flow_profiled(self, flow: ControlFlow,
+                          stats: Dict[int, list]) -> Optional[Tuple[int, str]]:
+        """
+        Igual a run_flow, mas soma em 'stats' as execuções e o tempo (ns)
+        de cada linha. Usada só no RUN PROFILE: o RUN normal não paga nada
+        pela medição.
+        """
+        ops, execute_op, line_of = flow.ops, self.execute_op, flow.line_of
+        marks, hops = flow.step_marks()
+        clock = time.perf_counter_ns
+        pc = skipped = 0
+        end = len(ops)
+        try:
+            while pc < end:
+                t0 = clock()
+                n = line_of(pc)
+                try:
+                    target = execute_op(ops, pc)
+                except RuntimeError as e:
+                    pc += 1
+                    return n, str(e)
+                finally:
+                    elapsed = clock() - t0
+                    entry = stats.get(n)
+                    if entry is None:
+                        stats[n] = [1, elapsed]
+                    else:
+                        entry[0] += 1
+                        entry[1] += elapsed
+                if target != pc + 1:
+                    skipped += hops[pc]
+                pc = target
+        finally:
+            self.stats.pending += marks[pc] + skipped
+        return None
+
+    def run(self, backend: str = "ast",
+            profile: Optional[Dict[int, list]] = None) -> Optional[Tuple[int, str]]:
+        """
+        RUN: executa todas as linhas em ordem, do início ao fim.
+        Com backend="vm" (RUN VM), o programa é compilado para MEPA e
+        executado pela máquina virtual (ver run_mepa); com backend="opt"
+        (RUN OPT), roda a versão otimizada pelo OPT. Com um dicionário
+        em 'profile' (RUN PROFILE), a execução é medida linha a linha
+        (ver run_flow_profiled) e o perfil fica em last_profile.
+
+        O RUN normal de um programa sem desvios é incremental (ver
+        run_incremental): depois de um INS/DEL, recomeça do checkpoint
+        mais próximo antes da linha alterada. Com if/while/for/GOTO não
+        há como garantir isso e o programa roda inteiro.
+
+        A saída do programa passa pelo buffer e é descarregada ao final
+        (também em caso de erro). Devolve (linha, mensagem) do erro que
+        interrompeu a execução, ou None.
+        """
+        if not self.program_lines:
+            raise InterpreterError("Nenhum programa carregado.")
+        clock = time.perf_counter
+        started = clock()
+        ready = None  # fim da fase de compilação (ver SessionStats)
+        error = None
+        finished = False  # False no fim = interrompido (Ctrl+C, tempo limite)
+        self.debug_mode = False
+        self.reset_runtime()
+        self.stats.pending = 0
+        try:
+            if backend == "vm":
+                # RUN VM: compila para MEPA e executa na máquina de pilha
+                prog = self.compile_mepa()
+                ready = clock()
+                error = run_mepa(prog, self.output_sink.write_value, self.memory)
+            elif backend == "opt":
+                flow = self.optimize()[0]
+                ops = self.loop_ops(flow)
+                ready = clock()
+                error = self.run_flow(flow, ops=ops)
+            # a medição é escolhida uma vez aqui, não a cada linha
+            elif profile is None:
+                flow = self.flow_program
+                tail = None
+                if self.checkpoints.budget and (flow is None or not flow.has_jumps):
+                    tail = self.straight_tail()
+                if tail is not None:
+                    ready = clock()
+                    error = self.run_incremental(*tail)
+                else:
+                    self.checkpoints.clear()
+                    self.last_resume = None
+                    flow = self.control_flow()
+                    ops = self.loop_ops(flow)
+                    ready = clock()
+                    error = self.run_flow(flow, ops=ops)
+            else:
+                self.last_profile = profile
+                flow = self.control_flow()
+                ready = clock()
+                error = self.run_flow_profiled(flow, profile)
+            finished = True
+            return error
+        except KeyboardInterrupt:
+            # o Ctrl+C pode ter caído no meio da gravação de um checkpoint
+            self.checkpoints.clear()
+            self.last_resume = None
+            raise
+        finally:
+            self.output_sink.flush()
+            if ready is not None:
+                self.stats.add_run(self.run_record(
+                    backend if profile is None else "profile", error, finished,
+                    ready - started, clock() - ready))
+
+    def run_record(self, backend: str, error: Optional[Tuple[int, str]],
+                   finished: bool, compile_seconds: float,
+                   execute_seconds: float) -> tuple:
+        """
+        Registro de um RUN para as estatísticas (SessionStats.add_run),
+        uma tupla com os campos de RUN_FIELDS. Um RUN interrompido conta
+        como erro, sem linha. No RUN VM, as linhas executadas e as
+        avaliações ficam None (não contadas).
+        """
+        lines, evaluations = self.stats.take()
+        if backend == "vm":
+            lines = evaluations = None
+        return (time.time(), self.current_file, backend, len(self.program_lines),
+                lines, evaluations,
+                self.last_resume if backend == "ast" else None,
+                int(error is not None or not finished),
+                error[0] if error is not None else None,
+                compile_seconds, execute_seconds)
+
+    def profile_rows(self, stats: Optional[Dict[int, list]] = None
+                     ) -> List[Tuple[int, int, int, str]]:
+        """
+        Linhas do perfil (padrão: o último RUN PROFILE) como
+        (linha, execuções, tempo_total_ns, código), da mais cara à mais
+        barata.
+        """
+        if stats is None:
+            stats = self.last_profile or {}
+        get = self.program_lines.get
+        rows = [(n, count, total, get(n, ""))
+                for n, (count, total) in stats.items()]
+        rows.sort(key=lambda row: (-row[2], row[0]))
+        return rows
+
+    # -----------------------------------------------------------------
+    # Backend MEPA (COMPILE/ASM, RUN VM) — ver seção 6
+    # -----------------------------------------------------------------
+
+    def mepa_fragment(self, line_no: int) -> list:
+        """
+        Trecho MEPA de UMA linha (variáveis ainda pelo nome), em cache
+        (mepa_fragments) com a mesma chave do cache de compilação.
+        """
+        code = self.program_lines[line_no]
+        entry = self.mepa_fragments.get(line_no)
+        if entry is not None and entry[0] == code:
+            return entry[1]
+        frag = mepa_fragment(self.get_instruction(line_no))
+        self.mepa_fragments[line_no] = (code, frag)
+        return frag
+
+    def compile_mepa(self) -> "MepaProgram":
+        """Programa MEPA ligado da sessão (recompilado só após mudanças)."""
+        if self.mepa_program is None:
+            nums = self.line_numbers()
+            self.mepa_program = link_mepa(
+                self.control_flow(), lambda pos: self.mepa_fragment(nums[pos]),
+                self.slot_of, self.var_names)
+        return self.mepa_program
+
+    def asm(self) -> List[str]:
+        """COMPILE/ASM: listagem do código MEPA, com as linhas-fonte."""
+        if not self.program_lines:
+            raise InterpreterError("Nenhum programa carregado.")
+        return mepa_listing(self.compile_mepa(), self.program_lines)
+
+    def optimize(self) -> Tuple[ControlFlow, Dict[str, int]]:
+        """
+        OPT: programa otimizado por optimize_flow e a contagem do que
+        mudou. Refeito só quando o control_flow() muda.
+        """
+        if not self.program_lines:
+            raise InterpreterError("Nenhum programa carregado.")
+        flow = self.control_flow()
+        if self.opt_program is None or self.opt_program[0] is not flow:
+            self.opt_program = (flow,) + optimize_flow(flow, self.slot_of)
+        return self.opt_program[1], self.opt_program[2]
+
+    # -----------------------------------------------------------------
+    # Modo DEBUG (DEBUG, NEXT, STACK, STOP)
+    # -----------------------------------------------------------------
+
+    def start_debug(self) -> int:
+        """
+        DEBUG: prepara a execução passo a passo e devolve a linha em que
+        o program_counter está (a primeira, se o DEBUG não estava ativo).
+        """
+        if not self.program_lines:
+            raise InterpreterError("Nenhum programa carregado.")
+        self.debug_mode = True
+        if self.program_counter is None:
+            self.reset_runtime()
+            self.trace.start(self.memory, self.pc_state())
+        return self.program_counter
+
+    def step(self) -> Tuple[int, str, Optional[str], bool]:
+        """
+        NEXT: executa a linha do program_counter e avança para a próxima
+        linha a executar, seguindo os desvios (if, while, for, GOTO).
+
+        Devolve (linha, código, erro, reiniciado): 'erro' é a mensagem se
+        a linha falhou (o DEBUG é encerrado) e 'reiniciado' indica que o
+        program_counter apontava para uma linha que não existe mais e o
+        DEBUG recomeçou do início. Ao passar da última linha o DEBUG
+        também é encerrado (program_counter volta a None).
+
+        A saída da linha fica no buffer de output_sink: o cliente decide
+        quando mostrá-la (flush). O passo entra no histórico (ver
+        DebugTrace); depois de um BACK, os passos seguintes são
+        descartados e a linha é executada de novo, com saída.
+        """
+        if self.program_counter is None:
+            raise InterpreterError("Nenhuma linha pronta para executar (DEBUG).")
+
+        t0 = time.perf_counter()
+        nums = self.line_numbers()
+        idx = self.program_lines.position(self.program_counter, self.pc_index)
+        restarted = idx is None
+        if restarted:
+            self.reset_runtime()
+            if self.program_counter is None:
+                raise InterpreterError("Não há linhas para executar.")
+            self.trace.start(self.memory, self.pc_state())
+            idx = self.pc_index
+
+        flow = self.control_flow()
+        line_no = nums[idx]
+        code = self.program_lines[line_no]
+        op_pc = flow.op_at(idx, self.pc_offset)
+        trace = self.trace
+        if trace.active:
+            trace.truncate()
+            watched = trace.watch(flow.ops[op_pc], self.memory)
+            target = trace.index_target(flow.ops[op_pc], self.memory, self.slot_of)
+        try:
+            pc = self.execute_op(flow.ops, op_pc)
+        except RuntimeError as e:
+            # Em caso de erro, cancelamos o modo debug automaticamente
+            # (o histórico fica: BACK volta para antes do erro)
+            self.stop_debug(keep_trace=True)
+            self.stats.add_step(time.perf_counter() - t0)
+            return line_no, code, str(e), restarted
+
+        # Avança para a próxima operação (que pode estar em outra linha)
+        if pc < len(flow.ops):
+            self.set_pc(flow, pc)
+        else:
+            self.stop_debug(keep_trace=True)
+        if trace.active:
+            trace.record(line_no, self.pc_state(), watched, self.memory, target)
+        self.stats.add_step(time.perf_counter() - t0)
+        return line_no, code, None, restarted
+
+    def pc_state(self) -> tuple:
+        """Posição atual (program_counter, pc_index, pc_offset)."""
+        return self.program_counter, self.pc_index, self.pc_offset
+
+    def goto_step(self, n: int) -> Optional[Tuple[int, str]]:
+        """
+        STEP <n>: leva a sessão ao estado depois do passo n do DEBUG.
+        Passos já guardados são reconstruídos pelo histórico, sem
+        executar nada (nem repetir a saída); passos depois do último são
+        executados com NEXT até n. Devolve (linha, mensagem) se uma
+        dessas linhas falhar, senão None.
+        """
+        trace = self.trace
+        if not trace.active:
+            raise InterpreterError("Nenhum passo gravado (use DEBUG e NEXT).")
+        if n < trace.base:
+            raise InterpreterError(
+                f"O passo {n} já foi descartado (o mais antigo guardado é "
+                f"o {trace.base}).")
+        if n > trace.last:
+            memory, pc = trace.rebuild(trace.last)
+            self.restore_step(trace.last, memory, pc)
+            while trace.pos < n and self.program_counter is not None:
+                line_no, _code, error, _restarted = self.step()
+                if error is not None:
+                    return line_no, error
+            return None
+        memory, pc = trace.rebuild(n)
+        self.restore_step(n, memory, pc)
+        return None
+
+    def back(self, steps: int = 1) -> None:
+        """BACK [k]: volta k passos no DEBUG (ver goto_step)."""
+        if not self.trace.active:
+            raise InterpreterError("Nenhum passo gravado (use DEBUG e NEXT).")
+        self.goto_step(max(self.trace.base, self.trace.pos - steps))
+
+    def restore_step(self, n: int, memory: List[object], pc: tuple) -> None:
+        """Coloca a sessão no estado (memória, pc) do passo n."""
+        memory.extend([UNDEFINED] * (len(self.var_names) - len(memory)))
+        self.memory = memory
+        self.program_counter, self.pc_index, self.pc_offset = pc
+        self.debug_mode = self.program_counter is not None
+        self.trace.pos = n
+
+    def set_pc(self, flow: ControlFlow, pc: int) -> None:
+        """Posiciona o program_counter na operação pc."""
+        pos = flow.pos_of[pc]
+        self.pc_index = pos
+        self.program_counter = flow.nums[pos]
+        self.pc_offset = pc - flow.first_op[pos]
+
+    def set_breakpoint(self, line_no: int, condition: Optional[str] = None) -> None:
+        """
+        BREAK <linha> [IF <expr>]: o CONT para antes de executar a linha
+        (se houver condição, só quando ela for verdadeira).
+        """
+        if line_no not in self.program_lines:
+            raise InterpreterError(f"Erro: linha {line_no} inexistente.")
+        cond = None
+        if condition is not None:
+            try:
+                cond = (condition, compile_expression(condition, self.slot_of)[1])
+            except ParseError as e:
+                raise InterpreterError(
+                    f"Erro na condição '{condition}': {e}") from None
+        self.breakpoints[line_no] = cond
+        self.break_ops = None
+
+    def clear_breakpoints(self, line_no: Optional[int] = None) -> int:
+        """CLEAR [linha]: remove um breakpoint (ou todos); devolve quantos."""
+        if line_no is None:
+            count = len(self.breakpoints)
+            self.breakpoints.clear()
+        else:
+            count = 1 if self.breakpoints.pop(line_no, False) is not False else 0
+        self.break_ops = None
+        return count
+
+    def breakpoint_list(self) -> List[Tuple[int, Optional[str]]]:
+        """Breakpoints como (linha, condição ou None), em ordem de linha."""
+        return [(n, cond[0] if cond else None)
+                for n, cond in sorted(self.breakpoints.items())]
+
+    def breakpoint_ops(self, flow: ControlFlow) -> List[tuple]:
+        """
+        Cópia das operações de 'flow' com uma armadilha ("break", condição)
+        no lugar das operações das linhas com breakpoint. As outras linhas
+        são as mesmas operações do RUN: não pagam nada pelos breakpoints.
+        """
+        if self.break_ops is None or self.break_ops[0] is not flow:
+            ops = list(flow.ops)
+            nums = flow.nums
+            for line_no, cond in self.breakpoints.items():
+                pos = bisect_left(nums, line_no)
+                if pos < len(nums) and nums[pos] == line_no:
+                    for i in flow.op_range(pos):
+                        ops[i] = ("break", cond)
+            self.break_ops = (flow, ops)
+        return self.break_ops[1]
+
+    def breakpoint_hit(self, cond: Optional[tuple]) -> bool:
+        """
+        O breakpoint deve parar a execução? Sem condição, sempre; com
+        condição, se ela for verdadeira ou se der erro (para o usuário ver).
+        """
+        if cond is None:
+            return True
+        try:
+            return lua_truthy(cond[1](self.memory))
+        except Exception:
+            return True
+
+    def cont(self) -> Tuple[str, Optional[int], Optional[str]]:
+        """
+        CONT: continua o DEBUG, na velocidade do RUN, até um breakpoint
+        ou o fim do programa. Devolve (motivo, linha, erro):
+            ("break", linha, None) - parou ANTES de executar a linha
+            ("error", linha, msg)  - erro (o DEBUG é encerrado)
+            ("end", None, None)    - fim do programa (DEBUG encerrado)
+        A linha atual é executada sem checar seu breakpoint (senão o CONT
+        pararia sempre no mesmo lugar). A saída fica no buffer de
+        output_sink, como no step.
+        """
+        line_no, _code, error, _restarted = self.step()
+        if error is not None:
+            return "error", line_no, error
+        if self.program_counter is None:
+            return "end", None, None
+        flow = self.control_flow()
+        pc = flow.op_at(self.pc_index, self.pc_offset)
+        start_line = self.program_counter
+        t0 = time.perf_counter()
+        try:
+            result = self.run_flow(flow, pc, self.breakpoint_ops(flow))
+        except _BreakpointHit as hit:
+            self.set_pc(flow, hit.pc)
+            if self.trace.active:
+                self.trace.record_jump(start_line, self.pc_state(), self.memory)
+            return "break", self.program_counter, None
+        except KeyboardInterrupt:
+            # a linha atual não corresponde mais às variáveis: encerra
+            self.stop_debug()
+            raise
+        finally:
+            self.stats.add_cont(time.perf_counter() - t0)
+        self.stop_debug(keep_trace=True)
+        if self.trace.active and result is None:
+            self.trace.record_jump(start_line, self.pc_state(), self.memory)
+        if result is not None:
+            return "error", result[0], result[1]
+        return "end", None, None
 
-# programa em memória: {numero_linha: "código"}
-program_lines: Dict[int, str] = {}
+    def stop_debug(self, keep_trace: bool = False) -> None:
+        """
+        STOP: sai do modo de depuração e reseta o program_counter.
+        'keep_trace' guarda o histórico (fim do programa ou erro: BACK
+        ainda pode voltar para um passo anterior).
+        """
+        self.debug_mode = False
+        self.program_counter = None
+        self.pc_index = None
+        self.pc_offset = 0
+        if not keep_trace:
+            self.trace.clear()
 
-# estado de execução / debug
-debug_mode: bool = False
-program_counter: Optional[int] = None  # linha atual (número da linha)
-runtime_env: Dict[str, object] = {}    # "memória" de variáveis
+    def stack(self) -> List[Tuple[str, object]]:
+        """
+        STACK: variáveis do programa como pares (nome, valor), em ordem
+        de nome. Aqui usamos a memória de variáveis como se fosse a
+        'pilha' de execução: cada slot atribuído volta a ter seu nome.
+        Os slots internos dos laços for ("(for ...)") não aparecem.
+        """
+        mem = self.memory
+        return [(name, mem[slot]) for name, slot in sorted(self.var_slots.items())
+                if mem[slot] is not UNDEFINED and name[0] != "("]
 
 
 # =====================================================================
-# 2. FUNÇÕES UTILITÁRIAS
+# 6. BACKEND MEPA (COMPILADOR + MÁQUINA VIRTUAL)
 # =====================================================================
-# Funções de apoio usadas por vários comandos:
-# - marcação de alterações (dirty),
-# - confirmação de descarte de mudanças,
-# - conversão segura para int,
-# - obtenção de linhas ordenadas.
+# Em vez de passar o texto de cada linha para o eval do Python, o
+# programa inteiro pode ser traduzido para instruções da MEPA:
+# - mepa_fragment: traduz UMA linha (com nomes simbólicos);
+# - link_mepa: junta os trechos seguindo o ControlFlow (seção 5),
+#   resolve variáveis em endereços fixos (AMEM / CRVL k / ARMZ k) — os
+#   mesmos slots usados pelas closures — e os desvios em endereços de
+#   código (DSVS / DSVF p);
+# - run_mepa: laço de despacho sobre uma pilha de valores;
+# - mepa_listing: texto do código gerado (comando COMPILE/ASM).
+# Os caches (trechos por linha e programa ligado) ficam na sessão:
+# Interpreter.mepa_fragment / Interpreter.compile_mepa.
+#
+# Instruções usadas (extensões desta implementação marcadas com *):
+#   INPP          início do programa
+#   AMEM n        aloca n posições de memória (uma por variável)
+#   CRCT k        empilha a constante k
+#   CRVL a        empilha o valor da variável no endereço a
+#   ARMZ a        desempilha e armazena no endereço a
+#   SOMA SUBT MULT DIVI   + - * /
+#   DIVE* MODI* POTE*     // % ^
+#   CONC*         concatenação (..)
+#   INVR          troca o sinal do topo
+#   CMIG CMDG CMME CMEG CMMA CMAG   == ~= < <= > >=
+#   NEGA          not
+#   DSVS p        desvia para p
+#   DSVF p        desempilha e desvia para p se for falso (nil/false)
+#   DUPL* DESC*   duplica / descarta o topo (curto-circuito de and/or)
+#   FORP* p       desempilha início, limite e passo; sai do for em p
+#   FORL* p       'end' do for: próxima volta em p
+#   IMPR          desempilha e imprime
+#   ERRO*         erro adiado (mensagem pronta)
+#   TABL* n       desempilha n valores e empilha a tabela {v1, ..., vn}
+#   INDX*         desempilha a chave e a tabela e empilha t[chave]
+#   TAMA*         # (tamanho) do topo
+#   ARMI*         desempilha valor, chave e tabela e faz t[chave] = valor
+#   PARA          fim do programa
 # =====================================================================
 
+(OP_INPP, OP_AMEM, OP_CRCT, OP_CRVL, OP_ARMZ, OP_SOMA, OP_SUBT, OP_MULT,
+ OP_DIVI, OP_DIVE, OP_MODI, OP_POTE, OP_CONC, OP_INVR, OP_IMPR, OP_ERRO,
+ OP_PARA, OP_CMIG, OP_CMDG, OP_CMME, OP_CMEG, OP_CMMA, OP_CMAG, OP_NEGA,
+ OP_DSVS, OP_DSVF, OP_DUPL, OP_DESC, OP_FORP, OP_FORL, OP_TABL, OP_INDX,
+ OP_TAMA, OP_ARMI) = range(34)
 
-def mark_dirty() -> None:
-    """Marca o programa como 'alterado' (há mudanças não salvas)."""
-    global dirty
-    dirty = True
+MEPA_NAMES = ("INPP", "AMEM", "CRCT", "CRVL", "ARMZ", "SOMA", "SUBT", "MULT",
+              "DIVI", "DIVE", "MODI", "POTE", "CONC", "INVR", "IMPR", "ERRO",
+              "PARA", "CMIG", "CMDG", "CMME", "CMEG", "CMMA", "CMAG", "NEGA",
+              "DSVS", "DSVF", "DUPL", "DESC", "FORP", "FORL", "TABL", "INDX",
+              "TAMA", "ARMI")
 
+MEPA_BINOPS = {
+    "+": OP_SOMA, "-": OP_SUBT, "*": OP_MULT, "/": OP_DIVI,
+    "//": OP_DIVE, "%": OP_MODI, "^": OP_POTE, "..": OP_CONC,
+    "==": OP_CMIG, "~=": OP_CMDG, "<": OP_CMME, "<=": OP_CMEG,
+    ">": OP_CMMA, ">=": OP_CMAG,
+}
+MEPA_JUMPS = (OP_DSVS, OP_DSVF)
 
-def clear_dirty() -> None:
-    """Marca que não há alterações pendentes (após LOAD ou SAVE)."""
-    global dirty
-    dirty = False
 
+class MepaProgram:
+    """
+    Programa MEPA pronto para a máquina virtual.
+    code[i] é o par (opcode inteiro, argumento) da instrução i e
+    line_of[i] diz de qual linha-fonte ela veio.
+    """
 
-def ask_yes_no(msg: str) -> bool:
-    """Pergunta [s/N] e retorna True se usuário responder 's'."""
-    ans = input(f"{msg} [s/N] ").strip().lower()
-    return ans in ("s", "sim", "y", "yes")
+    __slots__ = ("code", "line_of", "var_names", "expr_of")
+
+    def __init__(self) -> None:
+        self.code: List[Tuple[int, object]] = []
+        self.line_of: List[Optional[int]] = []
+        self.var_names: List[str] = []
+        self.expr_of: Dict[int, str] = {}
+
+
+def _mepa_expr(node: tuple, out: list) -> None:
+    """Gera (em pós-ordem) as instruções que calculam 'node' na pilha."""
+    kind = node[0]
+    if kind == "k":
+        out.append((OP_CRCT, node[1]))
+    elif kind == "v":
+        out.append((OP_CRVL, node[1]))
+    elif kind == "bin":
+        _mepa_expr(node[2], out)
+        _mepa_expr(node[3], out)
+        out.append((MEPA_BINOPS[node[1]], None))
+    elif kind == "neg":
+        _mepa_expr(node[1], out)
+        out.append((OP_INVR, None))
+    elif kind == "not":
+        _mepa_expr(node[1], out)
+        out.append((OP_NEGA, None))
+    elif kind == "and" or kind == "or":
+        # o valor do lado esquerdo fica na pilha se ele decidir o resultado;
+        # os desvios aqui são relativos ao início do trecho da linha
+        _mepa_expr(node[1], out)
+        out.append((OP_DUPL, None))
+        if kind == "or":
+            out.append((OP_NEGA, None))
+        jump = len(out)
+        out.append((OP_DSVF, None))
+        out.append((OP_DESC, None))
+        _mepa_expr(node[2], out)
+        out[jump] = (OP_DSVF, len(out))
+    elif kind == "index":
+        _mepa_expr(node[1], out)
+        _mepa_expr(node[2], out)
+        out.append((OP_INDX, None))
+    elif kind == "len":
+        _mepa_expr(node[1], out)
+        out.append((OP_TAMA, None))
+    elif kind == "table":
+        for item in node[1]:
+            _mepa_expr(item, out)
+        out.append((OP_TABL, len(node[1])))
+    else:
+        raise ValueError("construção não suportada pelo backend MEPA")
+
+
+def mepa_fragment(instr: tuple) -> list:
+    """
+    Traduz UMA instrução (de compile_line) para uma lista de
+    (opcode, argumento), com as variáveis ainda pelo nome. Nos
+    cabeçalhos de bloco o trecho só calcula os valores (condição; início,
+    limite e passo do for): o desvio é posto por link_mepa.
+    """
+    kind = instr[0]
+    frag: list = []
+    if kind == "error":
+        frag.append((OP_ERRO, instr[1]))
+    elif kind == "print":
+        _mepa_expr(instr[2], frag)
+        frag.append((OP_IMPR, None))
+    elif kind == "assign":
+        _mepa_expr(instr[3], frag)
+        frag.append((OP_ARMZ, instr[1]))
+    elif kind == "setindex":
+        for node in instr[3]:
+            _mepa_expr(node, frag)
+        frag.append((OP_ARMI, None))
+    elif kind in EXPR_KINDS:
+        _mepa_expr(instr[2], frag)
+    elif kind == "for":
+        for node in instr[3]:
+            _mepa_expr(node, frag)
+    return frag
+
+
+def link_mepa(flow: ControlFlow, fragment_of: Callable[[int], list],
+              slot_of: Callable[[str], int], var_names: List[str]) -> MepaProgram:
+    """
+    Junta o programa inteiro em um programa MEPA, seguindo as operações
+    de 'flow': cada operação vira o trecho da sua linha (fragment_of, pela
+    posição da linha) mais o desvio correspondente, já com o endereço de
+    código final. O endereço de cada variável é o seu slot (slot_of), e
+    var_names (slot -> nome) serve às mensagens e à listagem.
+    """
+    prog = MepaProgram()
+    prog.var_names = var_names
+    code, line_of = prog.code, prog.line_of
+    op_start: List[int] = []            # operação do flow -> endereço
+    targets: List[Tuple[int, int]] = []  # (endereço, operação de destino)
+
+    code.append((OP_INPP, None))
+    code.append((OP_AMEM, 0))
+    line_of.extend((None, None))
+
+    for i, op in enumerate(flow.ops):
+        op_start.append(len(code))
+        n = flow.line_of(i)
+        kind = op[0]
+        if kind == "error":
+            code.append((OP_ERRO, op[1]))
+            line_of.append(n)
+            continue
+        if kind in ("print", "assign", "setindex", "test", "forprep"):
+            if kind == "setindex":
+                expr = f"{op[1]} = {op[2]}"
+            else:
+                expr = op[2] if kind == "assign" else op[1]
+            prog.expr_of[n] = expr
+            base = len(code)
+            for mop, arg in fragment_of(flow.pos_of[i]):
+                if mop == OP_CRVL or mop == OP_ARMZ:
+                    arg = slot_of(arg)
+                elif mop in MEPA_JUMPS:
+                    arg += base
+                code.append((mop, arg))
+                line_of.append(n)
+        if kind == "test":
+            targets.append((len(code), op[3]))
+            code.append((OP_DSVF, None))
+        elif kind == "jump":
+            targets.append((len(code), op[1]))
+            code.append((OP_DSVS, None))
+        elif kind == "forprep":
+            targets.append((len(code), op[4]))
+            code.append((OP_FORP, op[3]))
+        elif kind == "forloop":
+            targets.append((len(code), op[2]))
+            code.append((OP_FORL, op[1]))
+        else:
+            continue
+        line_of.append(n)
 
+    op_start.append(len(code))
+    code.append((OP_PARA, None))
+    line_of.append(None)
+    code[1] = (OP_AMEM, len(var_names))
+    # desvios: FORP/FORL levam (slots, endereço); DSVS/DSVF só o endereço
+    for addr, target in targets:
+        mop, arg = code[addr]
+        dest = op_start[target]
+        code[addr] = (mop, (arg, dest) if mop in (OP_FORP, OP_FORL) else dest)
+    return prog
 
-def ensure_can_discard_changes() -> bool:
+
+def run_mepa(prog: MepaProgram, emit: Callable[[object], None],
+             mem: List[object]) -> Optional[Tuple[int, str]]:
+    """
+    Máquina virtual MEPA: executa prog sobre uma pilha de valores,
+    mandando o que for impresso para emit. A memória é 'mem', a mesma
+    lista de slots da sessão: o STACK vê as variáveis sem cópia.
+    Retorna None se terminou bem, ou (linha, mensagem) em caso de erro.
+    """
+    code = prog.code
+    undefined = UNDEFINED
+    stack: List[object] = []
+    push = stack.append
+    pop = stack.pop
+    pc = 0
+    error = None
+    try:
+        while True:
+            op, arg = code[pc]
+            pc += 1
+            if op == OP_CRVL:
+                v = mem[arg]
+                if v is undefined:
+                    raise NameError(f"name '{prog.var_names[arg]}' is not defined")
+                push(v)
+            elif op == OP_CRCT:
+                push(arg)
+            elif op == OP_ARMZ:
+                mem[arg] = pop()
+            elif op == OP_SOMA:
+                b = pop()
+                stack[-1] = lua_add(stack[-1], b)
+            elif op == OP_SUBT:
+                b = pop()
+                stack[-1] = lua_sub(stack[-1], b)
+            elif op == OP_MULT:
+                b = pop()
+                stack[-1] = lua_mul(stack[-1], b)
+            elif op == OP_DIVI:
+                b = pop()
+                stack[-1] = lua_div(stack[-1], b)
+            elif op == OP_DSVF:
+                v = pop()
+                if v is None or v is False:
+                    pc = arg
+            elif op == OP_DSVS:
+                pc = arg
+            elif op == OP_CMME:
+                b = pop()
+                stack[-1] = lua_lt(stack[-1], b)
+            elif op == OP_CMEG:
+                b = pop()
+                stack[-1] = lua_le(stack[-1], b)
+            elif op == OP_CMMA:
+                b = pop()
+                stack[-1] = lua_gt(stack[-1], b)
+            elif op == OP_CMAG:
+                b = pop()
+                stack[-1] = lua_ge(stack[-1], b)
+            elif op == OP_CMIG:
+                b = pop()
+                stack[-1] = lua_eq(stack[-1], b)
+            elif op == OP_CMDG:
+                b = pop()
+                stack[-1] = lua_ne(stack[-1], b)
+            elif op == OP_FORL:
+                if for_next(mem, arg[0]):
+                    pc = arg[1]
+            elif op == OP_IMPR:
+                emit(pop())
+            elif op == OP_INVR:
+                stack[-1] = lua_neg(stack[-1])
+            elif op == OP_DIVE:
+                b = pop()
+                stack[-1] = lua_idiv(stack[-1], b)
+            elif op == OP_MODI:
+                b = pop()
+                stack[-1] = lua_mod(stack[-1], b)
+            elif op == OP_POTE:
+                b = pop()
+                stack[-1] = lua_pow(stack[-1], b)
+            elif op == OP_CONC:
+                b = pop()
+                stack[-1] = lua_concat(stack[-1], b)
+            elif op == OP_NEGA:
+                v = stack[-1]
+                stack[-1] = v is None or v is False
+            elif op == OP_DUPL:
+                push(stack[-1])
+            elif op == OP_DESC:
+                pop()
+            elif op == OP_FORP:
+                step = pop()
+                stop = pop()
+                if not for_enter(mem, arg[0], pop(), stop, step):
+                    pc = arg[1]
+            elif op == OP_INDX:
+                k = pop()
+                t = stack[-1]
+                if type(t) is LuaTable and type(k) is int and 0 < k <= len(t.array):
+                    stack[-1] = t.array[k - 1]
+                else:
+                    stack[-1] = lua_index(t, k)
+            elif op == OP_ARMI:
+                v = pop()
+                k = pop()
+                lua_setindex(pop(), k, v)
+            elif op == OP_TABL:
+                if arg:
+                    items = stack[-arg:]
+                    del stack[-arg:]
+                    push(LuaTable(items))
+                else:
+                    push(LuaTable())
+            elif op == OP_TAMA:
+                stack[-1] = lua_len(stack[-1])
+            elif op == OP_AMEM:
+                if len(mem) < arg:
+                    mem.extend([UNDEFINED] * (arg - len(mem)))
+            elif op == OP_PARA:
+                break
+            elif op == OP_ERRO:
+                raise RuntimeError(arg)
+            # OP_INPP: nada a fazer
+    except RuntimeError as e:
+        # erros adiados e do for: a mensagem já vem pronta
+        error = (prog.line_of[pc - 1], str(e))
+    except Exception as e:
+        n = prog.line_of[pc - 1]
+        error = (n, f"Erro ao avaliar expressão '{prog.expr_of.get(n, '')}': {e}")
+    return error
+
+
+def mepa_listing(prog: MepaProgram, program_lines: ProgramStore) -> List[str]:
+    """Texto do código MEPA, com cada linha-fonte antes de suas instruções."""
+    out: List[str] = []
+    last_line = None
+    for i, (op, arg) in enumerate(prog.code):
+        name = MEPA_NAMES[op]
+        if op in (OP_CRVL, OP_ARMZ):
+            text = f"{name} {arg:<6} ; {prog.var_names[arg]}"
+        elif op in (OP_FORP, OP_FORL):
+            var = prog.var_names[arg[0][0]] if arg[0] else "?"
+            text = f"{name} {arg[1]:<6} ; {var}"
+        elif op == OP_CRCT:
+            text = f"{name} {arg!r}"
+        elif op == OP_ERRO:
+            text = f"{name} ; {arg}"
+        elif arg is not None:
+            text = f"{name} {arg}"
+        else:
+            text = name
+        n = prog.line_of[i]
+        if n is not None and n != last_line:
+            out.append(f"; {n} {program_lines[n]}")
+            last_line = n
+        out.append(f"{i:6d}  {text}")
+    return out
+
+
+# =====================================================================
+# 7. COMANDOS DO REPL (APRESENTAÇÃO)
+# =====================================================================
+# Cada comando do REPL chama o método correspondente da sessão
+# (Interpreter) e mostra o resultado na tela com as mensagens de
+# sempre. Toda a lógica fica na sessão; aqui só há texto e perguntas
+# ao usuário (salvar antes de descartar, nome do arquivo, paginação).
+# =====================================================================
+
+
+def ensure_can_discard_changes(session: Interpreter, quiet: bool = False) -> bool:
     """
     Se houver alterações não salvas, pergunta se pode descartar
-    (oferecendo a opção de salvar antes).
+    (oferecendo a opção de salvar antes). Com 'quiet' (modo script) não
+    há pergunta: as alterações são descartadas, com um aviso.
 
     Retorna True se pode continuar a operação,
     ou False se o usuário cancelar ou algo der errado.
     """
-    if not dirty:
+    if not session.dirty:
+        return True
+    if quiet:
+        print("Aviso: alterações não salvas descartadas.")
         return True
     if ask_yes_no("Há alterações não salvas. Deseja salvar antes?"):
-        if not cmd_save():
+        if not cmd_save(session):
             # erro ou cancelado
             return False
         return True
@@ -113,90 +4982,113 @@ def ensure_can_discard_changes() -> bool:
         return True
 
 
-def parse_int(value: str) -> Optional[int]:
-    """Tenta converter para int; em caso de falha, retorna None."""
-    try:
-        return int(value)
-    except ValueError:
-        return None
-
-
-def sorted_line_numbers():
-    """Retorna a lista de números de linha do programa em ordem crescente."""
-    return sorted(program_lines.keys())
-
-
-# =====================================================================
-# 3. COMANDOS DO REPL (EDIÇÃO E ARQUIVOS)
-# =====================================================================
-# Este bloco contém as funções que implementam os comandos:
-# LOAD, LIST, INS, DEL, SAVE.
-# São responsáveis por carregar/salvar código, listar, inserir e
-# remover linhas do programa em memória.
-# =====================================================================
-
-
-def cmd_load(path: str) -> None:
+def cmd_load(session: Interpreter, path: str,
+             cache_mode: Optional[str] = None, quiet: bool = False) -> None:
     """
     Comando LOAD.
-    Carrega um arquivo de código numerado (formato: '<linha> <código>')
-    e o armazena em program_lines.
+    Carrega um arquivo de código numerado (formato: '<linha> <código>').
+    Usa o cache .mepac quando válido (cache_mode: "off" desliga,
+    "rebuild" força a reconstrução). 'quiet' (modo script): só avisos
+    e erros, sem confirmação nem perguntas.
     """
-    global current_file, program_lines, debug_mode, program_counter, runtime_env
-
     # Antes de trocar o programa, verifica alterações não salvas
-    if not ensure_can_discard_changes():
+    if not ensure_can_discard_changes(session, quiet):
         print("Operação LOAD cancelada.")
         return
 
-    if not os.path.exists(path):
-        print(f"Erro: arquivo '{path}' não encontrado.")
-        return
-
     try:
-        new_program: Dict[int, str] = {}
-        with open(path, "r", encoding="utf-8") as f:
-            for raw_line in f:
-                line = raw_line.rstrip("\n")
-                if not line.strip():
-                    continue
-                # Espera algo como: 10 x = 1
-                parts = line.split(maxsplit=1)
-                if len(parts) != 2:
-                    print(f"Aviso: linha ignorada (sem número + código): {line}")
-                    continue
-                num_str, code = parts
-                num = parse_int(num_str)
-                if num is None or num < 0:
-                    print(f"Aviso: número de linha inválido: {line}")
-                    continue
-                new_program[num] = code
+        for warning in session.load(path, cache_mode):
+            print(warning)
+        if quiet:
+            return
+        print(f"Arquivo '{path}' carregado com sucesso.")
+        if session.journal.records:
+            print(f"Diário '{journal_path(path)}' aplicado: "
+                  f"{session.journal.records} alteração(ões).")
+    except InterpreterError as e:
+        print(e)
+    except Exception as e:
+        print(f"Erro ao carregar arquivo: {e}")
 
-        program_lines = new_program
-        current_file = path
-        clear_dirty()
 
-        # reset estado de execução
-        debug_mode = False
-        program_counter = None
-        runtime_env = {}
+def show_reload(changed: List[int], removed: List[int]) -> None:
+    """Resumo de um WATCH: quantas linhas mudaram (e quais, se forem poucas)."""
+    if not changed and not removed:
+        print("Nenhuma linha mudou.")
+        return
+    parts = []
+    for nums, what in ((changed, "nova(s) ou alterada(s)"), (removed, "removida(s)")):
+        if nums:
+            shown = ", ".join(map(str, nums[:WARNING_EXAMPLES]))
+            more = ", ..." if len(nums) > WARNING_EXAMPLES else ""
+            parts.append(f"{len(nums)} {what} ({shown}{more})")
+    print(f"Linhas: {'; '.join(parts)}.")
 
-        print(f"Arquivo '{path}' carregado com sucesso.")
+
+def cmd_watch(session: Interpreter, path: str, quiet: bool = False) -> None:
+    """
+    Comando WATCH (e opção --watch): carrega o arquivo, roda o programa e
+    fica observando o arquivo (FileWatcher). A cada alteração feita num
+    editor, aplica só as linhas que mudaram (Interpreter.reload) e roda
+    de novo. Ctrl+C encerra o WATCH e volta ao prompt.
+    """
+    if not ensure_can_discard_changes(session, quiet):
+        print("Operação WATCH cancelada.")
+        return
+    try:
+        diff, warnings = session.watch(path)
+    except InterpreterError as e:
+        print(e)
+        return
     except Exception as e:
         print(f"Erro ao carregar arquivo: {e}")
+        return
+    for warning in warnings:
+        print(warning)
+    watcher = FileWatcher(path)
+    print(f"Observando '{path}' (Ctrl+C para parar).")
+    try:
+        while True:
+            if diff is not None:
+                show_reload(*diff)
+            if session.program_lines:
+                t0 = time.perf_counter()
+                if cmd_run(session, quiet=True):
+                    print(f"Execução finalizada ({time.perf_counter() - t0:.3f}s).")
+            else:
+                print("Nenhum programa carregado.")
+            while True:
+                watcher.wait()
+                print(f"\n'{path}' alterado: recarregando...")
+                try:
+                    diff, warnings = session.reload()
+                    break
+                except InterpreterError as e:  # apagado e não recriado
+                    print(e)
+            for warning in warnings:
+                print(warning)
+    except KeyboardInterrupt:
+        session.output_sink.flush()
+        print("\nWATCH encerrado.")
 
 
-def cmd_list() -> None:
+def cmd_list(session: Interpreter, page_size: Optional[int] = 20) -> None:
     """
     Comando LIST.
-    Lista o programa em memória, exibindo 20 linhas por 'página'.
+    Lista o programa em memória, exibindo 'page_size' linhas por
+    'página' (None ou 0 lista tudo de uma vez, sem pausas).
     """
+    program_lines = session.program_lines
     if not program_lines:
         print("Nenhum programa carregado.")
         return
 
-    nums = sorted_line_numbers()
-    page_size = 20
+    if not page_size:
+        for n, code in program_lines.items():
+            print(f"{n:4d} {code}")
+        return
+
+    nums = session.line_numbers()
     for i in range(0, len(nums), page_size):
         chunk = nums[i:i + page_size]
         for n in chunk:
@@ -205,17 +5097,13 @@ def cmd_list() -> None:
             input("-- pressione ENTER para continuar --")
 
 
-def cmd_ins(line_no: int, code: str) -> None:
+def cmd_ins(session: Interpreter, line_no: int, code: str) -> None:
     """
     Comando INS.
     Insere ou substitui a linha 'line_no' pelo código fornecido.
     """
-    existed = line_no in program_lines
-    old = program_lines.get(line_no)
-    program_lines[line_no] = code
-    mark_dirty()
-
-    if existed:
+    old = session.ins(line_no, code)
+    if old is not None:
         print(f"Linha {line_no} substituída.")
         print(f"   De: {old}")
         print(f"   Para: {code}")
@@ -223,263 +5111,483 @@ def cmd_ins(line_no: int, code: str) -> None:
         print(f"Linha {line_no} inserida: {code}")
 
 
-def cmd_del_single(line_no: int) -> None:
+def cmd_paste(session: Interpreter, lines: Iterable[str]) -> None:
+    """
+    Comando PASTE (ou INS BLOCK).
+    Insere de uma vez as linhas '<número> <código>' recebidas, com as
+    regras do LOAD, e mostra um único resumo no lugar de uma
+    confirmação por linha.
+    """
+    t0 = time.perf_counter()
+    code, warnings = parse_numbered_lines(lines)
+    replaced = session.ins_block(code)
+    for warning in warnings:
+        print(warning)
+    print(f"PASTE: {len(code)} linha(s) ({len(code) - replaced} nova(s), "
+          f"{replaced} substituída(s)) em {time.perf_counter() - t0:.3f}s.")
+
+
+def cmd_del_single(session: Interpreter, line_no: int, quiet: bool = False) -> None:
     """
     Comando DEL com um único número de linha.
     Remove uma linha específica do programa.
     """
-    if line_no not in program_lines:
-        print(f"Erro: linha {line_no} inexistente.")
+    try:
+        removed = session.delete(line_no)
+    except InterpreterError as e:
+        print(e)
         return
-    removed = program_lines.pop(line_no)
-    mark_dirty()
-    print(f"Linha {line_no} removida: {removed}")
+    if not quiet:
+        print(f"Linha {line_no} removida: {removed}")
 
 
-def cmd_del_range(start_no: int, end_no: int) -> None:
+def cmd_del_range(session: Interpreter, start_no: int, end_no: int,
+                  quiet: bool = False) -> None:
     """
     Comando DEL com intervalo.
     Remove todas as linhas entre start_no e end_no (inclusive).
     """
-    if start_no > end_no:
-        print("Erro: intervalo inválido (linha inicial maior que final).")
+    try:
+        removed = session.delete_range(start_no, end_no)
+    except InterpreterError as e:
+        print(e)
+        return
+    if quiet:
         return
-    to_remove = [n for n in program_lines.keys() if start_no <= n <= end_no]
-    if not to_remove:
+    if not removed:
         print("Nenhuma linha no intervalo especificado.")
         return
-    for n in sorted(to_remove):
-        print(f"Removendo linha {n}: {program_lines[n]}")
-        program_lines.pop(n)
-    mark_dirty()
+    for n, code in removed:
+        print(f"Removendo linha {n}: {code}")
 
 
-def cmd_save() -> bool:
+def cmd_save(session: Interpreter, full: bool = False, quiet: bool = False) -> bool:
     """
-    Comando SAVE.
-    Salva o programa em disco no arquivo atual.
+    Comando SAVE [FULL].
+    Salva o programa em disco no arquivo atual (pergunta o nome se o
+    programa ainda não tem arquivo; com 'quiet', do modo script, não
+    pergunta nem confirma). Sem FULL, as alterações podem ir só para o
+    diário do arquivo (ver Interpreter.save).
     Retorna True se salvou com sucesso, False em caso de erro.
     """
-    global current_file
-    if not program_lines:
+    if not session.program_lines:
         print("Nenhum programa em memória para salvar.")
         return False
 
-    if current_file is None:
+    path = session.current_file
+    if path is None:
+        if quiet:
+            print("Nenhum arquivo associado ao programa (use LOAD antes).")
+            return False
         path = input("Informe o nome do arquivo para salvar: ").strip()
         if not path:
             print("Operação SAVE cancelada (nome vazio).")
             return False
-        current_file = path
 
     try:
-        with open(current_file, "w", encoding="utf-8") as f:
-            for n in sorted_line_numbers():
-                f.write(f"{n} {program_lines[n]}\n")
-        clear_dirty()
-        print(f"Arquivo '{current_file}' salvo com sucesso.")
+        session.save(path, full)
+        journal = session.journal
+        if quiet:
+            return True
+        if journal.size:
+            print(f"Arquivo '{path}' salvo com sucesso ({journal.records} "
+                  f"alteração(ões) no diário '{journal_path(path)}').")
+        else:
+            print(f"Arquivo '{path}' salvo com sucesso.")
         return True
     except Exception as e:
         print(f"Erro ao salvar arquivo: {e}")
         return False
 
 
-# =====================================================================
-# 4. INTERPRETADOR MINI-LUA (EXECUÇÃO)
-# =====================================================================
-# Este bloco contém o núcleo do "interpretador":
-# - reset_runtime: prepara ambiente de execução e program_counter;
-# - eval_expression: avalia expressões aritméticas usando eval;
-# - execute_line: interpreta UMA linha de código (atribuição/print);
-# - run_sequential: executa o programa por completo ou prepara para DEBUG.
-# =====================================================================
-
-
-def reset_runtime():
+def cmd_run(session: Interpreter, backend: str = "ast",
+            profile: Optional[Dict[int, list]] = None, quiet: bool = False) -> bool:
     """
-    Reinicia o ambiente de execução:
-    - limpa as variáveis (runtime_env),
-    - posiciona o program_counter na primeira linha existente.
+    Comando RUN (RUN VM com backend="vm", RUN OPT com backend="opt").
+    Retorna True se a execução terminou sem erro. Com 'quiet' (modo
+    script), só a saída do programa e os erros aparecem. Com --metrics
+    (session.metrics_path), o registro do RUN vai para o arquivo.
+    Ctrl+C interrompe só a execução (um laço sem fim, por exemplo): o
+    programa continua em memória e o REPL volta ao prompt.
     """
-    global runtime_env, program_counter
-    runtime_env = {}
-    pc_list = sorted_line_numbers()
-    program_counter = pc_list[0] if pc_list else None
+    try:
+        error = session.run(backend, profile)
+    except InterpreterError as e:
+        print(e)
+        return False
+    except KeyboardInterrupt:
+        session.output_sink.flush()
+        print("\nExecução interrompida.")
+        return False
+    if session.metrics_path is not None:
+        try:
+            append_metrics(session.metrics_path, session.stats.last_record())
+        except OSError as e:
+            print(f"Erro ao gravar métricas em '{session.metrics_path}': {e}")
+    if error is not None:
+        print(f"Erro na linha {error[0]}: {error[1]}")
+        return False
+    if not quiet:
+        print("Execução finalizada.")
+    return True
 
 
-def eval_expression(expr: str) -> object:
-    """
-    Avalia uma expressão da nossa mini-Lua usando eval do Python.
+# quantas linhas o relatório do PROFILE mostra na tela
+PROFILE_TOP = 20
 
-    ATENÇÃO: isso não é Lua de verdade, mas um subconjunto bem parecido:
-      - +, -, *, /, parênteses
-      - nomes de variáveis iguais
 
-    O escopo usado é somente o dicionário de variáveis runtime_env.
+def show_profile(rows: List[Tuple[int, int, int, str]],
+                 top: int = PROFILE_TOP) -> None:
+    """Mostra as linhas mais caras do perfil, com o código de cada uma."""
+    total_ns = sum(row[2] for row in rows)
+    executions = sum(row[1] for row in rows)
+    print(f"Perfil: {len(rows)} linha(s), {executions} execução(ões), "
+          f"{total_ns / 1e6:.3f} ms no total.")
+    print(f"{'linha':>7} {'execuções':>10} {'total (ms)':>11} "
+          f"{'média (µs)':>11} {'%':>6}  código")
+    for n, count, total, code in rows[:top]:
+        share = 100.0 * total / total_ns if total_ns else 0.0
+        print(f"{n:>7} {count:>10} {total / 1e6:>11.3f} "
+              f"{total / count / 1e3:>11.1f} {share:>6.1f}  {code}")
+    if len(rows) > top:
+        print(f"  ... mais {len(rows) - top} linha(s) (grave em JSON/CSV "
+              f"para ver todas)")
+
+
+def write_profile(rows: List[Tuple[int, int, int, str]], path: str) -> None:
+    """Grava o perfil completo em CSV (extensão .csv) ou JSON."""
+    records = [{"line": n, "count": count, "total_ms": total / 1e6,
+                "avg_us": total / count / 1e3, "code": code}
+               for n, count, total, code in rows]
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        if path.lower().endswith(".csv"):
+            writer = csv.DictWriter(f, fieldnames=["line", "count", "total_ms",
+                                                   "avg_us", "code"])
+            writer.writeheader()
+            writer.writerows(records)
+        else:
+            json.dump(records, f, ensure_ascii=False, indent=2)
+
+
+def cmd_profile(session: Interpreter, path: Optional[str] = None) -> None:
     """
-    try:
-        value = eval(expr, {}, runtime_env)
-        return value
-    except Exception as e:
-        raise RuntimeError(f"Erro ao avaliar expressão '{expr}': {e}")
+    Comando PROFILE (ou RUN PROFILE).
+    Executa o programa medindo cada linha, mostra as linhas mais caras
+    e, se 'path' for dado, grava o perfil completo em JSON ou CSV.
+    """
+    stats: Dict[int, list] = {}
+    cmd_run(session, profile=stats)
+    if not stats:
+        return
+    rows = session.profile_rows(stats)
+    show_profile(rows)
+    if path:
+        try:
+            write_profile(rows, path)
+            print(f"Perfil gravado em '{path}'.")
+        except OSError as e:
+            print(f"Erro ao gravar perfil: {e}")
 
 
-def execute_line(code: str) -> None:
+def cmd_asm(session: Interpreter) -> None:
     """
-    Executa UMA linha de código da mini-Lua.
-    Suporta:
-        - local x = expr
-        - x = expr
-        - print(expr)
+    Comando COMPILE/ASM.
+    Mostra o código MEPA gerado para o programa em memória.
     """
-    stripped = code.strip()
-    if not stripped:
+    try:
+        listing = session.asm()
+    except InterpreterError as e:
+        print(e)
         return
+    for text in listing:
+        print(text)
 
-    # Trata "local x = ..." como "x = ..."
-    if stripped.startswith("local "):
-        stripped = stripped[len("local "):].lstrip()
 
-    # print(...)
-    if stripped.startswith("print(") and stripped.endswith(")"):
-        inner = stripped[len("print("):-1].strip()
-        value = eval_expression(inner)
-        print(value)
+def cmd_opt(session: Interpreter) -> None:
+    """Comando OPT: otimiza o programa e mostra o que mudou."""
+    try:
+        _flow, stats = session.optimize()
+    except InterpreterError as e:
+        print(e)
         return
+    print(f"Otimização ({stats['lines']} linha(s), {stats['ops']} operação(ões)):")
+    print(f"  expressões com constantes propagadas/dobradas: {stats['folded']}")
+    print(f"  atribuições mortas removidas: {stats['removed']}")
+    print(f"  operações vazias retiradas: {stats['nops']}")
+    print("Use RUN OPT para executar a versão otimizada.")
 
-    # Atribuição: x = expr
-    if "=" in stripped:
-        var_name, expr = stripped.split("=", 1)
-        var_name = var_name.strip()
-        expr = expr.strip()
-        if not var_name.isidentifier():
-            raise RuntimeError(f"Nome de variável inválido: '{var_name}'")
-        value = eval_expression(expr)
-        runtime_env[var_name] = value
+
+def show_cache_stats(session: Interpreter) -> None:
+    """Comando CACHE: mostra acertos e falhas do cache de compilação."""
+    stats = session.cache_stats()
+    total = stats["hits"] + stats["misses"]
+    rate = (100.0 * stats["hits"] / total) if total else 0.0
+    print("Cache de compilação:")
+    print(f"  linhas em cache: {stats['lines']}")
+    print(f"  linhas pré-compiladas (.mepac) ainda não usadas: "
+          f"{stats['precompiled']}")
+    print(f"  acertos: {stats['hits']}")
+    print(f"  falhas:  {stats['misses']}")
+    print(f"  taxa de acerto: {rate:.1f}%")
+    print(f"RUN incremental: {stats['checkpoints']} checkpoint(s), "
+          f"{stats['checkpoint_bytes'] / 1024:.0f} KB")
+    if stats["last_resume"] is not None:
+        print(f"  último RUN recomeçou na linha {stats['last_resume']}")
+    spec = stats["spec"]
+    print(f"Especialização por tipo: {spec['specialized']} linha(s) "
+          f"especializada(s), {spec['generic']} mantida(s) genérica(s)")
+    print(f"  falhas de guarda (deopt): {spec['deopts']}, "
+          f"linhas que voltaram ao caminho genérico: {spec['reverted']}")
+
+
+def show_memory_usage(session: Interpreter) -> None:
+    """Comando MEM: mostra a memória usada pela sessão, por parte."""
+    usage = session.memory_usage()
+    print(f"Memória da sessão (aproximada, em KB; "
+          f"{len(session.program_lines)} linha(s) no programa):")
+    for key, what in (("program", "programa (números + texto)"),
+                      ("compiled", "linhas compiladas (cache)"),
+                      ("linked", "programa ligado (RUN/OPT)"),
+                      ("mepa", "código MEPA (RUN VM)"),
+                      ("variables", "variáveis do programa"),
+                      ("checkpoints", "checkpoints do RUN"),
+                      ("trace", "histórico do DEBUG"),
+                      ("buffers", "saída e diário pendentes")):
+        print(f"  {what:<28} {usage[key] / 1024:>12,.1f}")
+    print(f"  {'total':<28} {sum(usage.values()) / 1024:>12,.1f}")
+
+
+def show_stats(session: Interpreter, args: str = "") -> None:
+    """Comando STATS [RESET]: contadores e tempos da sessão."""
+    stats = session.stats
+    if args.upper() == "RESET":
+        stats.reset()
+        print("Estatísticas zeradas.")
+        return
+    if args:
+        print("Uso: STATS ou STATS RESET")
         return
+    totals = stats.as_dict()
+    print("Estatísticas da sessão (tempos em segundos):")
+    print(f"  LOAD:  {stats.loads} vez(es), {stats.lines_loaded:,} linha(s) "
+          f"carregada(s) em {stats.load_seconds:.3f}")
+    print(f"  SAVE:  {stats.saves} vez(es) em {stats.save_seconds:.3f}")
+    print(f"  RUN:   {stats.runs} vez(es), {stats.run_errors} com erro; "
+          f"compilação {stats.compile_seconds:.3f}, "
+          f"execução {stats.execute_seconds:.3f}")
+    print(f"         {stats.lines_executed:,} linha(s) executada(s) "
+          f"({totals['lines_per_second']:,.0f}/s), "
+          f"{stats.evaluations:,} avaliação(ões) de expressão")
+    print(f"  DEBUG: {stats.debug_steps} passo(s) em "
+          f"{stats.debug_seconds:.3f}")
+    last = stats.last_record()
+    if last is not None:
+        if last["error_line"] is not None:
+            where = f", erro na linha {last['error_line']}"
+        else:
+            where = ", interrompido" if last["errors"] else ""
+        executed = ("linhas não contadas" if last["lines_executed"] is None
+                    else f"{last['lines_executed']:,} linha(s) executada(s) "
+                         f"({last['lines_per_second'] or 0:,.0f}/s)")
+        print(f"  último RUN ({last['backend']}): {executed}, compilação "
+              f"{last['compile_seconds']:.4f}, execução "
+              f"{last['execute_seconds']:.4f}{where}")
+    if session.metrics_path is not None:
+        print(f"  métricas de cada RUN em '{session.metrics_path}' (JSON por linha)")
 
-    # Caso não reconheça a sintaxe:
-    raise RuntimeError(f"Instrução não suportada: '{code}'")
 
+def cmd_debug(session: Interpreter) -> bool:
+    """Comando DEBUG: prepara a execução passo a passo."""
+    try:
+        line_no = session.start_debug()
+    except InterpreterError as e:
+        print(e)
+        return False
+    print(f"Modo DEBUG: pronto na linha {line_no}.")
+    return True
 
-def run_sequential(debug: bool = False) -> None:
-    """
-    Executa o programa sequencialmente.
 
-    - Se debug=False (comando RUN):
-        executa todas as linhas em ordem, do início ao fim.
+def debug_next(session: Interpreter) -> None:
+    """Comando NEXT: executa a próxima linha no modo DEBUG."""
+    try:
+        line_no, code, error, restarted = session.step()
+    except InterpreterError as e:
+        print(e)
+        return
+    if restarted:
+        print("Program counter inválido, reiniciando debug.")
+    print(f"[DEBUG] Executando linha {line_no}: {code}")
+    # no DEBUG a saída da linha aparece imediatamente
+    session.output_sink.flush()
+    if error is not None:
+        print(f"Erro na linha {line_no}: {error}")
+        print("Modo de depuração finalizado.")
+    elif session.program_counter is not None:
+        print(f"[DEBUG] Próxima linha: {session.program_counter}")
+    else:
+        print("[DEBUG] Fim do programa alcançado.")
+        print("Modo de depuração finalizado.")
 
-    - Se debug=True (comando DEBUG):
-        apenas configura o estado para execução passo a passo
-        (program_counter) e exibe a linha inicial; a execução em si
-        é feita pela função debug_next().
-    """
-    global program_counter
 
-    if not program_lines:
-        print("Nenhum programa carregado.")
+def debug_cont(session: Interpreter) -> None:
+    """Comando CONT: executa até o próximo breakpoint (ou o fim)."""
+    try:
+        reason, line_no, error = session.cont()
+    except InterpreterError as e:
+        print(e)
+        return
+    except KeyboardInterrupt:  # como no RUN: o programa fica em memória
+        session.output_sink.flush()
+        print("\nExecução interrompida.")
+        print("Modo de depuração finalizado.")
         return
+    session.output_sink.flush()
+    if reason == "break":
+        print(f"[DEBUG] Breakpoint na linha {line_no}: "
+              f"{session.program_lines[line_no]}")
+    elif reason == "error":
+        print(f"Erro na linha {line_no}: {error}")
+        print("Modo de depuração finalizado.")
+    else:
+        print("[DEBUG] Fim do programa alcançado.")
+        print("Modo de depuração finalizado.")
 
-    if not debug:
-        # RUN: executa tudo de uma vez
-        reset_runtime()
-        for n in sorted_line_numbers():
-            code = program_lines[n]
-            try:
-                execute_line(code)
-            except RuntimeError as e:
-                print(f"Erro na linha {n}: {e}")
-                return
-        print("Execução finalizada.")
+
+def show_step(session: Interpreter) -> None:
+    """Mostra em que passo do histórico do DEBUG a sessão está."""
+    trace = session.trace
+    line_no = trace.line_of(trace.pos)
+    done = f"linha {line_no} executada" if line_no is not None else "início"
+    if session.program_counter is not None:
+        print(f"[DEBUG] Passo {trace.pos} ({done}); "
+              f"próxima linha: {session.program_counter}")
     else:
-        # DEBUG: só posiciona para a primeira linha
-        if program_counter is None:
-            reset_runtime()
-        # O resto é controlado por NEXT
-        if program_counter is None:
-            print("Não há linhas para executar.")
-        else:
-            print(f"Modo DEBUG: pronto na linha {program_counter}.")
+        print(f"[DEBUG] Passo {trace.pos} ({done}); fim do programa.")
 
 
-# =====================================================================
-# 5. MODO DEBUG (NEXT / STACK / STOP)
-# =====================================================================
-# Conjunto de funções voltadas à execução passo a passo:
-# - debug_next: executa somente a próxima linha;
-# - show_stack: mostra o estado atual das variáveis;
-# - stop_debug: sai do modo debug e reseta program_counter.
-# =====================================================================
+def cmd_back(session: Interpreter, args: str) -> None:
+    """Comando BACK [k]: volta k passos (padrão 1) no DEBUG."""
+    steps = parse_int(args) if args else 1
+    if steps is None or steps < 1:
+        print("Uso: BACK [passos]")
+        return
+    try:
+        session.back(steps)
+    except InterpreterError as e:
+        print(e)
+        return
+    show_step(session)
+
 
+def cmd_step(session: Interpreter, args: str) -> None:
+    """Comando STEP <n>: vai ao estado depois do passo n do DEBUG."""
+    n = parse_int(args)
+    if n is None or n < 0:
+        print("Uso: STEP <passo>")
+        return
+    try:
+        error = session.goto_step(n)
+    except InterpreterError as e:
+        print(e)
+        return
+    # passos depois do último guardado são executados (com saída)
+    session.output_sink.flush()
+    if error is not None:
+        print(f"Erro na linha {error[0]}: {error[1]}")
+        print("Modo de depuração finalizado.")
+        return
+    show_step(session)
 
-def debug_next() -> None:
-    """Executa a próxima linha no modo DEBUG."""
-    global program_counter
 
-    if program_counter is None:
-        print("Nenhuma linha pronta para executar (DEBUG).")
+def show_trace(session: Interpreter) -> None:
+    """Comando TRACE: resumo do histórico do DEBUG."""
+    trace = session.trace
+    if not trace.active:
+        print("Nenhum passo gravado (use DEBUG e NEXT).")
         return
+    print(f"Histórico do DEBUG: passos {trace.base} a {trace.last} "
+          f"(atual: {trace.pos}), {len(trace.cp_steps)} checkpoint(s), "
+          f"~{trace.size / 1024:.1f} KB de {trace.budget / 1024:.0f} KB.")
 
-    nums = sorted_line_numbers()
-    if program_counter not in nums:
-        print("Program counter inválido, reiniciando debug.")
-        reset_runtime()
-        if program_counter is None:
-            print("Não há linhas para executar.")
-            return
 
-    idx = nums.index(program_counter)
-    line_no = nums[idx]
-    code = program_lines[line_no]
-    print(f"[DEBUG] Executando linha {line_no}: {code}")
+def cmd_break(session: Interpreter, args: str) -> None:
+    """Comando BREAK: lista os breakpoints ou marca BREAK <linha> [IF <expr>]."""
+    if not args:
+        breakpoints = session.breakpoint_list()
+        if not breakpoints:
+            print("Nenhum breakpoint.")
+        for n, cond in breakpoints:
+            print(f"  {n}" + (f" IF {cond}" if cond else ""))
+        return
+    num_str, _, rest = args.partition(" ")
+    num = parse_int(num_str)
+    keyword, _, condition = rest.strip().partition(" ")
+    if num is None or (rest.strip() and (keyword.upper() != "IF" or not condition.strip())):
+        print("Uso: BREAK <linha> [IF <expressão>]")
+        return
     try:
-        execute_line(code)
-    except RuntimeError as e:
-        print(f"Erro na linha {line_no}: {e}")
-        # Em caso de erro, cancelamos o modo debug automaticamente
-        stop_debug()
+        session.set_breakpoint(num, condition.strip() or None)
+    except InterpreterError as e:
+        print(e)
         return
+    suffix = f" (se {condition.strip()})" if condition.strip() else ""
+    print(f"Breakpoint na linha {num}{suffix}.")
 
-    # Avança para próxima linha
-    if idx + 1 < len(nums):
-        program_counter = nums[idx + 1]
-        print(f"[DEBUG] Próxima linha: {program_counter}")
+
+def cmd_clear(session: Interpreter, args: str) -> None:
+    """Comando CLEAR [linha]: remove um breakpoint ou todos."""
+    if not args:
+        count = session.clear_breakpoints()
+        print(f"{count} breakpoint(s) removido(s).")
+        return
+    num = parse_int(args)
+    if num is None:
+        print("Uso: CLEAR [linha]")
+    elif session.clear_breakpoints(num):
+        print(f"Breakpoint da linha {num} removido.")
     else:
-        print("[DEBUG] Fim do programa alcançado.")
-        stop_debug()
+        print(f"Não há breakpoint na linha {num}.")
 
 
-def show_stack() -> None:
-    """
-    Exibe o estado das variáveis do programa.
-    Aqui usamos runtime_env como se fosse a 'pilha' de execução.
-    """
-    if not runtime_env:
+def show_stack(session: Interpreter) -> None:
+    """Comando STACK: exibe o estado das variáveis do programa."""
+    variables = session.stack()
+    if not variables:
         print("STACK vazia (nenhuma variável definida).")
         return
     print("STACK / Variáveis:")
-    for k in sorted(runtime_env.keys()):
-        print(f"  {k} = {runtime_env[k]!r}")
+    for name, value in variables:
+        shown = lua_repr(value) if value is None or type(value) is bool else repr(value)
+        print(f"  {name} = {shown}")
 
 
-def stop_debug() -> None:
-    """Sai do modo de depuração e reseta o program_counter."""
-    global debug_mode, program_counter
-    debug_mode = False
-    program_counter = None
+def stop_debug(session: Interpreter) -> None:
+    """Comando STOP: sai do modo de depuração."""
+    session.stop_debug()
     print("Modo de depuração finalizado.")
 
 
 # =====================================================================
-# 6. LOOP PRINCIPAL (REPL)
+# 8. LOOP PRINCIPAL (REPL)
 # =====================================================================
 # Responsável por:
 # - Ler linha de comando do usuário,
 # - Interpretar o comando (HELP, LOAD, LIST, INS, DEL, SAVE, RUN, DEBUG...),
 # - Chamar as funções adequadas.
-# É aqui que o usuário interage com o interpretador.
+# É aqui que o usuário interage com o interpretador. O REPL é só um
+# cliente de uma sessão (Interpreter).
+#
+# Modo script (--batch, ou automático quando a entrada não é um
+# terminal, como em 'python mepa.py < comandos.txt'): sem banner nem
+# prompt, sem confirmação por comando (INS, DEL, LOAD, SAVE, RUN), LIST
+# sem pausas e nenhuma pergunta; só saem a saída dos programas, os
+# avisos e os erros. Para montar programas grandes, PASTE (ou INS
+# BLOCK) recebe muitas linhas numeradas de uma vez, até uma linha END.
 # =====================================================================
 
+# linha que termina o bloco do PASTE / INS BLOCK
+PASTE_END = "END"
+
 
 def parse_command(line: str) -> Tuple[str, str]:
     """
@@ -495,21 +5603,67 @@ def parse_command(line: str) -> Tuple[str, str]:
     return cmd, args
 
 
-def main() -> None:
-    """Loop principal do REPL: lê comandos e despacha para as funções."""
-    global debug_mode
+def prompt_lines(prompt: str) -> Iterator[str]:
+    """Linhas digitadas no terminal (input) até o fim da entrada."""
+    while True:
+        try:
+            yield input(prompt)
+        except EOFError:
+            return
+
+
+def read_paste_block(lines: Iterator[str]) -> Iterator[str]:
+    """Linhas do PASTE até a linha END (ou o fim da entrada)."""
+    for line in lines:
+        # só linhas curtas podem ser o END: as outras passam direto
+        if len(line) < 16 and line.strip().upper() == PASTE_END:
+            return
+        yield line
+
+
+def repl(session: Optional[Interpreter] = None,
+         batch: Optional[bool] = None, watch: Optional[str] = None) -> None:
+    """
+    Loop principal do REPL: lê comandos e despacha para a sessão.
+    'batch' liga o modo script (None: liga quando a entrada padrão não
+    é um terminal). Com 'watch', começa por WATCH nesse arquivo.
+    """
+    if session is None:
+        session = Interpreter()
+    if batch is None:
+        batch = not sys.stdin.isatty()
+
+    if batch:
+        stdin_lines = iter(sys.stdin)
+
+        def read_line(prompt: str) -> str:
+            # direto do arquivo, sem o custo do input() por linha
+            try:
+                return next(stdin_lines).rstrip("\r\n")
+            except StopIteration:
+                raise EOFError from None
+    else:
+        read_line = input
+        print("MEPA/Lua – Interpretador em Python")
+        print("Digite HELP para ajuda básica. EXIT para sair.\n")
 
-    print("MEPA/Lua – Interpretador em Python")
-    print("Digite HELP para ajuda básica. EXIT para sair.\n")
+    if watch is not None:
+        cmd_watch(session, watch, quiet=batch)
 
     while True:
         try:
             # Prompt muda se estiver em modo debug
-            prompt = "DEBUG> " if debug_mode else "> "
-            line = input(prompt)
+            prompt = "DEBUG> " if session.debug_mode else "> "
+            line = read_line(prompt)
         except EOFError:
-            print()
+            if not batch:
+                print()
             break
+        except KeyboardInterrupt:
+            if batch:
+                raise
+            print()  # Ctrl+C no prompt só descarta a linha digitada
+            continue
 
         cmd, args = parse_command(line)
         if not cmd:
@@ -519,38 +5673,85 @@ def main() -> None:
         if cmd == "HELP":
             print("Comandos disponíveis:")
             print("  LOAD <arquivo>      - Carrega código numerado de um arquivo")
+            print("    [NOCACHE|REBUILD]   (sem usar / refazendo o cache .mepac)")
+            print("  WATCH <arquivo>     - Carrega e roda; a cada alteração do arquivo")
+            print("                        (num editor), aplica as linhas que mudaram")
+            print("                        e roda de novo (Ctrl+C para parar)")
             print("  LIST                - Lista o programa em memória")
             print("  INS <linha> <cod>   - Insere/substitui linha")
+            print("  PASTE | INS BLOCK   - Insere as linhas numeradas seguintes,")
+            print("                        até uma linha END")
             print("  DEL <linha>         - Remove linha")
             print("  DEL <li> <lf>       - Remove intervalo de linhas")
-            print("  SAVE                - Salva programa em arquivo")
+            print("  SAVE                - Salva programa em arquivo (as alterações")
+            print("                        vão para o diário .journal)")
+            print("  SAVE FULL           - Regrava o arquivo inteiro (sem diário)")
             print("  RUN                 - Executa programa inteiro")
+            print("  RUN VM              - Executa na máquina virtual MEPA")
+            print("  OPT                 - Otimiza o programa (constantes, atribuições")
+            print("                        mortas) e mostra o que mudou")
+            print("  RUN OPT             - Executa a versão otimizada")
+            print("  PROFILE [arq]       - Executa medindo cada linha (= RUN PROFILE);")
+            print("                        grava o perfil em arq (.json ou .csv)")
+            print("  COMPILE | ASM       - Mostra o código MEPA gerado")
             print("  DEBUG               - Entra em modo de depuração")
-            print("  NEXT                - Executa próxima linha (modo DEBUG)")
+            print("  NEXT                - Executa próxima linha (modo DEBUG;")
+            print("                        segue if/while/for/GOTO)")
+            print("  BREAK <linha> [IF <expr>] - Marca breakpoint (BREAK lista)")
+            print("  CLEAR [linha]       - Remove breakpoint (todos, sem linha)")
+            print("  CONT                - Executa até o próximo breakpoint (DEBUG)")
+            print("  BACK [k]            - Volta k passos no DEBUG (padrão 1)")
+            print("  STEP <n>            - Vai ao estado depois do passo n do DEBUG")
+            print("  TRACE               - Mostra os passos guardados do DEBUG")
             print("  STACK               - Mostra variáveis (modo DEBUG)")
             print("  STOP                - Sai do modo DEBUG")
+            print("  CACHE               - Mostra acertos/falhas do cache de compilação")
+            print("                        e as linhas especializadas por tipo")
+            print("  MEM                 - Mostra a memória usada pelo programa,")
+            print("                        pelos caches e pelas variáveis")
+            print("  STATS [RESET]       - Mostra (ou zera) os contadores da sessão:")
+            print("                        LOAD, SAVE, RUN (linhas/s), DEBUG")
             print("  EXIT                - Sai do programa")
             continue
 
         # Comando para sair do programa
         if cmd == "EXIT":
-            if not ensure_can_discard_changes():
+            if not ensure_can_discard_changes(session, batch):
                 # usuário quis salvar mas deu erro/cancelou
                 continue
-            print("Encerrando.")
+            if not batch:
+                print("Encerrando.")
             break
 
         # --------- comandos que funcionam tanto em debug quanto fora ----------
         if cmd == "LOAD":
             path = args.strip()
+            cache_mode = None
+            # opção no final: LOAD <arquivo> NOCACHE | REBUILD
+            head, _, option = path.rpartition(" ")
+            if head.strip() and option.upper() in ("NOCACHE", "REBUILD"):
+                path = head.strip()
+                cache_mode = "off" if option.upper() == "NOCACHE" else "rebuild"
             if not path:
-                print("Uso: LOAD <arquivo>")
+                print("Uso: LOAD <arquivo> [NOCACHE|REBUILD]")
+            else:
+                cmd_load(session, path, cache_mode, quiet=batch)
+            continue
+
+        if cmd == "WATCH":
+            if not args.strip():
+                print("Uso: WATCH <arquivo>")
             else:
-                cmd_load(path)
+                cmd_watch(session, args.strip(), quiet=batch)
             continue
 
         if cmd == "LIST":
-            cmd_list()
+            cmd_list(session, None if batch else 20)
+            continue
+
+        if cmd == "PASTE" or (cmd == "INS" and args.strip().upper() == "BLOCK"):
+            cmd_paste(session, read_paste_block(
+                stdin_lines if batch else prompt_lines("... ")))
             continue
 
         if cmd == "INS":
@@ -562,11 +5763,14 @@ def main() -> None:
                 print("Uso: INS <linha> <código>")
                 continue
             num_str, code = parts
-            num = parse_int(num_str)
-            if num is None or num < 0:
+            num = parse_line_number(num_str)
+            if num is None:
                 print("Número de linha inválido.")
                 continue
-            cmd_ins(num, code)
+            if batch:
+                session.ins(num, code)
+            else:
+                cmd_ins(session, num, code)
             continue
 
         if cmd == "DEL":
@@ -579,56 +5783,802 @@ def main() -> None:
                 if n is None:
                     print("Número de linha inválido.")
                     continue
-                cmd_del_single(n)
+                cmd_del_single(session, n, quiet=batch)
             elif len(parts) == 2:
                 n1 = parse_int(parts[0])
                 n2 = parse_int(parts[1])
                 if n1 is None or n2 is None:
                     print("Números de linha inválidos.")
                     continue
-                cmd_del_range(n1, n2)
+                cmd_del_range(session, n1, n2, quiet=batch)
             else:
                 print("Uso: DEL <linha> ou DEL <linha_i> <linha_f>")
             continue
 
         if cmd == "SAVE":
-            cmd_save()
+            if args.strip().upper() == "FULL":
+                cmd_save(session, full=True, quiet=batch)
+            elif args.strip():
+                print("Uso: SAVE [FULL]")
+            else:
+                cmd_save(session, quiet=batch)
+            continue
+
+        if cmd == "RUN" or cmd == "PROFILE":
+            if cmd == "PROFILE":
+                args = "PROFILE " + args
+            mode, _, rest = args.strip().partition(" ")
+            mode = mode.upper()
+            if (mode not in ("", "VM", "OPT", "PROFILE")
+                    or (rest and mode != "PROFILE")):
+                print("Uso: RUN, RUN VM, RUN OPT ou RUN PROFILE "
+                      "[arquivo.json|arquivo.csv]")
+                continue
+            if mode == "PROFILE":
+                cmd_profile(session, rest.strip() or None)
+            else:
+                cmd_run(session, {"": "ast", "VM": "vm", "OPT": "opt"}[mode],
+                        quiet=batch)
+            session.refresh_cache()
+            continue
+
+        if cmd in ("COMPILE", "ASM"):
+            cmd_asm(session)
             continue
 
-        if cmd == "RUN":
-            debug_mode = False
-            run_sequential(debug=False)
+        if cmd == "OPT":
+            cmd_opt(session)
             continue
 
         # ----------------- comandos específicos de DEBUG -----------------
         if cmd == "DEBUG":
-            debug_mode = True
-            run_sequential(debug=True)
+            cmd_debug(session)
             continue
 
         if cmd == "NEXT":
-            if not debug_mode:
+            if not session.debug_mode:
                 print("NEXT só pode ser usado em modo DEBUG.")
                 continue
-            debug_next()
+            debug_next(session)
+            continue
+
+        if cmd == "CONT":
+            if not session.debug_mode:
+                print("CONT só pode ser usado em modo DEBUG.")
+                continue
+            debug_cont(session)
+            continue
+
+        if cmd == "BACK":
+            cmd_back(session, args.strip())
+            continue
+
+        if cmd == "STEP":
+            cmd_step(session, args.strip())
+            continue
+
+        if cmd == "TRACE":
+            show_trace(session)
+            continue
+
+        if cmd == "BREAK":
+            cmd_break(session, args.strip())
+            continue
+
+        if cmd == "CLEAR":
+            cmd_clear(session, args.strip())
             continue
 
         if cmd == "STACK":
-            if not debug_mode:
+            if not session.debug_mode:
                 print("STACK é útil em modo DEBUG (mas mostrando mesmo assim).")
-            show_stack()
+            show_stack(session)
             continue
 
         if cmd == "STOP":
-            if debug_mode:
-                stop_debug()
+            if session.debug_mode:
+                stop_debug(session)
             else:
                 print("Não está em modo DEBUG.")
             continue
 
+        if cmd == "CACHE":
+            show_cache_stats(session)
+            continue
+
+        if cmd == "MEM":
+            show_memory_usage(session)
+            continue
+
+        if cmd == "STATS":
+            show_stats(session, args.strip())
+            continue
+
         # -----------------------------------------------------------------
         print(f"Comando desconhecido: {cmd}. Digite HELP para ajuda.")
 
 
+# =====================================================================
+# 9. MODO LOTE (LINHA DE COMANDO)
+# =====================================================================
+# Executa vários arquivos .mepa sem passar pelo REPL:
+#     python mepa.py run a.mepa b.mepa ...
+#     python mepa.py run --jobs 4 pasta/
+# Cada processo do pool mantém UMA sessão (Interpreter) aquecida, que
+# é reaproveitada pelos arquivos que ele executa (mesmo parser do LOAD
+# e mesma execução do RUN); a saída de cada arquivo é capturada e
+# escrita na ordem dos arquivos. O código de saída é 1 se algum falhar.
+# =====================================================================
+
+# sessão reaproveitada pelos arquivos executados neste processo
+_batch_session: Optional[Interpreter] = None
+
+
+def collect_program_files(paths: List[str]) -> List[str]:
+    """Expande pastas em seus arquivos .mepa (em ordem alfabética)."""
+    files: List[str] = []
+    for path in paths:
+        if os.path.isdir(path):
+            found = []
+            for root, _dirs, names in os.walk(path):
+                found.extend(os.path.join(root, n) for n in names
+                             if n.endswith(".mepa"))
+            files.extend(sorted(found))
+        else:
+            files.append(path)
+    return files
+
+
+def run_program_file(path: str, backend: str = "ast",
+                     buffer_size: int = DEFAULT_OUTPUT_BUFFER,
+                     cache_mode: str = "on",
+                     metrics: Optional[str] = None) -> Tuple[str, str, bool, int]:
+    """
+    Carrega e executa UM arquivo (usado pelos processos do pool).
+    Retorna (caminho, saída capturada, sucesso, linhas do programa).
+    Com 'metrics', o registro do RUN vai para esse arquivo (--metrics).
+    """
+    global _batch_session
+    if _batch_session is None:
+        _batch_session = Interpreter(checkpoint_budget=0)
+    session = _batch_session
+    session.mepac_mode = "off" if cache_mode == "off" else "on"
+    session.metrics_path = metrics
+    out = io.StringIO()
+    # a saída do programa e as mensagens do interpretador vão para 'out'
+    session.set_output(out, buffer_size)
+    with contextlib.redirect_stdout(out):
+        try:
+            warnings = session.load(path, cache_mode)
+        except InterpreterError as e:
+            print(e)
+            return path, out.getvalue(), False, 0
+        except Exception as e:
+            print(f"Erro ao carregar arquivo: {e}")
+            return path, out.getvalue(), False, 0
+        for warning in warnings:
+            print(warning)
+        ok = cmd_run(session, backend)
+        session.refresh_cache()
+    return path, out.getvalue(), ok, len(session.program_lines)
+
+
+def run_batch(paths: List[str], jobs: int, backend: str = "ast",
+              buffer_size: int = DEFAULT_OUTPUT_BUFFER,
+              cache_mode: str = "on", metrics: Optional[str] = None) -> int:
+    """Executa os arquivos em paralelo e imprime um resumo em stderr."""
+    files = collect_program_files(paths)
+    if not files:
+        print("Nenhum arquivo .mepa encontrado.", file=sys.stderr)
+        return 1
+
+    t0 = time.perf_counter()
+    failed = 0
+    total_lines = 0
+    show_headers = len(files) > 1
+
+    def report(result: Tuple[str, str, bool, int]) -> None:
+        nonlocal failed, total_lines
+        path, output, ok, n_lines = result
+        if show_headers:
+            sys.stdout.write(f"==> {path} <==\n")
+        sys.stdout.write(output)
+        sys.stdout.flush()
+        total_lines += n_lines
+        if not ok:
+            failed += 1
+
+    if jobs <= 1 or len(files) == 1:
+        for path in files:
+            report(run_program_file(path, backend, buffer_size, cache_mode,
+                                    metrics))
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            # map devolve os resultados na ordem dos arquivos
+            for result in pool.map(run_program_file, files,
+                                   [backend] * len(files),
+                                   [buffer_size] * len(files),
+                                   [cache_mode] * len(files),
+                                   [metrics] * len(files), chunksize=4):
+                report(result)
+
+    elapsed = time.perf_counter() - t0
+    rate = total_lines / elapsed if elapsed > 0 else 0.0
+    print(f"{len(files)} arquivo(s), {failed} com erro, {total_lines} linhas "
+          f"em {elapsed:.3f}s ({len(files) / elapsed:.1f} arquivos/s, "
+          f"{rate:,.0f} linhas/s)", file=sys.stderr)
+    return 1 if failed else 0
+
+
+# =====================================================================
+# 10. MODO SERVIDOR (python mepa.py serve ...)
+# =====================================================================
+# Mantém várias sessões abertas para outros programas, sem o custo de
+# iniciar um processo (e o REPL) a cada pedido:
+#     python mepa.py serve --socket /tmp/mepa.sock
+#     python mepa.py serve --port 8765
+# Protocolo: uma mensagem JSON por linha, nos dois sentidos. O pedido
+# traz o comando como no REPL, e a resposta repete o "id" do pedido:
+#     {"id": 1, "cmd": "INS 10 print(1 + 2)"}
+#     {"id": 1, "ok": true, "line": 10, "replaced": null}
+#     {"id": 2, "cmd": "RUN", "timeout": 5}
+#     {"id": 2, "ok": true, "output": "3\n", "seconds": 0.0004}
+# Em caso de erro: {"id": ..., "ok": false, "error": "...", ...}.
+# Cada conexão tem sua sessão (Interpreter), atendida em ordem. O RUN
+# roda num pool de processos (RunWorkerPool), para um programa longo
+# não travar os outros clientes; os processos guardam as últimas
+# sessões já compiladas e só recebem o programa de novo depois de uma
+# alteração. Cada pedido tem um tempo limite: um RUN que passa dele tem
+# o processo encerrado (e substituído).
+# =====================================================================
+
+DEFAULT_SERVE_TIMEOUT = 30.0      # tempo limite padrão de um pedido (s)
+SERVE_LINE_LIMIT = 16 * 1024 * 1024  # tamanho máximo de uma mensagem
+SERVE_WORKER_SESSIONS = 16        # sessões guardadas em cada processo do pool
+
+
+def _serve_worker(conn) -> None:
+    """
+    Processo do pool do servidor: recebe (chave, versão, programa ou
+    None, backend), executa o RUN e devolve ("done", saída, erro,
+    variáveis, registro do RUN para as estatísticas). Se o programa não veio e a sessão 'chave' nessa versão
+    não está guardada aqui, devolve ("missing",) para o servidor reenviar.
+    """
+    import signal
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # o Ctrl-C é do servidor
+    sessions: Dict[str, Tuple[int, Interpreter]] = {}
+    conn.send(("ready",))
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            return
+        if job is None:
+            return
+        key, version, program, backend = job
+        entry = sessions.pop(key, None)
+        if program is None and (entry is None or entry[0] != version):
+            conn.send(("missing",))
+            continue
+        session = entry[1] if entry is not None else Interpreter(mepac_mode="off")
+        if program is not None:
+            session.install(dict(program))
+        sessions[key] = (version, session)
+        if len(sessions) > SERVE_WORKER_SESSIONS:
+            del sessions[next(iter(sessions))]
+        out = io.StringIO()
+        session.set_output(out)
+        try:
+            error = session.run(backend)
+        except InterpreterError as e:
+            conn.send(("error", str(e)))
+            continue
+        conn.send(("done", out.getvalue(), error, session.stack(),
+                   session.stats.last_run))
+
+
+class _RunWorker:
+    """Um processo do RunWorkerPool e as sessões que ele já recebeu."""
+
+    __slots__ = ("process", "conn", "known", "ready", "receiving")
+
+    def __init__(self, ctx) -> None:
+        self.conn, child = ctx.Pipe()
+        self.process = ctx.Process(target=_serve_worker, args=(child,),
+                                   daemon=True)
+        self.process.start()
+        child.close()
+        self.known: Dict[str, int] = {}  # chave da sessão -> versão enviada
+        self.ready = False  # já mandou ("ready",), isto é, terminou de iniciar?
+        self.receiving = False  # há uma thread esperando em receive()?
+
+    def receive(self) -> tuple:
+        """Próxima mensagem do processo (bloqueia: roda numa thread)."""
+        try:
+            return self.conn.recv()
+        finally:
+            self.receiving = False
+
+    def kill(self) -> None:
+        self.process.kill()
+        self.process.join()
+        # uma thread ainda presa em receive() recebe EOF do processo
+        # morto; a conexão fecha quando ela a soltar
+        if not self.receiving:
+            self.conn.close()
+
+
+class RunWorkerPool:
+    """
+    Pool de processos para o RUN do servidor. Diferente do
+    ProcessPoolExecutor, um processo pode ser encerrado no meio do
+    trabalho (tempo limite) sem afetar os outros, e cada sessão volta,
+    se ele estiver livre, ao processo que já tem o seu programa.
+    """
+
+    __slots__ = ("ctx", "workers", "idle", "available", "threads")
+
+    def __init__(self, size: int) -> None:
+        import multiprocessing
+        # "spawn": o servidor tem threads e um laço asyncio, que não
+        # devem ser copiados (fork) para os processos
+        self.ctx = multiprocessing.get_context("spawn")
+        self.workers = [_RunWorker(self.ctx) for _ in range(max(1, size))]
+        self.idle = list(self.workers)
+        self.available = asyncio.Semaphore(len(self.workers))
+        # uma thread por processo para esperar as respostas (_receive)
+        self.threads = ThreadPoolExecutor(len(self.workers),
+                                          thread_name_prefix="mepa-pool")
+
+    async def start(self) -> None:
+        """Espera todos os processos terminarem de iniciar."""
+        for worker in self.workers:
+            await self._ready(worker)
+
+    def _take_idle(self, key: str) -> _RunWorker:
+        """Processo livre, de preferência um que já conhece a sessão."""
+        for worker in self.idle:
+            if key in worker.known:
+                break
+        else:
+            worker = self.idle[-1]
+        self.idle.remove(worker)
+        return worker
+
+    async def run(self, key: str, version: int,
+                  program: Callable[[], list], backend: str) -> tuple:
+        """
+        Executa o RUN da sessão 'key' num processo livre. 'program'
+        devolve as linhas do programa, só chamada se o processo ainda
+        não tiver essa versão. Se o pedido for cancelado (tempo limite),
+        o processo é encerrado e substituído.
+        """
+        await self.available.acquire()
+        worker = self._take_idle(key)
+        try:
+            await self._ready(worker)
+            job = (key, version,
+                   None if worker.known.get(key) == version else program(),
+                   backend)
+            reply = await self._call(worker, job)
+            if reply[0] == "missing":
+                reply = await self._call(worker, (key, version, program(), backend))
+            worker.known[key] = version
+            return reply
+        except BaseException:
+            worker = self._replace(worker)
+            raise
+        finally:
+            self.idle.append(worker)
+            self.available.release()
+
+    async def _ready(self, worker: _RunWorker) -> None:
+        if not worker.ready:
+            await self._receive(worker)
+            worker.ready = True
+
+    async def _call(self, worker: _RunWorker, job: tuple) -> tuple:
+        """Envia o trabalho e espera a resposta."""
+        worker.conn.send(job)
+        return await self._receive(worker)
+
+    async def _receive(self, worker: _RunWorker) -> tuple:
+        """
+        Espera a próxima mensagem do processo sem bloquear o laço. A
+        espera fica numa thread, e não em loop.add_reader: no Windows, o
+        laço padrão (Proactor) não tem add_reader e os pipes do
+        multiprocessing não servem para select.
+        """
+        loop = asyncio.get_running_loop()
+        worker.receiving = True
+        try:
+            return await loop.run_in_executor(self.threads, worker.receive)
+        except EOFError:
+            raise InterpreterError("O processo de execução terminou inesperadamente.")
+
+    def _replace(self, worker: _RunWorker) -> _RunWorker:
+        worker.kill()
+        fresh = _RunWorker(self.ctx)
+        self.workers[self.workers.index(worker)] = fresh
+        return fresh
+
+    def forget(self, key: str) -> None:
+        """A sessão 'key' foi encerrada: esquece o que os processos têm dela."""
+        for worker in self.workers:
+            worker.known.pop(key, None)
+
+    def close(self) -> None:
+        for worker in self.workers:
+            worker.kill()
+        self.threads.shutdown(wait=False)
+
+
+class ServeSession:
+    """
+    Sessão de uma conexão do servidor: o Interpreter, a saída capturada
+    dos print (NEXT), a versão do programa (aumenta a cada LOAD/INS/
+    DEL), que diz aos processos do pool quando recebê-lo de novo, e o
+    diretório de onde o LOAD pode ler (root).
+    """
+
+    __slots__ = ("key", "root", "session", "out", "version", "pending")
+
+    def __init__(self, key: str, root: str) -> None:
+        self.key = key
+        self.root = root
+        self.out = io.StringIO()
+        # sem .mepac: o servidor não cria arquivos ao lado dos programas
+        self.session = Interpreter(self.out, mepac_mode="off",
+                                   checkpoint_budget=0)
+        self.version = 0
+        # comando ainda rodando numa thread depois de passar do tempo
+        # limite; o próximo pedido espera por ele
+        self.pending: Optional[asyncio.Future] = None
+
+    def take_output(self) -> str:
+        """Saída dos print desde a última chamada."""
+        self.session.output_sink.flush()
+        text = self.out.getvalue()
+        self.out.seek(0)
+        self.out.truncate()
+        return text
+
+
+def _serve_path(root: str, name: str) -> str:
+    """
+    Caminho de um LOAD do servidor: relativo a 'root' e sem sair dele
+    (nem por '..', nem por caminho absoluto, nem por link simbólico).
+    """
+    path = os.path.realpath(os.path.join(root, name))
+    if os.path.commonpath([root, path]) != root:
+        raise InterpreterError(
+            f"Erro: '{name}' está fora do diretório do servidor.")
+    return path
+
+
+def _parse_line_args(args: str, count: int) -> Optional[List[int]]:
+    """'count' (ou menos) números de linha em 'args'; None se inválidos."""
+    parts = args.split()
+    if not 1 <= len(parts) <= count:
+        return None
+    nums = [parse_int(p) for p in parts]
+    return None if None in nums else nums
+
+
+async def serve_command(state: ServeSession, pool: RunWorkerPool,
+                        line: str) -> dict:
+    """
+    Executa um comando do protocolo na sessão e devolve os campos da
+    resposta (sem o "id"). Erros da sessão viram {"ok": False, ...}.
+    """
+    session = state.session
+    cmd, args = parse_command(line)
+    args = args.strip()
+    loop = asyncio.get_running_loop()
+
+    async def in_thread(fn, *fn_args):
+        # comandos que podem demorar (ler ou compilar um programa
+        # grande) rodam fora do laço, para não atrasar os outros clientes
+        state.pending = loop.run_in_executor(None, fn, *fn_args)
+        result = await asyncio.shield(state.pending)
+        state.pending = None
+        return result
+
+    if cmd == "LOAD":
+        if not args:
+            raise InterpreterError("Uso: LOAD <arquivo>")
+        warnings = await in_thread(session.load, _serve_path(state.root, args))
+        state.version += 1
+        return {"ok": True, "lines": len(session.program_lines),
+                "warnings": warnings}
+    if cmd == "INS":
+        num_str, _, code = args.partition(" ")
+        num = parse_line_number(num_str)
+        if num is None or not code.strip():
+            raise InterpreterError("Uso: INS <linha> <código>")
+        old = session.ins(num, code.strip())
+        state.version += 1
+        return {"ok": True, "line": num, "replaced": old}
+    if cmd == "DEL":
+        nums = _parse_line_args(args, 2)
+        if nums is None:
+            raise InterpreterError("Uso: DEL <linha> ou DEL <linha_i> <linha_f>")
+        if len(nums) == 1:
+            removed = [(nums[0], session.delete(nums[0]))]
+        else:
+            removed = session.delete_range(nums[0], nums[1])
+        state.version += 1
+        return {"ok": True, "removed": removed}
+    if cmd == "LIST":
+        return {"ok": True, "lines": list(session.program_lines.items())}
+    if cmd == "RUN":
+        mode = args.upper()
+        if mode not in ("", "VM", "OPT"):
+            raise InterpreterError("Uso: RUN, RUN VM ou RUN OPT")
+        if not session.program_lines:
+            raise InterpreterError("Nenhum programa carregado.")
+        t0 = time.perf_counter()
+        reply = await pool.run(state.key, state.version,
+                               lambda: list(session.program_lines.items()),
+                               {"": "ast", "VM": "vm", "OPT": "opt"}[mode])
+        if reply[0] == "error":
+            raise InterpreterError(reply[1])
+        _kind, output, error, variables, record = reply
+        # a sessão fica como depois de um RUN local (STACK mostra o final)
+        session.debug_mode = False
+        session.reset_runtime()
+        for name, value in variables:
+            session.memory[session.slot_of(name)] = value
+        session.stats.add_run(record)
+        result = {"ok": error is None, "output": output,
+                  "seconds": round(time.perf_counter() - t0, 6)}
+        if error is not None:
+            result["line"], result["error"] = error
+        return result
+    if cmd == "DEBUG":
+        return {"ok": True, "line": await in_thread(session.start_debug)}
+    if cmd == "NEXT":
+        if not session.debug_mode:
+            raise InterpreterError("NEXT só pode ser usado em modo DEBUG.")
+        line_no, code, error, restarted = await in_thread(session.step)
+        result = {"ok": error is None, "line": line_no, "code": code,
+                  "output": state.take_output(),
+                  "next": session.program_counter, "restarted": restarted}
+        if error is not None:
+            result["error"] = error
+        return result
+    if cmd == "BACK" or cmd == "STEP":
+        n = parse_int(args) if args or cmd == "STEP" else 1
+        if n is None or n < (1 if cmd == "BACK" else 0):
+            raise InterpreterError("Uso: BACK [passos] ou STEP <passo>")
+        if cmd == "BACK":
+            session.back(n)
+            error = None
+        else:
+            error = await in_thread(session.goto_step, n)
+        result = {"ok": error is None, "step": session.trace.pos,
+                  "output": state.take_output(),
+                  "next": session.program_counter}
+        if error is not None:
+            result["line"], result["error"] = error
+        return result
+    if cmd == "STACK":
+        return {"ok": True, "variables": session.stack()}
+    if cmd == "MEM":
+        # só a sessão da conexão: as instruções compiladas pelo RUN
+        # ficam nos processos do pool
+        return {"ok": True, "memory": await in_thread(session.memory_usage)}
+    if cmd == "STATS":
+        if args.upper() == "RESET":
+            session.stats.reset()
+        elif args:
+            raise InterpreterError("Uso: STATS ou STATS RESET")
+        return {"ok": True, "stats": session.stats.as_dict()}
+    if cmd == "STOP":
+        session.stop_debug()
+        return {"ok": True}
+    raise InterpreterError(f"Comando desconhecido: {cmd}.")
+
+
+async def serve_connection(reader, writer, pool: RunWorkerPool,
+                           max_timeout: float, key: str, root: str) -> None:
+    """Atende uma conexão: lê pedidos (JSON por linha) e responde em ordem."""
+    state = ServeSession(key, root)
+    try:
+        while True:
+            try:
+                raw = await reader.readline()
+            except (ValueError, ConnectionError):
+                break  # mensagem grande demais ou conexão perdida
+            if not raw:
+                break
+            if not raw.strip():
+                continue
+            try:
+                request = json.loads(raw)
+                line = request["cmd"]
+                if not isinstance(line, str):
+                    raise TypeError
+            except (ValueError, TypeError, KeyError):
+                reply = {"ok": False,
+                         "error": 'Pedido inválido: esperado {"cmd": "..."}.'}
+                writer.write(json.dumps(reply).encode() + b"\n")
+                await writer.drain()
+                continue
+            timeout = max_timeout
+            if isinstance(request.get("timeout"), (int, float)):
+                timeout = min(max_timeout, max(0.0, request["timeout"]))
+            if state.pending is not None:
+                # comando anterior que passou do tempo ainda está rodando
+                await asyncio.wait([state.pending])
+                state.pending = None
+            try:
+                reply = await asyncio.wait_for(
+                    serve_command(state, pool, line), timeout)
+            except asyncio.TimeoutError:
+                reply = {"ok": False, "timeout": True,
+                         "error": f"Tempo limite excedido ({timeout:g}s)."}
+            except InterpreterError as e:
+                reply = {"ok": False, "error": str(e)}
+            except Exception as e:
+                reply = {"ok": False, "error": f"Erro interno: {e}"}
+            if "id" in request:
+                reply = {"id": request["id"], **reply}
+            # tabelas (LuaTable) vão como o resumo do STACK
+            writer.write(json.dumps(reply, ensure_ascii=False,
+                                    default=repr).encode() + b"\n")
+            await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        pool.forget(key)
+        writer.close()
+
+
+async def serve(socket_path: Optional[str] = None, host: str = "127.0.0.1",
+                port: Optional[int] = None, workers: int = 1,
+                timeout: float = DEFAULT_SERVE_TIMEOUT,
+                root: Optional[str] = None) -> None:
+    """
+    Abre o servidor (socket Unix ou TCP) e atende até ser interrompido.
+    O LOAD só lê arquivos dentro de 'root' (padrão: o diretório atual).
+    """
+    root = os.path.realpath(root if root is not None else os.getcwd())
+    pool = RunWorkerPool(workers)
+    await pool.start()
+    counter = 0
+
+    async def handle(reader, writer) -> None:
+        nonlocal counter
+        counter += 1
+        await serve_connection(reader, writer, pool, timeout,
+                               f"{os.getpid()}-{counter}", root)
+
+    if socket_path is not None:
+        if not hasattr(asyncio, "start_unix_server"):
+            pool.close()
+            raise InterpreterError(
+                "Socket Unix não existe neste sistema (Windows): use --port.")
+        server = await asyncio.start_unix_server(handle, socket_path,
+                                                 limit=SERVE_LINE_LIMIT)
+        where = socket_path
+    else:
+        server = await asyncio.start_server(handle, host, port,
+                                            limit=SERVE_LINE_LIMIT)
+        where = f"{host}:{server.sockets[0].getsockname()[1]}"
+    print(f"Servidor MEPA em {where} ({len(pool.workers)} processo(s) "
+          f"para RUN, tempo limite {timeout:g}s).", file=sys.stderr, flush=True)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        pool.close()
+        if socket_path is not None and os.path.exists(socket_path):
+            os.unlink(socket_path)
+
+
+def is_loopback(host: str) -> bool:
+    """O endereço 'host' só aceita conexões da própria máquina?"""
+    import ipaddress
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False  # nome de máquina: pode ser qualquer interface
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """
+    Ponto de entrada: sem argumentos abre o REPL; com 'run' executa
+    arquivos em modo lote e com 'serve' abre o servidor.
+    """
+    parser = argparse.ArgumentParser(
+        prog="mepa.py", description="Interpretador MEPA/Lua em Python")
+    sub = parser.add_subparsers(dest="command")
+    run_parser = sub.add_parser("run", help="executa arquivos .mepa sem o REPL")
+    run_parser.add_argument("paths", nargs="+", metavar="ARQUIVO|PASTA")
+    run_parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1,
+                            help="processos em paralelo (padrão: nº de CPUs)")
+    backend_group = run_parser.add_mutually_exclusive_group()
+    backend_group.add_argument("--vm", action="store_true",
+                               help="executa na máquina virtual MEPA")
+    backend_group.add_argument("--opt", action="store_true",
+                               help="executa a versão otimizada (OPT)")
+    run_parser.add_argument("--buffer", type=int, default=DEFAULT_OUTPUT_BUFFER,
+                            metavar="BYTES",
+                            help="tamanho do buffer de saída dos programas")
+    cache_group = run_parser.add_mutually_exclusive_group()
+    cache_group.add_argument("--no-cache", action="store_true",
+                             help="não lê nem grava os arquivos .mepac")
+    cache_group.add_argument("--rebuild-cache", action="store_true",
+                             help="ignora e regrava os arquivos .mepac")
+    run_parser.add_argument("--metrics", metavar="ARQUIVO",
+                            help="acrescenta as métricas de cada RUN ao "
+                                 "arquivo (uma linha JSON por RUN)")
+    mode_group = parser.add_mutually_exclusive_group()
+    mode_group.add_argument("--batch", action="store_true",
+                            help="REPL em modo script: sem prompts, confirmações "
+                                 "nem perguntas (padrão se a entrada não é um "
+                                 "terminal)")
+    mode_group.add_argument("--interactive", action="store_true",
+                            help="REPL interativo mesmo com a entrada redirecionada")
+    parser.add_argument("--watch", metavar="ARQUIVO",
+                        help="começa observando o arquivo (comando WATCH)")
+    parser.add_argument("--metrics", metavar="ARQUIVO",
+                        help="acrescenta as métricas de cada RUN ao arquivo "
+                             "(uma linha JSON por RUN; ver STATS)")
+    parser.add_argument("--trace-mb", type=float,
+                        default=DEFAULT_TRACE_BUDGET / (1024 * 1024), metavar="MB",
+                        help="memória para o histórico do DEBUG (BACK/STEP); "
+                             "0 desliga")
+    serve_parser = sub.add_parser(
+        "serve", help="atende outros programas por socket (JSON por linha)")
+    where = serve_parser.add_mutually_exclusive_group(required=True)
+    where.add_argument("--socket", metavar="CAMINHO", help="socket Unix")
+    where.add_argument("--port", type=int, help="porta TCP (0 = qualquer livre)")
+    serve_parser.add_argument("--host", default="127.0.0.1",
+                              help="endereço TCP (padrão: 127.0.0.1)")
+    serve_parser.add_argument("--allow-remote", action="store_true",
+                              help="aceita um --host que não seja local")
+    serve_parser.add_argument("--root", metavar="DIR",
+                              help="diretório de onde o LOAD pode ler "
+                                   "(padrão: o diretório atual)")
+    serve_parser.add_argument("--workers", type=int,
+                              default=os.cpu_count() or 1,
+                              help="processos para RUN (padrão: nº de CPUs)")
+    serve_parser.add_argument("--timeout", type=float,
+                              default=DEFAULT_SERVE_TIMEOUT, metavar="SEG",
+                              help="tempo limite de cada pedido")
+    opts = parser.parse_args(argv)
+
+    if opts.command == "run":
+        cache_mode = ("off" if opts.no_cache
+                      else "rebuild" if opts.rebuild_cache else "on")
+        backend = "vm" if opts.vm else "opt" if opts.opt else "ast"
+        return run_batch(opts.paths, opts.jobs, backend, opts.buffer, cache_mode,
+                         opts.metrics)
+    if opts.command == "serve":
+        if opts.port is not None and not opts.allow_remote \
+                and not is_loopback(opts.host):
+            parser.error(f"--host {opts.host} aceita conexões de outras "
+                         "máquinas (que poderiam ler arquivos pelo LOAD); "
+                         "use --allow-remote se for mesmo isso")
+        try:
+            asyncio.run(serve(opts.socket, opts.host, opts.port, opts.workers,
+                              opts.timeout, opts.root))
+        except InterpreterError as e:
+            print(e, file=sys.stderr)
+            return 1
+        except KeyboardInterrupt:
+            print("Servidor encerrado.", file=sys.stderr)
+        return 0
+    session = Interpreter(trace_budget=int(opts.trace_mb * 1024 * 1024))
+    session.metrics_path = opts.metrics
+    repl(session, batch=True if opts.batch else False if opts.interactive else None,
+         watch=opts.watch)
+    return 0
+
+
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Cliente do servidor MEPA/Lua (python mepa.py serve ...).
+
+Fala o protocolo do servidor (uma mensagem JSON por linha) e pode ser
+usado de dois jeitos:
+
+- importado, por outros programas:
+
+      from mepa_client import MepaClient
+      with MepaClient(socket_path="/tmp/mepa.sock") as client:
+          client.request("INS 10 print(1 + 2)")
+          print(client.request("RUN")["output"])
+
+- pela linha de comando, com os comandos como argumentos ou, sem
+  eles, lidos da entrada padrão (um por linha, como no REPL):
+
+      python mepa_client.py --socket /tmp/mepa.sock "LOAD prog.mepa" RUN
+      python mepa_client.py --port 8765 --json < comandos.txt
+
+Cada conexão é uma sessão no servidor: o programa e as variáveis
+ficam lá até a conexão ser fechada.
+
+Uso:
+    python mepa_client.py (--socket CAMINHO | --port N [--host H])
+                          [--timeout SEG] [--json] [COMANDO ...]
+"""
+
+import argparse
+import json
+import socket
+import sys
+from typing import Optional
+
+
+class MepaClient:
+    """Conexão (síncrona) com o servidor: um pedido por vez."""
+
+    __slots__ = ("sock", "file", "next_id")
+
+    def __init__(self, socket_path: Optional[str] = None,
+                 host: str = "127.0.0.1", port: Optional[int] = None) -> None:
+        if socket_path is not None:
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.sock.connect(socket_path)
+        else:
+            self.sock = socket.create_connection((host, port))
+        self.file = self.sock.makefile("rwb")
+        self.next_id = 1
+
+    def request(self, cmd: str, timeout: Optional[float] = None) -> dict:
+        """
+        Envia um comando (como no REPL: "INS 10 x = 1", "RUN", ...) e
+        devolve a resposta do servidor. 'timeout' pede um tempo limite
+        menor que o do servidor para este pedido.
+        """
+        message = {"id": self.next_id, "cmd": cmd}
+        if timeout is not None:
+            message["timeout"] = timeout
+        self.next_id += 1
+        self.file.write(json.dumps(message).encode() + b"\n")
+        self.file.flush()
+        line = self.file.readline()
+        if not line:
+            raise ConnectionError("O servidor fechou a conexão.")
+        return json.loads(line)
+
+    def close(self) -> None:
+        self.file.close()
+        self.sock.close()
+
+    def __enter__(self) -> "MepaClient":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def show_reply(reply: dict) -> None:
+    """Mostra a resposta de um jeito parecido com o REPL."""
+    if reply.get("output"):
+        sys.stdout.write(reply["output"])
+    for warning in reply.get("warnings", ()):
+        print(warning)
+    for name, value in reply.get("variables", ()):
+        print(f"  {name} = {value!r}")
+    if isinstance(reply.get("lines"), list):  # LIST (no LOAD é a contagem)
+        for n, code in reply["lines"]:
+            print(f"{n} {code}")
+    for part, size in reply.get("memory", {}).items():  # MEM
+        print(f"  {part:<12} {size / 1024:>12,.1f} KB")
+    for name, value in reply.get("stats", {}).items():  # STATS
+        print(f"  {name:<16} {json.dumps(value)}")
+    if "code" in reply:
+        print(f"[DEBUG] linha {reply['line']}: {reply['code']}")
+    if not reply.get("ok"):
+        where = f"Erro na linha {reply['line']}: " if "line" in reply else ""
+        print(f"{where}{reply.get('error')}", file=sys.stderr)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    where = parser.add_mutually_exclusive_group(required=True)
+    where.add_argument("--socket", metavar="CAMINHO", help="socket Unix")
+    where.add_argument("--port", type=int, help="porta TCP")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--timeout", type=float, metavar="SEG",
+                        help="tempo limite de cada pedido")
+    parser.add_argument("--json", action="store_true",
+                        help="mostra as respostas em JSON, uma por linha")
+    parser.add_argument("commands", nargs="*", metavar="COMANDO")
+    opts = parser.parse_args()
+
+    commands = opts.commands or (line.rstrip("\n") for line in sys.stdin)
+    failed = False
+    with MepaClient(opts.socket, opts.host, opts.port) as client:
+        for cmd in commands:
+            if not cmd.strip():
+                continue
+            reply = client.request(cmd, opts.timeout)
+            failed = failed or not reply.get("ok")
+            if opts.json:
+                print(json.dumps(reply, ensure_ascii=False))
+            else:
+                show_reply(reply)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,57 @@
+"""
+Configuração dos testes (pytest): o módulo mepa fica na raiz do
+repositório, um nível acima desta pasta.
+"""
+
+import io
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import mepa  # noqa: E402
+
+BACKENDS = ("ast", "opt", "vm")
+
+
+def new_session(**options) -> mepa.Interpreter:
+    """Sessão sem .mepac nem checkpoints, com a saída num StringIO."""
+    options.setdefault("mepac_mode", "off")
+    options.setdefault("checkpoint_budget", 0)
+    session = mepa.Interpreter(**options)
+    session.set_output(io.StringIO())
+    return session
+
+
+def output_of(session: mepa.Interpreter) -> str:
+    session.output_sink.flush()
+    return session.output_sink.target.getvalue()
+
+
+@pytest.fixture
+def run():
+    """
+    run(programa, backend) -> (saída, erro): roda {linha: código} (ou
+    uma lista de linhas, numeradas de 10 em 10) numa sessão nova.
+    """
+    def run_program(program, backend: str = "ast"):
+        if not isinstance(program, dict):
+            program = {10 * (i + 1): code for i, code in enumerate(program)}
+        session = new_session()
+        session.install(program)
+        error = session.run(backend)
+        return output_of(session), error
+    return run_program
+
+
+@pytest.fixture
+def write(tmp_path):
+    """write(nome, linhas) -> caminho de um .mepa gravado em tmp_path."""
+    def write_program(name: str, lines) -> str:
+        path = tmp_path / name
+        path.write_bytes("".join(f"{line}\n" for line in lines).encode())
+        return str(path)
+    return write_program
@@ -0,0 +1,127 @@
+"""RUN, RUN OPT e RUN VM: mesmos resultados; reescritas do OPT."""
+
+import _thread
+import glob
+import os
+import random
+import threading
+
+import pytest
+
+import check_mepa
+import mepa
+from conftest import BACKENDS, output_of, new_session
+
+SAMPLES = sorted(glob.glob(os.path.join(os.path.dirname(__file__), "*.mepa")))
+
+
+@pytest.mark.parametrize("path", SAMPLES, ids=os.path.basename)
+def test_samples_same_result(path):
+    results = []
+    for backend in BACKENDS:
+        session = new_session()
+        session.load(path)
+        error = session.run(backend)
+        # tabelas (LuaTable) são comparadas pelo conteúdo, como no STACK
+        results.append((output_of(session), error,
+                        [(name, repr(value)) for name, value in session.stack()]))
+    assert results[1:] == results[:1] * (len(results) - 1)
+
+
+@pytest.mark.parametrize("expr", check_mepa.ERROR_ORDER_CASES)
+def test_error_order(expr):
+    program = {10: "x = 1", 20: f"y = {expr}", 30: "print(x)"}
+    assert check_mepa.check(expr, program, False)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_random_programs(seed):
+    generator = check_mepa.ProgramGenerator(random.Random(seed))
+    for i in range(40):
+        program = generator.program()
+        assert check_mepa.check(f"{seed}/{i}", program, False), program
+
+
+def test_goto_and_loops(run):
+    program = {
+        10: "s = 0",
+        20: "for i = 1, 4 do",
+        30: "s = s + i",
+        40: "end",
+        50: "GOTO 70",
+        60: "s = 1000",
+        70: "n = 0",
+        80: "while n < 3 do",
+        90: "n = n + 1",
+        100: "end",
+        110: "print(s + n)",
+    }
+    for backend in BACKENDS:
+        assert run(program, backend) == ("13\n", None)
+
+
+def test_opt_rewrites():
+    session = new_session()
+    session.install({
+        10: "x = 2 * 3",
+        20: "y = x + 1",
+        30: "if false then",
+        40: "print(1)",
+        50: "end",
+        60: "print(y)",
+    })
+    _flow, stats = session.optimize()
+    assert stats["lines"] == 6
+    assert stats["folded"] >= 1      # x é constante: y = 7
+    assert stats["nops"] >= 1        # 'if false' não roda nunca
+    assert session.run("opt") is None
+    assert output_of(session) == "7\n"
+    # o OPT não muda o STACK que o RUN mostraria
+    assert session.stack() == [("x", 6), ("y", 7)]
+
+
+def test_opt_keeps_reassigned_variable(run):
+    program = ["x = 1", "i = 0", "while i < 2 do", "x = x + 1", "i = i + 1",
+               "end", "print(x)"]
+    assert run(program, "opt") == run(program, "ast") == ("3\n", None)
+
+
+def test_opt_redone_after_edit():
+    session = new_session()
+    session.install({10: "x = 1", 20: "print(x)"})
+    first = session.optimize()[0]
+    session.ins(10, "x = 2")
+    assert session.optimize()[0] is not first
+    session.run("opt")
+    assert output_of(session) == "2\n"
+
+
+def test_vm_runtime_error_line(run):
+    for backend in BACKENDS:
+        out, error = run({10: "print(1)", 20: "x = y + 1"}, backend)
+        assert out == "1\n" and error[0] == 20
+
+
+def test_mepa_listing():
+    session = new_session()
+    session.install({10: "x = 1", 20: "print(x)"})
+    listing = mepa.mepa_listing(session.compile_mepa(), session.program_lines)
+    assert listing and any("10" in line for line in listing)
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_ctrl_c_stops_only_the_run(backend, capsys):
+    session = new_session()
+    session.install({10: "print(1)", 20: "while true do", 30: "end"})
+    timer = threading.Timer(0.2, _thread.interrupt_main)
+    timer.start()
+    try:
+        assert not mepa.cmd_run(session, backend)
+    finally:
+        timer.cancel()
+    assert "Execução interrompida." in capsys.readouterr().out
+    assert output_of(session) == "1\n"  # a saída do buffer não se perde
+    session.ins(20, "print(2)")
+    session.delete(30)
+    assert mepa.cmd_run(session, backend, quiet=True)
+    assert output_of(session) == "1\n1\n2\n"
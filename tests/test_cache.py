@@ -0,0 +1,142 @@
+"""Cache de compilação da sessão, RUN incremental e o cache em disco (.mepac)."""
+
+import os
+
+import mepa
+from conftest import output_of, new_session
+
+
+def straight_program(count: int) -> dict:
+    program = {10: "s = 0"}
+    for i in range(1, count):
+        program[10 * (i + 1)] = f"s = s + {i}"
+    program[10 * (count + 1)] = "print(s)"
+    return program
+
+
+def test_second_run_uses_cache():
+    session = new_session()
+    session.install({10: "x = 1", 20: "y = x + 1", 30: "print(y)"})
+    session.run()
+    assert session.cache_stats()["misses"] == 3
+    session.run()
+    assert session.cache_stats()["misses"] == 3
+    assert output_of(session) == "2\n2\n"
+
+
+def test_ins_recompiles_only_that_line():
+    session = new_session()
+    session.install({10: "x = 1", 20: "y = x + 1", 30: "print(y)"})
+    session.run()
+    session.ins(20, "y = x + 10")
+    session.run()
+    stats = session.cache_stats()
+    assert stats["misses"] == 4 and stats["hits"] == 2
+    assert output_of(session).splitlines() == ["2", "11"]
+
+
+def test_delete_drops_line_from_cache():
+    session = new_session()
+    session.install({10: "x = 1", 20: "x = 5", 30: "print(x)"})
+    session.run()
+    session.delete(20)
+    assert 20 not in session.compiled_lines
+    session.run()
+    assert output_of(session).splitlines() == ["5", "1"]
+
+
+def test_install_keeps_identical_lines():
+    session = new_session()
+    session.install({10: "x = 1", 20: "y = 2", 30: "print(x + y)"})
+    session.run()
+    session.install({10: "x = 1", 20: "y = 3", 30: "print(x + y)"})
+    assert sorted(session.compiled_lines) == [10, 30]
+    session.run()
+    assert output_of(session).splitlines() == ["3", "4"]
+
+
+def test_new_program_compacts_slots():
+    session = new_session()
+    session.install({n: f"v{n} = {n}" for n in range(1, 51)})
+    session.run()
+    session.install({10: "a = 1", 20: "print(a)"})
+    session.run()
+    assert session.var_names == ["a"]
+    assert output_of(session) == "1\n"
+
+
+def test_incremental_run_resumes_from_checkpoint():
+    count = 4 * mepa.CHECKPOINT_INTERVAL
+    session = new_session(checkpoint_budget=mepa.DEFAULT_CHECKPOINT_BUDGET)
+    session.install(straight_program(count))
+    session.run()
+    session.ins(10 * count - 5, "s = s + 1000")
+    session.run()
+    assert session.last_resume is not None and session.last_resume > 10
+    fresh = new_session()
+    fresh.install(dict(session.program_lines.items()))
+    fresh.run()
+    assert output_of(session).splitlines()[-1] == output_of(fresh).strip()
+    assert session.stack() == fresh.stack()
+
+
+def test_mepac_written_and_reused(write):
+    path = write("prog.mepa", ["10 x = 2", "20 y = x * 3", "30 print(y)"])
+    session = new_session(mepac_mode="on")
+    session.load(path)
+    assert os.path.exists(mepa.mepac_path(path))
+    session.run()
+    session.refresh_cache()  # o que o RUN do REPL faz ao final
+
+    again = new_session(mepac_mode="on")
+    again.load(path)
+    assert again.cache_stats()["precompiled"] == 3
+    assert again.run() is None
+    assert output_of(again) == "6\n"
+    assert not again.mepac_stale  # nada precisou ser compilado
+
+
+def test_mepac_invalidated_by_change(write):
+    path = write("prog.mepa", ["10 x = 2", "20 print(x)"])
+    session = new_session(mepac_mode="on")
+    session.load(path)
+    session.run()
+    session.refresh_cache()
+    # mesmo tamanho e mesma data: só o hash mostra a mudança
+    st = os.stat(path)
+    with open(path, "r+b") as f:
+        f.write(b"10 x = 7")
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns))
+
+    again = new_session(mepac_mode="on")
+    again.load(path)
+    assert again.cache_stats()["precompiled"] == 0
+    again.run()
+    assert output_of(again) == "7\n"
+
+
+def test_mepac_rebuild_and_off(write):
+    path = write("prog.mepa", ["10 print(1)"])
+    session = new_session(mepac_mode="off")
+    session.load(path)
+    assert not os.path.exists(mepa.mepac_path(path))
+
+    session = new_session(mepac_mode="on")
+    session.load(path)
+    session.run()
+    session.refresh_cache()
+    rebuilt = new_session(mepac_mode="on")
+    rebuilt.load(path, "rebuild")
+    assert rebuilt.cache_stats()["precompiled"] == 0
+    assert new_session(mepac_mode="on").load(path) == []
+
+
+def test_mepac_not_written_for_edited_program(write):
+    path = write("prog.mepa", ["10 print(1)"])
+    session = new_session(mepac_mode="on")
+    session.load(path)
+    os.remove(mepa.mepac_path(path))
+    session.ins(20, "print(2)")
+    session.run()
+    session.refresh_cache()
+    assert not os.path.exists(mepa.mepac_path(path))
@@ -0,0 +1,194 @@
+"""LOAD, SAVE incremental (diário), WATCH e a releitura por diferença."""
+
+import os
+
+import pytest
+
+import mepa
+from conftest import output_of, new_session
+
+
+def loaded(path: str) -> mepa.Interpreter:
+    session = new_session()
+    session.load(path)
+    return session
+
+
+def program_of(session: mepa.Interpreter) -> dict:
+    return dict(session.program_lines.items())
+
+
+def test_load_warnings(write):
+    path = write("prog.mepa", ["10 print(1)", "abc print(2)", "20",
+                               "99999999999999999999 print(3)", "-5 print(4)"])
+    session = new_session()
+    warnings = session.load(path)
+    assert program_of(session) == {10: "print(1)"}
+    assert len(warnings) == 2  # linhas sem código / número inválido
+    assert "99999999999999999999" in "".join(warnings)
+
+
+def test_load_largest_line_number(write):
+    path = write("prog.mepa", [f"{mepa.MAX_LINE_NUMBER} print(1)"])
+    assert program_of(loaded(path)) == {mepa.MAX_LINE_NUMBER: "print(1)"}
+
+
+def test_program_survives_file_truncation(write):
+    path = write("prog.mepa", ["10 x = 1", "20 print(x)"])
+    session = loaded(path)
+    open(path, "wb").close()
+    assert session.run() is None
+    assert output_of(session) == "1\n"
+    session.save(path, full=True)
+    assert program_of(loaded(path)) == {10: "x = 1", 20: "print(x)"}
+
+
+def test_incremental_save_writes_journal(write):
+    path = write("prog.mepa", ["10 x = 1", "20 y = 2", "30 print(x + y)"])
+    with open(path, "rb") as f:
+        original = f.read()
+    session = loaded(path)
+    session.ins(20, "y = 5")
+    session.ins(40, "print(y)")
+    session.delete(10)
+    session.save()
+    assert os.path.exists(mepa.journal_path(path))
+    with open(path, "rb") as f:
+        assert f.read() == original  # o arquivo base não muda
+    again = loaded(path)
+    assert program_of(again) == {20: "y = 5", 30: "print(x + y)", 40: "print(y)"}
+    assert not again.dirty
+
+
+def test_incomplete_batch_is_ignored(write):
+    path = write("prog.mepa", ["10 print(1)"])
+    session = loaded(path)
+    session.ins(20, "print(2)")
+    session.save()
+    # um SAVE interrompido antes do fsync: lote sem a linha final
+    with open(mepa.journal_path(path), "ab") as f:
+        f.write(b"INS 30 print(3)\n")
+    again = new_session()
+    warnings = again.load(path)
+    assert program_of(again) == {10: "print(1)", 20: "print(2)"}
+    assert any("incompleto" in w for w in warnings)
+    # o próximo SAVE descarta a sobra
+    again.ins(40, "print(4)")
+    again.save()
+    assert program_of(loaded(path)) == {10: "print(1)", 20: "print(2)",
+                                        40: "print(4)"}
+
+
+def test_journal_of_other_base_is_ignored(write):
+    path = write("prog.mepa", ["10 x = 1", "20 print(x)"])
+    session = loaded(path)
+    session.ins(30, "print(9)")
+    session.save()
+    # mesmo tamanho e mesma data, conteúdo diferente (cópia que preserva
+    # a data, relógio de pouca resolução...)
+    st = os.stat(path)
+    with open(path, "r+b") as f:
+        f.write(b"10 x = 7")
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns))
+
+    other = new_session()
+    warnings = other.load(path)
+    assert program_of(other) == {10: "x = 7", 20: "print(x)"}
+    assert any("não corresponde" in w for w in warnings)
+
+    # a sessão antiga não acrescenta ao diário: regrava o arquivo
+    session.ins(40, "print(4)")
+    session.save()
+    assert not os.path.exists(mepa.journal_path(path))
+    assert program_of(loaded(path)) == {10: "x = 1", 20: "print(x)",
+                                        30: "print(9)", 40: "print(4)"}
+
+
+def test_save_full_removes_journal(write):
+    path = write("prog.mepa", ["10 print(1)"])
+    session = loaded(path)
+    session.ins(20, "print(2)")
+    session.save()
+    session.ins(30, "print(3)")
+    session.save(full=True)
+    assert not os.path.exists(mepa.journal_path(path))
+    assert program_of(loaded(path)) == {10: "print(1)", 20: "print(2)",
+                                        30: "print(3)"}
+
+
+def test_journal_compaction(write, monkeypatch):
+    monkeypatch.setattr(mepa, "JOURNAL_COMPACT_MIN", 0)
+    path = write("prog.mepa", ["10 print(1)"])
+    session = loaded(path)
+    session.ins(20, "print(2)")
+    session.save()
+    assert not os.path.exists(mepa.journal_path(path))
+    with open(path, "rb") as f:
+        assert f.read() == b"10 print(1)\n20 print(2)\n"
+
+
+def test_diff_program_file(write):
+    path = write("prog.mepa", ["10 x = 1", "20 y = 2", "30 z = 3", "40 print(z)"])
+    store = loaded(path).program_lines
+    new = b"10 x = 1\n20 y = 20\n25 w = 0\n40 print(z)\n"
+    new_store, changed, removed = mepa.diff_program_file(store, new)
+    assert (changed, removed) == ([20, 25], [30])
+    assert dict(new_store.items()) == {10: "x = 1", 20: "y = 20", 25: "w = 0",
+                                       40: "print(z)"}
+
+
+def test_diff_falls_back_on_unordered_lines(write):
+    path = write("prog.mepa", ["10 x = 1", "20 print(x)"])
+    store = loaded(path).program_lines
+    assert mepa.diff_program_file(store, b"10 x = 1\n5 print(x)\n") is None
+
+
+def test_reload_keeps_unchanged_lines_compiled(write):
+    lines = [f"{10 * i} x{i} = {i}" for i in range(1, 21)] + ["300 print(x20)"]
+    path = write("prog.mepa", lines)
+    session = loaded(path)
+    session.run()
+    compiled = dict(session.compiled_lines)
+    lines[4] = "50 x5 = 50"
+    del lines[9]
+    write("prog.mepa", lines)
+    (changed, removed), warnings = session.reload()
+    assert (changed, removed, warnings) == ([50], [100], [])
+    assert all(session.compiled_lines[n] is compiled[n]
+               for n in compiled if n not in (50, 100))
+    session.run()
+    assert output_of(session) == "20\n20\n"
+    assert dict(session.stack())["x5"] == 50
+
+
+def test_watch_unchanged_file_keeps_program(write):
+    path = write("prog.mepa", ["10 print(1)"])
+    session = loaded(path)
+    session.run()
+    assert session.watch(path) == (([], []), [])
+    assert 10 in session.compiled_lines
+
+
+def test_watch_other_file_loads(write):
+    first = write("a.mepa", ["10 print(1)"])
+    second = write("b.mepa", ["10 print(2)"])
+    session = loaded(first)
+    diff, _warnings = session.watch(second)
+    assert diff is None and session.current_file == second
+
+
+def test_reload_with_journal_replays_it(write):
+    path = write("prog.mepa", ["10 x = 1", "20 print(x)"])
+    session = loaded(path)
+    session.ins(10, "x = 2")
+    session.save()
+    other = loaded(path)
+    (_changed, removed), _warnings = other.reload()
+    assert program_of(other) == {10: "x = 2", 20: "print(x)"}
+    assert removed == []
+
+
+def test_reload_without_file():
+    session = new_session()
+    with pytest.raises(mepa.InterpreterError):
+        session.reload()
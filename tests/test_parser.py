@@ -0,0 +1,69 @@
+"""Parser de expressões: precedência, associatividade e erros de sintaxe."""
+
+import pytest
+
+import mepa
+from conftest import BACKENDS
+
+
+@pytest.mark.parametrize("expr, expected", [
+    ("2 + 3 * 4", "14"),
+    ("(2 + 3) * 4", "20"),
+    ("2 ^ 3 ^ 2", "512.0"),       # '^' associa à direita
+    ("-2 ^ 2", "-4.0"),           # '^' antes do menos unário
+    ("10 - 4 - 3", "3"),          # '-' associa à esquerda
+    ("7 // 2 * 2", "6"),
+    ("1 .. 2 .. 3", "123"),       # '..' associa à direita
+    ("1 + 2 .. 3", "33"),         # '..' abaixo da aritmética
+    ("1 < 2 == true", "true"),
+    ("not nil == true", "true"),  # 'not' antes da comparação
+    ("nil or 3", "3"),
+    ("false and 1", "false"),
+    ("1 or 2 and 3", "1"),        # 'and' antes do 'or'
+    ("#{1, 2, 3} + 1", "4"),
+])
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_precedence(run, backend, expr, expected):
+    assert run([f"print({expr})"], backend) == (expected + "\n", None)
+
+
+@pytest.mark.parametrize("expr, message", [
+    ("(1", "fim inesperado da expressão"),
+    ("1 +", "fim inesperado da expressão"),
+    ("1 2", "símbolo inesperado"),
+    ("1, 2", "símbolo inesperado ','"),
+])
+def test_syntax_errors(expr, message):
+    with pytest.raises(mepa.ParseError, match=message):
+        mepa.parse_expression(expr)
+
+
+def test_constant_folding():
+    assert mepa.parse_expression("2 * 3 + 1") == ("k", 7)
+    assert mepa.parse_expression("x + 1")[0] == "bin"
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_syntax_error_reports_line(run, backend):
+    out, error = run({10: "print(1)", 20: "x = 1 +", 30: "print(2)"}, backend)
+    assert error[0] == 20 and "fim inesperado" in error[1]
+
+
+@pytest.mark.parametrize("expr", [
+    "-(" * 100000 + "y" + ")" * 100000,   # recursão do parser
+    " + ".join(["y"] * 100000),           # AST funda sem recursão
+    "{" * 300 + "}" * 300,
+])
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_nested_too_deeply(run, backend, expr):
+    out, error = run({10: "y = 1", 20: f"x = {expr}", 30: "print(1)"}, backend)
+    assert error[0] == 20 and error[1].endswith("expressão aninhada demais")
+
+
+@pytest.mark.parametrize("expr, expected", [
+    ("- " * (mepa.MAX_EXPRESSION_DEPTH - 1) + "y", "-1"),
+    (" + ".join(["y"] * mepa.MAX_EXPRESSION_DEPTH), "200"),
+])
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_nesting_within_limit(run, backend, expr, expected):
+    assert run(["y = 1", f"print({expr})"], backend) == (expected + "\n", None)
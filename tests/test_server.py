@@ -0,0 +1,158 @@
+"""Servidor (mepa.py serve): LOAD confinado ao diretório e tempo limite do RUN."""
+
+import asyncio
+import json
+import os
+
+import pytest
+
+import mepa
+
+
+def serve_requests(root: str, requests: list, timeout: float = 10.0,
+                   workers: int = 1) -> list:
+    """
+    Abre o servidor numa porta TCP livre (como 'mepa.py serve --port 0'),
+    envia os pedidos por uma conexão e devolve as respostas.
+    """
+    root = os.path.realpath(root)
+
+    async def scenario() -> list:
+        pool = mepa.RunWorkerPool(workers)
+        try:
+            await pool.start()
+
+            async def handle(reader, writer) -> None:
+                await mepa.serve_connection(reader, writer, pool, timeout,
+                                            "teste", root)
+
+            server = await asyncio.start_server(handle, "127.0.0.1", 0,
+                                                limit=mepa.SERVE_LINE_LIMIT)
+            async with server:
+                port = server.sockets[0].getsockname()[1]
+                reader, writer = await asyncio.open_connection("127.0.0.1", port)
+                replies = []
+                for request in requests:
+                    if isinstance(request, str):
+                        request = {"cmd": request}
+                    writer.write(json.dumps(request).encode() + b"\n")
+                    await writer.drain()
+                    replies.append(json.loads(await reader.readline()))
+                writer.close()
+                await writer.wait_closed()
+            return replies
+        finally:
+            pool.close()
+
+    return asyncio.run(scenario())
+
+
+@pytest.fixture
+def root(tmp_path):
+    """Diretório do servidor com um programa; ao lado, um arquivo fora dele."""
+    inside = tmp_path / "root"
+    inside.mkdir()
+    (inside / "prog.mepa").write_bytes(b"10 x = 6\n20 print(x * 7)\n")
+    (tmp_path / "secret.mepa").write_bytes(b"10 print(1)\n")
+    return str(inside)
+
+
+def test_serve_path_inside_root(root):
+    real = os.path.realpath(root)
+    assert mepa._serve_path(real, "prog.mepa") == os.path.join(real, "prog.mepa")
+    assert mepa._serve_path(real, "sub/../prog.mepa") == os.path.join(real,
+                                                                      "prog.mepa")
+
+
+@pytest.mark.parametrize("name", ["../secret.mepa", "sub/../../secret.mepa",
+                                  "..", "/etc/passwd"])
+def test_serve_path_outside_root(root, name):
+    with pytest.raises(mepa.InterpreterError, match="fora do diretório"):
+        mepa._serve_path(os.path.realpath(root), name)
+
+
+def test_serve_path_symlink_outside_root(root):
+    link = os.path.join(root, "link.mepa")
+    try:
+        os.symlink(os.path.join(os.path.dirname(root), "secret.mepa"), link)
+    except (OSError, NotImplementedError):
+        pytest.skip("sem permissão para criar links simbólicos")
+    with pytest.raises(mepa.InterpreterError, match="fora do diretório"):
+        mepa._serve_path(os.path.realpath(root), "link.mepa")
+
+
+def test_serve_path_prefix_is_not_inside(tmp_path):
+    # "/x/root2" começa com "/x/root", mas não está dentro dele
+    (tmp_path / "root").mkdir()
+    (tmp_path / "root2").mkdir()
+    with pytest.raises(mepa.InterpreterError):
+        mepa._serve_path(str(tmp_path / "root"), "../root2/prog.mepa")
+
+
+@pytest.mark.parametrize("host, expected", [
+    ("127.0.0.1", True), ("::1", True), ("localhost", True),
+    ("0.0.0.0", False), ("192.168.0.10", False), ("example.com", False),
+])
+def test_is_loopback(host, expected):
+    assert mepa.is_loopback(host) is expected
+
+
+def test_load_and_run(root):
+    replies = serve_requests(root, [
+        "LOAD prog.mepa",
+        "RUN",
+        "RUN VM",
+        {"cmd": "STACK", "id": 7},
+        "LOAD ../secret.mepa",
+        "LIST",
+    ])
+    load, run, run_vm, stack, outside, listing = replies
+    assert load == {"ok": True, "lines": 2, "warnings": []}
+    assert run["ok"] and run["output"] == "42\n"
+    assert run_vm["ok"] and run_vm["output"] == "42\n"
+    assert stack == {"id": 7, "ok": True, "variables": [["x", 6]]}
+    assert not outside["ok"] and "fora do diretório" in outside["error"]
+    # o LOAD recusado não troca o programa da sessão
+    assert listing["lines"] == [[10, "x = 6"], [20, "print(x * 7)"]]
+
+
+def test_run_timeout_replaces_worker(root):
+    replies = serve_requests(root, [
+        "INS 10 x = 0",
+        "INS 20 while true do",
+        "INS 30 x = x + 1",
+        "INS 40 end",
+        {"cmd": "RUN", "timeout": 0.5},
+        "DEL 20 40",
+        "INS 50 print(x + 1)",
+        "RUN",
+    ], timeout=5.0)
+    timed_out, after = replies[4], replies[7]
+    assert timed_out["ok"] is False and timed_out["timeout"] is True
+    assert "Tempo limite" in timed_out["error"]
+    # o processo encerrado foi substituído: o próximo RUN funciona
+    assert after["ok"] and after["output"] == "1\n"
+
+
+def test_timeout_limited_by_server(root):
+    # o cliente não pode pedir mais tempo do que o servidor permite
+    replies = serve_requests(root, [
+        "INS 10 while true do",
+        "INS 20 end",
+        {"cmd": "RUN", "timeout": 60},
+    ], timeout=0.5)
+    assert replies[2]["timeout"] is True
+
+
+def test_bad_requests(root):
+    replies = serve_requests(root, [
+        {"nada": 1},
+        {"cmd": 3},
+        "INS 99999999999999999999 print(1)",
+        "RUN",
+        "FOO",
+    ])
+    assert all(not reply["ok"] for reply in replies)
+    assert replies[0]["error"].startswith("Pedido inválido")
+    assert replies[2]["error"].startswith("Uso: INS")
+    assert replies[3]["error"] == "Nenhum programa carregado."